@@ -0,0 +1,219 @@
+"""
+End-to-end throughput benchmark of the invoice pipeline (run_invoice_pipeline, as behind POST /process-invoice)
+Generates synthetic invoices (see synthetic_invoices.py) or reads a generated directory, processes them
+and reports pages/s, invoices/s, p50/p95 latency, item recall and peak RSS per layout and overall.
+With --first-pass-dpi, PDF pages are OCR'd with adaptive DPI and the pages escalated to full resolution are counted.
+Page I/O per page - rasterizing (convert_to_images) and handing the page to tesseract (page_io) - is reported next to
+the tesseract time, so runs with and without --page-files-dir (e.g. /dev/shm) can be compared.
+
+    python benchmarks/benchmark.py --invoices 3 --photos
+    python benchmarks/benchmark.py --data bench-data --concurrency 2 --json baseline.json
+    python benchmarks/benchmark.py --data bench-data --first-pass-dpi 150 --json adaptive.json
+    python benchmarks/benchmark.py --data bench-data --page-files-dir /dev/shm --json page-files.json
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import argparse
+import base64
+import json
+import logging
+import math
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import main as service
+import synthetic_invoices
+
+def load_invoices(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Benchmark cases: file bytes, file name, template and expected items"""
+    cases = []
+    if args.data:
+        with open(os.path.join(args.data, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        for entry in manifest:
+            for kind, file_name in entry['files'].items():
+                if kind == 'photo' and not args.photos:
+                    continue
+                with open(os.path.join(args.data, file_name), 'rb') as f:
+                    file_bytes = f.read()
+                expected = entry['items'][:entry['first_page_items']] if kind == 'photo' else entry['items']
+                cases.append({
+                    'layout': entry['layout'],
+                    'file_name': file_name,
+                    'file_bytes': file_bytes,
+                    'template_config': entry['template_config'],
+                    'items': expected,
+                })
+        return cases
+
+    rng = random.Random(args.seed)
+    font = synthetic_invoices.load_font()
+    for layout in args.layouts.split(','):
+        for n in range(1, args.invoices + 1):
+            invoice = synthetic_invoices.generate_invoice(layout, rng, rng.randint(args.min_lines, args.max_lines))
+            pages = [synthetic_invoices.render_page(lines, font) for lines in invoice.pages]
+            cases.append({
+                'layout': layout,
+                'file_name': f"{layout}_{n}.pdf",
+                'file_bytes': synthetic_invoices.to_pdf(pages),
+                'template_config': synthetic_invoices.template_config(layout),
+                'items': invoice.items,
+            })
+            if args.photos:
+                cases.append({
+                    'layout': layout,
+                    'file_name': f"{layout}_{n}_photo.jpg",
+                    'file_bytes': synthetic_invoices.to_photo(pages[0], rng),
+                    'template_config': synthetic_invoices.template_config(layout),
+                    'items': invoice.items[:synthetic_invoices.LINES_PER_PAGE],
+                })
+    return cases
+
+def matched_items(expected: List[Dict[str, Any]], items: List[service.InvoiceItem]) -> int:
+    """Expected items found with the same quantity and unit price"""
+    found = [(round(item.quantity, 2), round(item.unit_price, 2)) for item in items]
+    matched = 0
+    for item in expected:
+        key = (round(item['quantity'], 2), round(item['unit_price'], 2))
+        if key in found:
+            found.remove(key)
+            matched += 1
+    return matched
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    request = service.ProcessInvoiceRequest(
+        file_base64=base64.b64encode(case['file_bytes']).decode(),
+        file_name=case['file_name'],
+        template_config=case['template_config'],
+        include_raw_text=False,
+    )
+    pages = {}
+    started = time.perf_counter()
+    try:
+        result = service.run_invoice_pipeline(request, progress=lambda done, total: pages.update(total=total))
+        error = None
+    except Exception as e:
+        result, error = None, str(getattr(e, 'detail', e))
+    return {
+        'layout': case['layout'],
+        'file_name': case['file_name'],
+        'seconds': time.perf_counter() - started,
+        'pages': pages.get('total', 0),
+        'items_expected': len(case['items']),
+        'items_matched': matched_items(case['items'], result.items) if result else 0,
+        'escalated_pages': len(result.escalated_pages or []) if result else 0,
+        'error': error,
+    }
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+def summarize(results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Throughput over wall_seconds - the whole run overall, the layout's own processing time per layout"""
+    latencies = [result['seconds'] for result in results]
+    expected = sum(result['items_expected'] for result in results)
+    return {
+        'invoices': len(results),
+        'pages': sum(result['pages'] for result in results),
+        'errors': sum(1 for result in results if result['error']),
+        'invoices_per_second': round(len(results) / wall_seconds, 3) if wall_seconds else 0,
+        'pages_per_second': round(sum(result['pages'] for result in results) / wall_seconds, 3) if wall_seconds else 0,
+        'p50_seconds': round(percentile(latencies, 50), 3),
+        'p95_seconds': round(percentile(latencies, 95), 3),
+        'item_recall': round(sum(result['items_matched'] for result in results) / expected, 3) if expected else None,
+        'escalated_pages': sum(result['escalated_pages'] for result in results),
+    }
+
+IO_STAGES = ['convert_to_images', 'page_io', 'tesseract']
+
+def stage_ms_per_page(before: Dict[str, Any], after: Dict[str, Any], pages: int) -> Dict[str, float]:
+    """Milliseconds per page spent in each of IO_STAGES between two ocr_stage_seconds snapshots"""
+    return {
+        stage: round((after.get(stage, (0, 0.0))[1] - before.get(stage, (0, 0.0))[1]) * 1000 / pages, 2) if pages else 0.0
+        for stage in IO_STAGES
+    }
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of the service process (tesseract and poppler run as separate processes)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def print_report(report: Dict[str, Any]) -> None:
+    columns = ['invoices', 'pages', 'errors', 'invoices_per_second', 'pages_per_second', 'p50_seconds', 'p95_seconds', 'item_recall', 'escalated_pages']
+    print(f"{'layout':<12}" + ''.join(f"{column:>20}" for column in columns))
+    for layout, summary in list(report['layouts'].items()) + [('ALL', report['overall'])]:
+        print(f"{layout:<12}" + ''.join(f"{str(summary[column]):>20}" for column in columns))
+    print('ms per page: ' + ', '.join(f"{stage} {ms}" for stage, ms in report['stage_ms_per_page'].items()))
+    print(f"wall time: {report['wall_seconds']} s, peak RSS: {report['peak_rss_mb']} MB")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', help='Directory written by synthetic_invoices.py (default: generate in memory)')
+    parser.add_argument('--layouts', default=','.join(synthetic_invoices.LAYOUTS))
+    parser.add_argument('--invoices', type=int, default=2, help='Invoices per layout when generating')
+    parser.add_argument('--min-lines', type=int, default=5)
+    parser.add_argument('--max-lines', type=int, default=60)
+    parser.add_argument('--photos', action='store_true', help='Include phone-photo images')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1, help='Process the whole set this many times')
+    parser.add_argument('--concurrency', type=int, default=1, help='Invoices processed at once')
+    parser.add_argument('--first-pass-dpi', type=int, help='Adaptive DPI first pass resolution (default: OCR_FIRST_PASS_DPI, 0 = off)')
+    parser.add_argument('--page-files-dir', help='Directory for intermediate page files (default: OCR_PAGE_FILES_DIR, empty = in memory)')
+    parser.add_argument('--no-warmup', action='store_true', help='Include first-use costs in the numbers')
+    parser.add_argument('--json', help='Write the report to this file')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.first_pass_dpi is not None:
+        service.FIRST_PASS_DPI = args.first_pass_dpi
+    if args.page_files_dir is not None:
+        service.PAGE_FILES_DIR = args.page_files_dir
+    cases = load_invoices(args)
+    if not args.no_warmup:
+        service.warm_up()
+
+    stages_before = service.metrics.histogram_totals('ocr_stage_seconds', 'stage')
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(run_case, cases * args.repeat))
+    wall_seconds = time.perf_counter() - started
+    stages_after = service.metrics.histogram_totals('ocr_stage_seconds', 'stage')
+
+    report = {
+        'settings': {
+            'concurrency': args.concurrency,
+            'repeat': args.repeat,
+            'page_workers': service.PAGE_WORKERS,
+            'render_dpi': service.RENDER_DPI,
+            'first_pass_dpi': service.FIRST_PASS_DPI,
+            'page_files_dir': service.PAGE_FILES_DIR,
+        },
+        'layouts': {
+            layout: summarize(layout_results, sum(result['seconds'] for result in layout_results) / args.concurrency)
+            for layout, layout_results in (
+                (layout, [result for result in results if result['layout'] == layout])
+                for layout in dict.fromkeys(case['layout'] for case in cases)
+            )
+        },
+        'overall': summarize(results, wall_seconds),
+        'stage_ms_per_page': stage_ms_per_page(stages_before, stages_after, sum(result['pages'] for result in results)),
+        'peak_rss_mb': peak_rss_mb(),
+        'wall_seconds': round(wall_seconds, 3),
+        'failures': [result for result in results if result['error']],
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""
+Closed-loop load test of the HTTP service
+Starts uvicorn with the app locally (or targets --url), sends POST /process-invoice requests with
+synthetic invoices at rising concurrency - every client sends its next request as soon as the
+previous one is answered - and records throughput, latency percentiles, error and 429 rates and the
+server's CPU and RSS (uvicorn plus its tesseract / poppler children, from /proc).
+
+    python benchmarks/load_test.py --concurrency 1,2,4,8 --duration 60 --json run-a.json
+    python benchmarks/load_test.py --env OCR_MAX_CONCURRENT=4 --label max4 --json run-b.json
+    python benchmarks/load_test.py --compare run-a.json run-b.json
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import synthetic_invoices
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+SAMPLE_SECONDS = 0.5  # Server CPU / RSS sampling interval
+
+def build_requests(args: argparse.Namespace) -> List[bytes]:
+    """JSON bodies of the fixture set (generated, or read from a synthetic_invoices.py directory)"""
+    invoices: List[Tuple[str, bytes, Dict[str, Any]]] = []
+    if args.data:
+        with open(os.path.join(args.data, 'manifest.json'), encoding='utf-8') as f:
+            for entry in json.load(f):
+                for kind, file_name in entry['files'].items():
+                    if kind == 'photo' and not args.photos:
+                        continue
+                    with open(os.path.join(args.data, file_name), 'rb') as invoice_file:
+                        invoices.append((file_name, invoice_file.read(), entry['template_config']))
+    else:
+        rng = random.Random(args.seed)
+        font = synthetic_invoices.load_font()
+        for layout in args.layouts.split(','):
+            for n in range(1, args.invoices + 1):
+                invoice = synthetic_invoices.generate_invoice(layout, rng, rng.randint(args.min_lines, args.max_lines))
+                pages = [synthetic_invoices.render_page(lines, font) for lines in invoice.pages]
+                config = synthetic_invoices.template_config(layout)
+                invoices.append((f"{layout}_{n}.pdf", synthetic_invoices.to_pdf(pages), config))
+                if args.photos:
+                    invoices.append((f"{layout}_{n}_photo.jpg", synthetic_invoices.to_photo(pages[0], rng), config))
+    return [
+        json.dumps({
+            'file_base64': base64.b64encode(file_bytes).decode(),
+            'file_name': file_name,
+            'template_config': config,
+            'include_raw_text': False,
+        }).encode()
+        for file_name, file_bytes, config in invoices
+    ]
+
+class ProcessSampler:
+    """CPU time and RSS of a process tree, sampled from /proc in a background thread"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._stop = threading.Event()
+        self._rss_samples: List[int] = []
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _stat(pid: int) -> List[str]:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()
+
+    def _tree(self) -> List[int]:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    children.setdefault(int(self._stat(int(entry))[1]), []).append(int(entry))
+                except (OSError, IndexError):
+                    continue
+        tree, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            tree.append(pid)
+            pending.extend(children.get(pid, []))
+        return tree
+
+    def cpu_seconds(self) -> float:
+        """User + system time of the server, including its finished children"""
+        fields = self._stat(self.pid)
+        return sum(int(value) for value in fields[11:15]) / CLOCK_TICKS  # utime, stime, cutime, cstime
+
+    def _rss_bytes(self) -> int:
+        rss = 0
+        for pid in self._tree():
+            try:
+                rss += int(self._stat(pid)[21]) * PAGE_SIZE
+            except (OSError, IndexError):
+                continue
+        return rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(SAMPLE_SECONDS):
+            self._rss_samples.append(self._rss_bytes())
+
+    def start(self) -> None:
+        self._rss_samples = [self._rss_bytes()]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Dict[str, float]:
+        self._stop.set()
+        self._thread.join()
+        return {
+            'rss_peak_mb': round(max(self._rss_samples) / 2 ** 20, 1),
+            'rss_mean_mb': round(sum(self._rss_samples) / len(self._rss_samples) / 2 ** 20, 1),
+        }
+
+def start_server(port: int, env: Dict[str, str]) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=SERVICE_DIR,
+        env={**os.environ, **env},
+    )
+    deadline = time.monotonic() + 180
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=2):
+                return server
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.5)
+    server.kill()
+    raise RuntimeError("Server did not become ready in time")
+
+def send(url: str, body: bytes, timeout: float) -> Tuple[int, float, float]:
+    """(HTTP status, latency seconds, Retry-After seconds); status 0 for connection errors and timeouts"""
+    request = urllib.request.Request(f"{url}/process-invoice", data=body, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    retry_after = 0.0
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+        retry_after = float(e.headers.get('Retry-After') or 0)
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        status = 0
+    return status, time.perf_counter() - started, retry_after
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+def run_level(url: str, bodies: List[bytes], concurrency: int, duration: float, timeout: float,
+              sampler: Optional[ProcessSampler]) -> Dict[str, Any]:
+    """concurrency clients in a closed loop for duration seconds - a rejected client waits Retry-After, like a real caller"""
+    results: List[Tuple[int, float]] = []
+    lock = threading.Lock()
+    next_body = iter(range(10 ** 9))
+    stop_at = time.monotonic() + duration
+
+    def client() -> None:
+        while time.monotonic() < stop_at:
+            with lock:
+                body = bodies[next(next_body) % len(bodies)]
+            status, latency, retry_after = send(url, body, timeout)
+            with lock:
+                results.append((status, latency))
+            if status == 429:
+                time.sleep(max(min(retry_after, stop_at - time.monotonic()), 0))
+
+    cpu_before = sampler.cpu_seconds() if sampler else None
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    elapsed = time.perf_counter() - started
+
+    ok = [latency for status, latency in results if status == 200]
+    level = {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'throughput_rps': round(len(ok) / elapsed, 3),
+        'p50_seconds': round(percentile(ok, 50), 3),
+        'p95_seconds': round(percentile(ok, 95), 3),
+        'p99_seconds': round(percentile(ok, 99), 3),
+        'error_rate': round(sum(1 for status, _ in results if status not in (200, 429)) / len(results), 3) if results else 0,
+        'rate_429': round(sum(1 for status, _ in results if status == 429) / len(results), 3) if results else 0,
+    }
+    if sampler:
+        level.update(sampler.stop())
+        level['cpu_cores'] = round((sampler.cpu_seconds() - cpu_before) / elapsed, 2)
+    return level
+
+LEVEL_COLUMNS = ['requests', 'throughput_rps', 'p50_seconds', 'p95_seconds', 'p99_seconds', 'error_rate', 'rate_429', 'cpu_cores', 'rss_peak_mb']
+
+def print_header() -> None:
+    print(f"{'clients':>8}" + ''.join(f"{column:>16}" for column in LEVEL_COLUMNS))
+
+def print_level(level: Dict[str, Any]) -> None:
+    print(f"{level['concurrency']:>8}" + ''.join(f"{str(level.get(column, '-')):>16}" for column in LEVEL_COLUMNS))
+
+def compare(paths: List[str]) -> None:
+    """Side by side throughput / p95 / CPU / RSS per concurrency level, relative to the first run"""
+    runs = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            runs.append(json.load(f))
+    base = {level['concurrency']: level for level in runs[0]['levels']}
+    for run in runs:
+        print(f"\n{run['label']}  {run['server_env']}")
+        print(f"{'clients':>8}{'rps':>10}{'vs base':>10}{'p95 s':>10}{'vs base':>10}{'429':>8}{'errors':>8}{'cpu':>8}{'rss MB':>10}")
+        for level in run['levels']:
+            reference = base.get(level['concurrency'])
+
+            def delta(key: str) -> str:
+                if not reference or not reference[key]:
+                    return '-'
+                return f"{(level[key] / reference[key] - 1) * 100:+.0f}%"
+
+            print(f"{level['concurrency']:>8}{level['throughput_rps']:>10}{delta('throughput_rps'):>10}"
+                  f"{level['p95_seconds']:>10}{delta('p95_seconds'):>10}{level['rate_429']:>8}{level['error_rate']:>8}"
+                  f"{str(level.get('cpu_cores', '-')):>8}{str(level.get('rss_peak_mb', '-')):>10}")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--compare', nargs='+', metavar='REPORT', help='Compare JSON reports instead of running')
+    parser.add_argument('--url', help='Target a running server instead of starting one (no CPU / RSS numbers)')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='Server environment, e.g. OCR_MAX_CONCURRENT=4')
+    parser.add_argument('--concurrency', default='1,2,4,8', help='Client counts to step through')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per concurrency level')
+    parser.add_argument('--timeout', type=float, default=120, help='Client timeout per request')
+    parser.add_argument('--data', help='Directory written by synthetic_invoices.py (default: generate)')
+    parser.add_argument('--layouts', default=','.join(synthetic_invoices.LAYOUTS))
+    parser.add_argument('--invoices', type=int, default=1, help='Invoices per layout when generating')
+    parser.add_argument('--min-lines', type=int, default=5)
+    parser.add_argument('--max-lines', type=int, default=60)
+    parser.add_argument('--photos', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', help='Name of this run in reports (default: the server env)')
+    parser.add_argument('--json', help='Write the report to this file')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    server_env = dict(item.split('=', 1) for item in args.env)
+    bodies = build_requests(args)
+    server = None
+    sampler = None
+    url = args.url
+    if not url:
+        server = start_server(args.port, server_env)
+        sampler = ProcessSampler(server.pid)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        levels = []
+        print_header()
+        for concurrency in (int(value) for value in args.concurrency.split(',')):
+            levels.append(run_level(url, bodies, concurrency, args.duration, args.timeout, sampler))
+            print_level(levels[-1])
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        'label': args.label or (' '.join(args.env) or 'default'),
+        'server_env': server_env,
+        'cpu_count': os.cpu_count(),
+        'fixtures': len(bodies),
+        'duration_per_level': args.duration,
+        'levels': levels,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+OCR-free parsing benchmark and regression gate
+Runs the parsing stages of the pipeline (fix_ocr_errors / clean_ocr_text, template compilation and
+extract_line_items) on golden OCR texts in benchmarks/fixtures - one per display_layout, with the
+items they must yield - so parsing can be timed and checked without tesseract. The item stage is also
+reported as memory allocated per call (peak, traced with tracemalloc).
+
+    python benchmarks/parsing_benchmark.py                    # time all fixtures
+    python benchmarks/parsing_benchmark.py --save-baseline    # record this machine's timings
+    python benchmarks/parsing_benchmark.py --check            # fail on changed items or slower parsing
+    python benchmarks/parsing_benchmark.py --update           # accept the current items as golden
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import main as service
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'parsing_baseline.json')  # Machine specific, not committed
+
+STAGES = ['fix_ocr_errors', 'clean_ocr_text', 'extract_line_items', 'parse']
+
+def load_fixtures(layouts: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """<layout>.txt (raw OCR text with page markers) + <layout>.json (template_config, expected items)"""
+    fixtures = []
+    for text_path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.txt'))):
+        layout = os.path.splitext(os.path.basename(text_path))[0]
+        if layouts and layout not in layouts:
+            continue
+        with open(text_path, encoding='utf-8') as f:
+            raw_text = f.read()
+        with open(os.path.join(FIXTURES_DIR, f"{layout}.json"), encoding='utf-8') as f:
+            expected = json.load(f)
+        fixtures.append({'layout': layout, 'raw_text': raw_text, **expected})
+    return fixtures
+
+def extract_items(text: str, template_config: Dict[str, Any]) -> List[service.ParsedItem]:
+    """Template compilation and line item extraction, as run_invoice_pipeline does per request"""
+    compiled = service.CompiledTemplate(template_config)
+    return service.extract_line_items(text, compiled.config, compiled.language, compiled.psm, compiled)
+
+def parse(raw_text: str, template_config: Dict[str, Any]) -> List[service.ParsedItem]:
+    return extract_items(service.clean_ocr_text(raw_text), template_config)
+
+def seconds_per_call(func: Callable[[], Any], repeat: int) -> float:
+    """Best of `repeat` rounds, each long enough (~0.2 s) to time reliably"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+def allocated_kib(func: Callable[[], Any]) -> float:
+    """Peak memory allocated by one call (after a warm-up call, so caches are not counted)"""
+    func()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+def time_fixture(fixture: Dict[str, Any], repeat: int) -> Dict[str, float]:
+    raw_text, template_config = fixture['raw_text'], fixture['template_config']
+    cleaned = service.clean_ocr_text(raw_text)
+    stages = {
+        'fix_ocr_errors': lambda: service.fix_ocr_errors(raw_text),
+        'clean_ocr_text': lambda: service.clean_ocr_text(raw_text),  # Includes fix_ocr_errors
+        'extract_line_items': lambda: extract_items(cleaned, template_config),
+        'parse': lambda: parse(raw_text, template_config),
+    }
+    timings = {stage: seconds_per_call(stages[stage], repeat) for stage in STAGES}
+    timings['extract_line_items_kib'] = allocated_kib(stages['extract_line_items'])
+    return timings
+
+def changed_items(fixture: Dict[str, Any], items: List[Dict[str, Any]]) -> Optional[str]:
+    """Description of the first difference from the golden items (None if identical)"""
+    expected = fixture['items']
+    if len(items) != len(expected):
+        return f"{len(items)} items instead of {len(expected)}"
+    for index, (item, expected_item) in enumerate(zip(items, expected)):
+        if item != expected_item:
+            fields = {field: (expected_item.get(field), value) for field, value in item.items() if expected_item.get(field) != value}
+            return f"item {index}: " + ', '.join(f"{field} {old!r} -> {new!r}" for field, (old, new) in fields.items())
+    return None
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layouts', help='Comma separated fixtures to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing rounds per stage (best is reported)')
+    parser.add_argument('--check', action='store_true', help='Exit 1 if items changed or parsing got slower than the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the baseline (0.25 = 25%%)')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='Store the timings as the baseline')
+    parser.add_argument('--update', action='store_true', help='Store the current items as the golden items')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.ERROR)
+    fixtures = load_fixtures(args.layouts.split(',') if args.layouts else None)
+    baseline = {}
+    if args.check and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    failures = []
+    timings = {}
+    print(f"{'layout':<12}{'items':>7}" + ''.join(f"{stage + ' ms':>22}" for stage in STAGES) + f"{'items/s':>12}{'items KiB':>12}")
+    for fixture in fixtures:
+        layout = fixture['layout']
+        items = [service.to_invoice_item(item).model_dump(exclude={'ingredient_candidates'}) for item in parse(fixture['raw_text'], fixture['template_config'])]
+        if args.update:
+            with open(os.path.join(FIXTURES_DIR, f"{layout}.json"), 'w', encoding='utf-8') as f:
+                json.dump({'template_config': fixture['template_config'], 'items': items}, f, ensure_ascii=False, indent=1)
+                f.write('\n')
+        else:
+            change = changed_items(fixture, items)
+            if change:
+                failures.append(f"{layout}: {change}")
+
+        timings[layout] = time_fixture(fixture, args.repeat)
+        parse_seconds = timings[layout]['parse']
+        print(f"{layout:<12}{len(items):>7}" + ''.join(f"{timings[layout][stage] * 1000:>22.3f}" for stage in STAGES)
+              + f"{len(items) / parse_seconds:>12.0f}{timings[layout]['extract_line_items_kib']:>12.1f}")
+
+        baseline_seconds = baseline.get(layout, {}).get('parse')
+        if baseline_seconds and parse_seconds > baseline_seconds * (1 + args.tolerance):
+            failures.append(f"{layout}: parse {parse_seconds * 1000:.3f} ms, baseline {baseline_seconds * 1000:.3f} ms")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(timings, f, indent=1)
+        print(f"Baseline written to {args.baseline}")
+    if args.check:
+        if not baseline:
+            print(f"No baseline at {args.baseline} - only items were checked")
+        for failure in failures:
+            print(f"FAIL {failure}")
+        return 1 if failures else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
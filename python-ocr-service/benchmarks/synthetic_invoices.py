@@ -0,0 +1,273 @@
+"""
+Synthetic invoice generator for benchmarks
+Renders invoices in the line formats of every supported display_layout as scanned-like PDFs
+and phone-photo-like JPEGs, together with the items each invoice should yield.
+
+    python benchmarks/synthetic_invoices.py --out bench-data --invoices 3 --photos
+"""
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+from typing import Any, Callable, Dict, List, Tuple
+import argparse
+import io
+import json
+import os
+import random
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'src', 'assets', 'fonts', 'Roboto-Regular.ttf')
+
+RENDER_DPI = 200  # Resolution of the generated page images (A4)
+LINES_PER_PAGE = 34  # Item lines that fit on one page below the header
+
+PRODUCTS = [
+    'Mouka pšeničná hladká', 'Mouka žitná chlebová', 'Cukr krystal', 'Cukr moučka', 'Sůl jemná',
+    'Máslo', 'Tuk pekařský', 'Droždí čerstvé', 'Vejce slepičí', 'Mléko polotučné',
+    'Tvaroh měkký', 'Maková náplň', 'Povidla švestková', 'Kakao tmavé', 'Vlašské ořechy',
+    'Rozinky', 'Skořice mletá', 'Vanilkový cukr', 'Olej řepkový', 'Sezam loupaný',
+]
+
+def czech_number(value: float, decimals: int = 2) -> str:
+    """1603.5 -> '1 603,50' (space thousands separator, decimal comma)"""
+    text = f"{value:,.{decimals}f}"
+    return text.replace(',', ' ').replace('.', ',')
+
+# Item line generators per display_layout: (rng, line_number) -> (text lines, expected item)
+
+def makro_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    code = str(rng.randint(100000, 999999))
+    quantity = rng.randint(1, 12)
+    price = round(rng.uniform(9, 250), 2)
+    total = round(quantity * price, 2)
+    vat = round(total * 0.12, 2)
+    line = (f"{code} {quantity} {rng.choice(PRODUCTS).upper()} {czech_number(price)} 1 {czech_number(price)} "
+            f"{czech_number(total)} 12,0 {czech_number(vat)} {czech_number(total + vat)}")
+    return [line], {'product_code': code, 'quantity': quantity, 'unit_price': price}
+
+def backaldrin_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    code = f"0{rng.randint(2000000, 2999999)}"
+    quantity = rng.choice([25, 50, 75, 100])
+    price = round(rng.uniform(40, 200), 3)
+    total = round(quantity * price, 2)
+    line = f"{code} {rng.choice(PRODUCTS)} 25 kg {quantity} kg {czech_number(price, 3)} {czech_number(total)} 12%"
+    return [line], {'product_code': code, 'quantity': quantity, 'unit_price': price}
+
+def dekos_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    code = f"{rng.randint(1, 40)}.{rng.randint(1000, 9999)}"
+    quantity = rng.randint(1, 30)
+    price = round(rng.uniform(1, 600), 4)
+    total = round(quantity * price, 2)
+    line = f"{code} {rng.choice(PRODUCTS)} {czech_number(price, 4)} {czech_number(quantity, 3)} {rng.choice(['ks', 'bal'])} 21 {czech_number(total)}"
+    return [line], {'product_code': code, 'quantity': quantity, 'unit_price': price}
+
+def leco_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    code = str(rng.randint(100, 999))
+    quantity = rng.randint(1, 20)
+    price = round(rng.uniform(20, 250), 2)
+    amount = round(quantity * price, 2)
+    vat = round(amount * 0.12, 2)
+    line = (f"{code} {rng.choice(PRODUCTS)} {quantity} ks {czech_number(price)} {czech_number(amount)} "
+            f"12 {czech_number(vat)} {czech_number(amount + vat)}")
+    return [line], {'product_code': code, 'quantity': quantity, 'unit_price': price}
+
+def pesek_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    code = f"0{rng.randint(100, 999)}"
+    quantity = rng.choice([10, 25, 50])
+    price = round(rng.uniform(5, 40), 2)
+    total = round(quantity * price, 2)
+    lines = [rng.choice(PRODUCTS), f"{code} {quantity}kg {czech_number(price)} 12 % {czech_number(total)}"]
+    return lines, {'product_code': code, 'quantity': quantity, 'unit_price': price}
+
+def goodmills_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    code = str(rng.randint(510000, 519999))
+    quantity = round(rng.uniform(500, 9000), 2)
+    price = round(rng.uniform(6, 12), 4)
+    total = round(quantity * price, 2)
+    lines = [
+        f"{code} 12% {quantity:.2f} KG {price:.4f} {total:.2f}",
+        f"Pš.m.{rng.choice(PRODUCTS)} volná",
+        "Vyrobeno: 21/10/2025, DMT: 22/07/2026",
+    ]
+    return lines, {'product_code': code, 'quantity': quantity, 'unit_price': price}
+
+def albert_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    name = rng.choice(PRODUCTS).upper()
+    price = round(rng.uniform(10, 150), 2)
+    if rng.random() < 0.25:
+        # Multi-piece purchase: "2 x 69,90 Kč" on the next line
+        quantity = rng.randint(2, 5)
+        lines = [f"{name} {rng.randint(100, 2500)} 1", f"{quantity} x {czech_number(price)} Kč {czech_number(quantity * price)} A"]
+    else:
+        quantity = 1
+        lines = [f"{name} {rng.randint(100, 2500)} {czech_number(price)} A"]
+    return lines, {'description': name, 'quantity': quantity, 'unit_price': price}
+
+def fabio_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    quantity = rng.randint(1, 20)
+    price = round(rng.uniform(50, 900), 4)
+    amount = round(quantity * price, 2)
+    total = round(amount * 1.12, 2)
+    line = (f"{rng.choice(PRODUCTS)} {rng.choice([5, 10, 15, 25])} kg {czech_number(quantity)} ks {czech_number(price, 4)} "
+            f"{czech_number(amount)} 12 {czech_number(total)}")
+    return [line], {'quantity': quantity, 'unit_price': price}
+
+def zeelandia_item(rng: random.Random, n: int) -> Tuple[List[str], Dict[str, Any]]:
+    code = f"000{rng.randint(1000, 9999)}"
+    packages = rng.randint(1, 15)
+    package_kg = rng.choice([1, 5, 10, 11])
+    quantity = packages * package_kg
+    price = round(rng.uniform(30, 400), 2)
+    total = round(quantity * price, 2)
+    line = (f"{code} {rng.choice(PRODUCTS)} {package_kg}kg {packages} BKT {czech_number(package_kg)} KG "
+            f"{czech_number(quantity)} KG {czech_number(price)} {czech_number(total)} CZ 12%")
+    # Quantity is the number of packages, the price is per KG
+    return [line], {'product_code': code, 'quantity': packages, 'unit_price': price}
+
+INVOICE_NUMBER = 'Faktura č. {number}'
+ISSUE_DATE = 'Datum vystavení: {date}'
+
+# display_layout -> (first page header lines, item generator, lines after the items)
+# The header ends where the item table starts
+LAYOUTS: Dict[str, Tuple[List[str], Callable[[random.Random, int], Tuple[List[str], Dict[str, Any]]], List[str]]] = {
+    'makro': (['MAKRO Cash & Carry CR s.r.o.', 'Faktura č./ VS: {number}', ISSUE_DATE], makro_item, []),
+    'backaldrin': (
+        ['backaldrin s.r.o.', INVOICE_NUMBER, ISSUE_DATE, 'Předmět zdanitelného plnění Množství / j. v CZK bez bez DPH DPH'],
+        backaldrin_item,
+        ['Částky v CZK']
+    ),
+    'dekos': (['DEKOS s.r.o.', 'DAŇOVÝ DOKLAD - faktura č. {number}', ISSUE_DATE, 'Forma úhrady: převodem'], dekos_item, ['FAKTURA č. {number}']),
+    'le-co': (['LE-CO', INVOICE_NUMBER, ISSUE_DATE], leco_item, []),
+    'pesek': (['Pešek - Rambousek s.r.o.', INVOICE_NUMBER, ISSUE_DATE], pesek_item, []),
+    'goodmills': (['GoodMills Česko spol. s r.o.', INVOICE_NUMBER, ISSUE_DATE], goodmills_item, []),
+    'albert': (['Albert Česká republika, s.r.o.', INVOICE_NUMBER, ISSUE_DATE], albert_item, []),
+    'fabio': (['FABIO PRODUKT spol. s r.o.', 'Dodací list', INVOICE_NUMBER, ISSUE_DATE], fabio_item, []),
+    'zeelandia': (['Zeelandia spol. s r.o.', INVOICE_NUMBER, ISSUE_DATE], zeelandia_item, []),
+}
+
+class SyntheticInvoice:
+    """Text lines per page of one generated invoice and the items it should yield"""
+
+    def __init__(self, layout: str, invoice_number: str, pages: List[List[str]], items: List[Dict[str, Any]]):
+        self.layout = layout
+        self.invoice_number = invoice_number
+        self.pages = pages
+        self.items = items
+
+    @property
+    def text(self) -> str:
+        return '\n'.join('\n'.join(lines) for lines in self.pages)
+
+def template_config(layout: str) -> Dict[str, Any]:
+    """Minimal template for a generated invoice - table formats are picked by display_layout"""
+    return {
+        'display_layout': layout,
+        'patterns': {
+            'invoice_number': r'Faktura\s+č\.\s*(\d+)',
+            'date': r'Datum vystavení:\s*(\d{1,2}\.\d{1,2}\.\d{4})',
+        },
+    }
+
+def generate_invoice(layout: str, rng: random.Random, line_count: int) -> SyntheticInvoice:
+    """Invoice with line_count items, split over as many pages as needed"""
+    header_lines, item_line, footer_lines = LAYOUTS[layout]
+    invoice_number = str(rng.randint(250000000, 259999999))
+    date = f"{rng.randint(1, 28)}.{rng.randint(1, 12)}.2025"
+    header = [line.format(number=invoice_number, date=date) for line in header_lines]
+
+    item_lines: List[List[str]] = []
+    items = []
+    for n in range(1, line_count + 1):
+        lines, item = item_line(rng, n)
+        item_lines.append(lines)
+        items.append(item)
+
+    pages = []
+    for start in range(0, max(line_count, 1), LINES_PER_PAGE):
+        page = list(header) if start == 0 else [f"{header[0]} - pokračování"]
+        for lines in item_lines[start:start + LINES_PER_PAGE]:
+            page.extend(lines)
+        pages.append(page)
+    total = sum(item['quantity'] * item['unit_price'] for item in items)
+    pages[-1].extend(line.format(number=invoice_number) for line in footer_lines)
+    pages[-1].extend(['', f"Celkem k úhradě: {czech_number(total * 1.12)} Kč"])
+    return SyntheticInvoice(layout, invoice_number, pages, items)
+
+def render_page(lines: List[str], font: ImageFont.FreeTypeFont, dpi: int = RENDER_DPI) -> Image.Image:
+    """A4 page with the lines typeset left aligned, as a scanner would deliver it"""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    margin = int(0.6 * dpi)
+    line_height = int(font.size * 1.45)
+    y = margin
+    for line in lines:
+        draw.text((margin, y), line, font=font, fill=0)
+        y += line_height
+    return image
+
+def to_pdf(pages: List[Image.Image], dpi: int = RENDER_DPI) -> bytes:
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format='PDF', resolution=dpi, save_all=True, append_images=pages[1:])
+    return buffer.getvalue()
+
+def to_photo(page: Image.Image, rng: random.Random) -> bytes:
+    """Phone photo of a printed page: slight rotation, uneven light, sensor noise, blur, JPEG"""
+    photo = page.convert('RGB').rotate(rng.uniform(-3, 3), resample=Image.BICUBIC, expand=True, fillcolor=(92, 88, 80))
+
+    # Light falls off towards one side of the page
+    shade = Image.linear_gradient('L').rotate(rng.choice([0, 90, 180, 270])).resize(photo.size)
+    shade = shade.point(lambda value: 175 + value * 80 // 255)
+    photo = Image.composite(photo, Image.new('RGB', photo.size, (0, 0, 0)), shade)
+
+    noise = Image.effect_noise(photo.size, 24).convert('RGB')
+    photo = Image.blend(photo, noise, 0.08).filter(ImageFilter.GaussianBlur(rng.uniform(0.4, 1.0)))
+
+    buffer = io.BytesIO()
+    photo.save(buffer, format='JPEG', quality=rng.randint(60, 85))
+    return buffer.getvalue()
+
+def load_font(path: str = FONT_PATH, dpi: int = RENDER_DPI) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(path, int(10 / 72 * dpi))  # 10 pt
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='Output directory (files + manifest.json)')
+    parser.add_argument('--layouts', default=','.join(LAYOUTS), help='Comma separated display layouts (default: all)')
+    parser.add_argument('--invoices', type=int, default=3, help='Invoices per layout')
+    parser.add_argument('--min-lines', type=int, default=5)
+    parser.add_argument('--max-lines', type=int, default=80)
+    parser.add_argument('--photos', action='store_true', help='Also write a phone-photo JPEG of each first page')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--font', default=FONT_PATH)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    font = load_font(args.font)
+    os.makedirs(args.out, exist_ok=True)
+    manifest = []
+    for layout in args.layouts.split(','):
+        for n in range(1, args.invoices + 1):
+            invoice = generate_invoice(layout, rng, rng.randint(args.min_lines, args.max_lines))
+            pages = [render_page(lines, font) for lines in invoice.pages]
+            files = {'pdf': f"{layout}_{n}.pdf"}
+            with open(os.path.join(args.out, files['pdf']), 'wb') as f:
+                f.write(to_pdf(pages))
+            if args.photos:
+                files['photo'] = f"{layout}_{n}_photo.jpg"
+                with open(os.path.join(args.out, files['photo']), 'wb') as f:
+                    f.write(to_photo(pages[0], rng))
+            manifest.append({
+                'layout': layout,
+                'invoice_number': invoice.invoice_number,
+                'pages': len(pages),
+                'files': files,
+                'template_config': template_config(layout),
+                'items': invoice.items,
+                'first_page_items': min(len(invoice.items), LINES_PER_PAGE),  # What the photo shows
+            })
+            print(f"{layout}_{n}: {len(pages)} page(s), {len(invoice.items)} items")
+
+    with open(os.path.join(args.out, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+if __name__ == '__main__':
+    main()
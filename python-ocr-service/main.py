@@ -4,26 +4,594 @@ Extracts data from invoices using supplier-specific templates
 Version: 2.0.1 - Albert format support with weight field
 """
 
-from fastapi import FastAPI, HTTPException
+import time
+_import_started = time.perf_counter()  # Startup import time, reported by /ready
+
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import pytesseract
-from PIL import Image
-import pdf2image
+from PIL import Image, ImageDraw, ImageOps
 import re
 import io
 import base64
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Any, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache, partial
+from itertools import groupby, product
 import logging
-from pyzbar import pyzbar
-import numpy as np
-import cv2
+import os
+import contextvars
+import copy
+import cProfile
+import difflib
+import hashlib
+import importlib
+import json
+import math
+import pstats
+import random
+import asyncio
+import secrets
+import shlex
+import signal
+import subprocess
+import tempfile
+import sys
+import threading
+import unicodedata
+import uuid
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (LOG_LEVEL=debug enables per-line parsing diagnostics in the log)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Invoice OCR Service")
+# Per-request diagnostics collector, set only for requests submitted with trace=true
+_diagnostics: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar('diagnostics', default=None)
+
+# Profiler of the current request, set only for profiled requests (see RequestProfile)
+_profile: contextvars.ContextVar[Optional['RequestProfile']] = contextvars.ContextVar('profile', default=None)
+
+# display_layout of the invoice being processed - label of the stage latency metrics
+_metric_layout: contextvars.ContextVar[str] = contextvars.ContextVar('metric_layout', default='none')
+
+# Markers used by the Backaldrin second page diagnostics (trace mode only)
+SECOND_PAGE_MARKERS = [
+    'Stranač. 2',
+    'Strana 2',
+    'page 2',
+    'Dodavatel: backaldrin',
+    '01395050',  # First item from second page
+    '01250120',  # Second item from second page
+]
+
+def trace_enabled() -> bool:
+    """True when the current request collects diagnostics (trace=true)"""
+    return _diagnostics.get() is not None
+
+def trace(msg: str, *args: Any) -> None:
+    """
+    Record a diagnostic message for the current request.
+    Collected into the response `diagnostics` field when tracing, otherwise
+    logged at DEBUG level - formatting only happens if one of them needs it.
+    """
+    diagnostics = _diagnostics.get()
+    if diagnostics is not None:
+        diagnostics.append(msg % args if args else msg)
+    logger.debug(msg, *args)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _prometheus_labels(labels: Tuple[Tuple[str, str], ...], *extra: Tuple[str, str]) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    escaped = (
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class Metrics:
+    """
+    Process-wide counters and latency histograms - counters on GET /stats, everything on GET /metrics
+    (Prometheus text format). Recording is a dict update under a lock, cheap enough to stay on.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        # Per histogram: [observations per bucket (last one is +Inf), sum of observed values]
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[Any]] = {}
+    
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += value
+    
+    def histogram_totals(self, name: str, label: str) -> Dict[str, Tuple[int, float]]:
+        """(observations, sum of values) of a histogram per value of one label, summed over the other labels"""
+        totals: Dict[str, Tuple[int, float]] = {}
+        with self._lock:
+            for (histogram_name, labels), (counts, total) in self._histograms.items():
+                if histogram_name == name:
+                    value = dict(labels).get(label, '')
+                    count, seconds = totals.get(value, (0, 0.0))
+                    totals[value] = (count + sum(counts), seconds + total)
+        return totals
+    
+    def counters(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+    
+    def prometheus(self, gauges: List[Tuple[str, str, Dict[str, str], float]] = ()) -> str:
+        """
+        Text exposition of all metrics; gauges are (name, type, labels, value) samples
+        taken at scrape time (queue depths, cache statistics)
+        """
+        with self._lock:
+            samples = [(name, 'counter', labels, value) for (name, labels), value in self._counters.items()]
+            histograms = sorted((key, list(counts), total) for key, (counts, total) in self._histograms.items())
+        samples += [(name, kind, tuple(sorted(labels.items())), value) for name, kind, labels, value in gauges]
+        
+        lines = []
+        for name, group in groupby(sorted(samples, key=lambda sample: sample[:3]), key=lambda sample: sample[0]):
+            group = list(group)
+            lines.append(f"# TYPE {name} {group[0][1]}")
+            lines.extend(f"{name}{_prometheus_labels(labels)} {value}" for _, _, labels, value in group)
+        for name, group in groupby(histograms, key=lambda histogram: histogram[0][0]):
+            lines.append(f"# TYPE {name} histogram")
+            for (_, labels), counts, total in group:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_prometheus_labels(labels, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{name}_sum{_prometheus_labels(labels)} {total}")
+                lines.append(f"{name}_count{_prometheus_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Record the duration of a pipeline stage in the ocr_stage_seconds histogram (by display_layout)"""
+    metrics.observe('ocr_stage_seconds', seconds, stage=stage, display_layout=_metric_layout.get())
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a pipeline stage (see record_stage)"""
+    started = time.perf_counter()
+    yield
+    record_stage(stage, time.perf_counter() - started)
+
+# Profiling: requests sent with profile=true plus a sampled share of all traffic (changed at runtime on /admin/profiling)
+PROFILE_TOP_FUNCTIONS = int(os.getenv('OCR_PROFILE_TOP_FUNCTIONS', '25'))
+ADMIN_TOKEN = os.getenv('OCR_ADMIN_TOKEN')  # Enables the /admin endpoints (X-Admin-Token header)
+
+class RequestProfile:
+    """
+    cProfile of one request. cProfile only sees its own thread - the pipeline thread and
+    every page worker get their own profiler, merged into one summary at the end.
+    """
+    
+    def __init__(self):
+        self._profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+    
+    def start(self) -> cProfile.Profile:
+        """Start profiling the calling thread - the caller disables the returned profiler"""
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        profiler.enable()
+        return profiler
+    
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """func profiled in whichever thread it runs"""
+        def profiled(*args: Any) -> Any:
+            profiler = self.start()
+            try:
+                return func(*args)
+            finally:
+                profiler.disable()
+        return profiled
+    
+    def top_functions(self, limit: int) -> List[Dict[str, Any]]:
+        """Functions with the highest cumulative time (summed over threads - page workers overlap)"""
+        with self._lock:
+            stats = pstats.Stats(*self._profilers)
+        rows = sorted(stats.stats.items(), key=lambda row: row[1][3], reverse=True)[:limit]
+        return [
+            {
+                'function': f"{os.path.basename(func[0])}:{func[1]}({func[2]})" if func[0] != '~' else func[2],
+                'calls': calls,
+                'total_seconds': round(total, 4),
+                'cumulative_seconds': round(cumulative, 4),
+            }
+            for func, (_, calls, total, cumulative, _) in rows
+        ]
+
+class ProfileStore:
+    """Runtime sampling rate and the most recent request profiles"""
+    
+    def __init__(self, sample_percent: float, max_profiles: int):
+        self.sample_percent = sample_percent
+        self._profiles: deque = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+    
+    def sampled(self) -> bool:
+        return self.sample_percent > 0 and random.random() * 100 < self.sample_percent
+    
+    def add(self, profile: Dict[str, Any]) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+    
+    def recent(self) -> List[Dict[str, Any]]:
+        """Stored profiles, newest first"""
+        with self._lock:
+            return list(reversed(self._profiles))
+
+profiles = ProfileStore(
+    float(os.getenv('OCR_PROFILE_SAMPLE_PERCENT', '0')),
+    int(os.getenv('OCR_PROFILE_STORE_SIZE', '50'))
+)
+
+class RequestCancelled(Exception):
+    """Raised inside the pipeline once its request was cancelled or ran past its deadline"""
+    
+    def __init__(self, reason: str, stage: str):
+        super().__init__(f"Request cancelled ({reason}) during {stage}")
+        self.reason = reason  # deadline | client_disconnected
+        self.stage = stage
+
+class Cancellation:
+    """
+    Deadline and cancellation flag of one request, shared with the threads working on it.
+    The pipeline calls check() between pages and stages, running tesseract processes are killed once it fires.
+    """
+    
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+    
+    def cancel(self, reason: str) -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+    
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel('deadline')
+        return self._event.is_set()
+    
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline (None without a deadline)"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+    
+    def check(self, stage: str) -> None:
+        if self.cancelled():
+            raise RequestCancelled(self.reason, stage)
+
+# Request deadlines: X-Deadline-Ms header (time budget of the caller), otherwise the default below
+DEFAULT_DEADLINE_SECONDS = float(os.getenv('OCR_DEFAULT_DEADLINE_SECONDS', '60'))  # 0 disables the default deadline
+DISCONNECT_POLL_SECONDS = 0.5  # How often a waiting request checks whether its client is still connected
+TESSERACT_POLL_SECONDS = 0.1  # How often a running tesseract process checks for cancellation
+
+def request_timeout(deadline_ms: Optional[int], default: Optional[float] = DEFAULT_DEADLINE_SECONDS) -> Optional[float]:
+    """Time budget in seconds from the X-Deadline-Ms header, falling back to the default"""
+    if deadline_ms is not None and deadline_ms > 0:
+        return deadline_ms / 1000
+    return default or None
+
+# Asynchronous job settings (POST /jobs)
+JOB_WORKERS = int(os.getenv('OCR_JOB_WORKERS', '2'))  # Invoices OCR'd in parallel by the job worker pool
+JOB_QUEUE_LIMIT = int(os.getenv('OCR_JOB_QUEUE_LIMIT', '100'))  # Max jobs and batch files waiting (batch lane)
+JOB_TTL_SECONDS = int(os.getenv('OCR_JOB_TTL_SECONDS', '3600'))  # Finished jobs are kept this long for polling
+
+# Pages of one invoice OCR'd in parallel (each page is a separate tesseract process)
+PAGE_WORKERS = int(os.getenv('OCR_PAGE_WORKERS', str(min(4, os.cpu_count() or 1))))
+if PAGE_WORKERS > 1:
+    # Parallel tesseract processes - keep each one single-threaded to avoid oversubscribing the CPUs
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+RENDER_DPI = 300  # PDF pages are rasterized at this resolution for OCR
+# Uploaded images are scaled down so their long side is at most this (an A4 page at RENDER_DPI) - 0 keeps them as uploaded
+IMAGE_MAX_SIDE = int(os.getenv('OCR_IMAGE_MAX_SIDE', str(int(11.7 * RENDER_DPI))))
+# Adaptive DPI: PDF pages are OCR'd at this resolution first and again at RENDER_DPI only when the result looks poor
+FIRST_PASS_DPI = int(os.getenv('OCR_FIRST_PASS_DPI', '0'))  # 0 disables adaptive DPI (every page at RENDER_DPI)
+ESCALATE_CONFIDENCE = float(os.getenv('OCR_ESCALATE_CONFIDENCE', '80'))  # Mean tesseract word confidence (0-100)
+ESCALATE_MATCH_RATE = float(os.getenv('OCR_ESCALATE_MATCH_RATE', '0.5'))  # Share of amount lines that became items
+# Table lines that fail their checks are OCR'd again from crops of the page at a higher resolution -
+# opt-in, per template (line_reocr) or for all of them
+LINE_REOCR = os.getenv('OCR_LINE_REOCR', 'false').lower() in ('1', 'true', 'yes')
+LINE_REOCR_DPI = int(os.getenv('OCR_LINE_REOCR_DPI', '600'))  # 0 disables line re-OCR, also for templates that ask for it
+LINE_REOCR_MAX_LINES = int(os.getenv('OCR_LINE_REOCR_MAX_LINES', '12'))  # Per invoice - more failing lines mean a bad scan, not misreads
+# Single text line, no dictionaries (they pull digit runs towards words: "5L" / "51")
+LINE_REOCR_CONFIG = os.getenv('OCR_LINE_REOCR_CONFIG', '--oem 3 --psm 7 -c load_system_dawg=0 -c load_freq_dawg=0')
+# Orientation detection: every page is checked (tesseract OSD on a downscaled copy) and turned upright before OCR
+DETECT_ORIENTATION = os.getenv('OCR_DETECT_ORIENTATION', 'false').lower() in ('1', 'true', 'yes')
+ORIENTATION_CONFIDENCE = float(os.getenv('OCR_ORIENTATION_CONFIDENCE', '2'))  # Lowest OSD confidence a page is turned on
+# Page triage: blank pages and repeated pages are skipped before OCR, decided on all pages rendered once at TRIAGE_DPI
+PAGE_TRIAGE = os.getenv('OCR_PAGE_TRIAGE', 'false').lower() in ('1', 'true', 'yes')
+TRIAGE_DPI = 50
+TRIAGE_BLANK_INK = float(os.getenv('OCR_TRIAGE_BLANK_INK', '0.0001'))  # Ink density below which a page is blank
+TRIAGE_DUPLICATE_DISTANCE = float(os.getenv('OCR_TRIAGE_DUPLICATE_DISTANCE', '0.05'))  # Share of hash bits; 0 keeps duplicates
+# Intermediate page files: PDF pages are rendered (grayscale, uncompressed) into this directory and tesseract reads
+# them from there - use a RAM-backed one such as /dev/shm. Empty: pages are decoded into memory and written out for tesseract
+PAGE_FILES_DIR = os.getenv('OCR_PAGE_FILES_DIR', '')
+# Decoded page images one request may hold at once - limits how many of its pages are worked on in parallel
+PAGE_MEMORY_BUDGET_MB = int(os.getenv('OCR_PAGE_MEMORY_BUDGET_MB', '256'))
+
+# Admission control: invoices processed at once (each holds its rendered pages in memory) and wait queues per lane
+MAX_CONCURRENT = int(os.getenv('OCR_MAX_CONCURRENT', '2'))
+QUEUE_LIMITS = {
+    'interactive': int(os.getenv('OCR_QUEUE_LIMIT_INTERACTIVE', '10')),  # /process-invoice, /process-invoice/stream
+    'batch': JOB_QUEUE_LIMIT,  # Jobs, batch files and requests sent with X-Request-Lane: batch
+}
+ADMISSION_POLL_SECONDS = 0.1  # How often a waiting request checks its deadline / disconnect
+
+class AdmissionRejected(Exception):
+    """The wait queue of a lane is full - answered with 429 and Retry-After"""
+    
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"Too many invoices waiting in the {lane} queue, retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+class AdmissionTicket:
+    """Place of one invoice in a lane's wait queue - admitted is set on the event loop the invoice waits on"""
+    
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.loop = asyncio.get_running_loop()
+        self.admitted = asyncio.Event()
+
+class AdmissionController:
+    """
+    Limits how many invoices are processed at once. Waiting invoices queue per lane (FIFO),
+    free slots go to the interactive lane first; a full lane is rejected right away.
+    enqueue() never blocks and wait() waits for the slot on the event loop, so a queued invoice holds
+    no thread - run() then runs the work on a worker thread and frees the slot again.
+    """
+    
+    LANES = ('interactive', 'batch')
+    
+    def __init__(self, max_concurrent: int, queue_limits: Dict[str, int]):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.queue_limits = queue_limits
+        self.active = 0
+        self._queues: Dict[str, deque] = {lane: deque() for lane in self.LANES}
+        self._lock = threading.Lock()  # Slots are freed from worker threads
+        self._avg_service_seconds = 5.0  # Moving average of processing time, used for Retry-After
+    
+    def enqueue(self, lane: str) -> AdmissionTicket:
+        """Queue an invoice (called on the event loop) - admitted right away when a slot is free"""
+        with self._lock:
+            queue = self._queues[lane]
+            if len(queue) >= self.queue_limits[lane]:
+                metrics.inc('admission_rejected_total', lane=lane)
+                waiting = sum(len(q) for q in self._queues.values())
+                retry_after = math.ceil(self._avg_service_seconds * (waiting + 1) / self.max_concurrent)
+                raise AdmissionRejected(lane, max(retry_after, 1))
+            ticket = AdmissionTicket(lane)
+            queue.append(ticket)
+            self._dispatch()
+            return ticket
+    
+    def abandon(self, ticket: AdmissionTicket) -> None:
+        """Drop a ticket that will never be run"""
+        with self._lock:
+            if ticket in self._queues[ticket.lane]:
+                self._queues[ticket.lane].remove(ticket)
+            elif ticket.admitted_at is not None:
+                self._free_slot(ticket)
+    
+    def _next_ticket(self) -> Optional[AdmissionTicket]:
+        for lane in self.LANES:
+            if self._queues[lane]:
+                return self._queues[lane][0]
+        return None
+    
+    def _dispatch(self) -> None:
+        """Hand free slots to the next waiting tickets (caller holds _lock)"""
+        while self.active < self.max_concurrent:
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            self._queues[ticket.lane].popleft()
+            self.active += 1
+            ticket.admitted_at = time.monotonic()
+            ticket.loop.call_soon_threadsafe(ticket.admitted.set)
+    
+    def _free_slot(self, ticket: AdmissionTicket) -> None:
+        """Free the slot of an admitted ticket (caller holds _lock)"""
+        self.active -= 1
+        service_seconds = time.monotonic() - ticket.admitted_at
+        self._avg_service_seconds = 0.8 * self._avg_service_seconds + 0.2 * service_seconds
+        self._dispatch()
+    
+    async def wait(self, ticket: AdmissionTicket, cancellation: Cancellation) -> None:
+        """Wait for the ticket's turn without holding a thread (RequestCancelled once the request is cancelled)"""
+        while not ticket.admitted.is_set():
+            try:
+                await asyncio.wait_for(ticket.admitted.wait(), ADMISSION_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            if cancellation.cancelled():
+                with self._lock:
+                    # A ticket admitted just now goes ahead - the pipeline stops at its first check
+                    if ticket.admitted_at is None:
+                        self._queues[ticket.lane].remove(ticket)
+                        metrics.inc('requests_cancelled_total', reason=cancellation.reason, stage='queue')
+                        raise RequestCancelled(cancellation.reason, 'queue')
+        
+        metrics.inc('admission_admitted_total', lane=ticket.lane)
+        metrics.inc('admission_wait_seconds_total', ticket.admitted_at - ticket.enqueued_at, lane=ticket.lane)
+    
+    def run(self, ticket: AdmissionTicket, func: Callable[[], Any]) -> Any:
+        """Run func for an admitted ticket (blocking, on a worker thread) and free its slot again"""
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._free_slot(ticket)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Current queue depth and wait of the oldest waiting invoice per lane"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'active': self.active,
+                'max_concurrent': self.max_concurrent,
+                'lanes': {
+                    lane: {
+                        'waiting': len(queue),
+                        'queue_limit': self.queue_limits[lane],
+                        'oldest_wait_seconds': round(now - queue[0].enqueued_at, 3) if queue else 0,
+                    }
+                    for lane, queue in self._queues.items()
+                },
+            }
+
+admission = AdmissionController(MAX_CONCURRENT, QUEUE_LIMITS)
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def run_admitted(
+    ticket: AdmissionTicket,
+    cancellation: Cancellation,
+    func: Callable[[], Any],
+    executor: Optional[ThreadPoolExecutor] = None
+) -> Any:
+    """Wait for admission on the event loop, then run blocking func on executor (default: the threadpool)"""
+    await admission.wait(ticket, cancellation)
+    if executor is None:
+        return await run_in_threadpool(admission.run, ticket, func)
+    return await asyncio.get_running_loop().run_in_executor(executor, admission.run, ticket, func)
+
+def request_lane(lane: Optional[str], default: str = 'interactive') -> str:
+    """Admission lane from the X-Request-Lane header"""
+    lane = (lane or default).lower()
+    if lane not in AdmissionController.LANES:
+        raise HTTPException(status_code=400, detail=f"Unknown X-Request-Lane: {lane}")
+    return lane
+
+# Startup warm-up: pay the first-use costs (heavy imports, tesseract language data, poppler, QR decoder)
+# before traffic arrives - /ready answers 503 until it is done. OCR_WARMUP=false skips it.
+WARMUP_ENABLED = os.getenv('OCR_WARMUP', 'true').lower() not in ('0', 'false', 'no')
+WARMUP_LANGUAGE = 'ces'
+
+# Readiness state and startup timings (seconds), reported by /ready
+startup: Dict[str, Any] = {
+    'status': 'starting',
+    'import_seconds': {},
+    'warmup_seconds': {},
+    'errors': {},
+}
+
+def lazy_import(name: str) -> Any:
+    """
+    Import a heavy module (numpy, cv2, pyzbar, pdf2image) on first use instead of at startup -
+    the import time is recorded in startup['import_seconds']
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        startup['import_seconds'][name] = round(time.perf_counter() - started, 3)
+    return module
+
+def _warmup_image() -> Image.Image:
+    """Small built-in text image for the warm-up OCR run"""
+    image = Image.new('RGB', (320, 60), 'white')
+    ImageDraw.Draw(image).text((10, 20), "Faktura 2024001  1 ks  125,50", fill='black')
+    return image
+
+def warm_up() -> None:
+    """
+    Load everything the first invoice would otherwise wait for: the lazily imported modules,
+    tesseract with its language data, a one-page PDF rasterized by poppler and the QR decoder.
+    Runs in a background thread; sets startup['status'] to 'ready' (or 'failed')
+    """
+    timings = startup['warmup_seconds']
+    warmup_started = time.perf_counter()
+    try:
+        for name in ('numpy', 'cv2', 'pyzbar.pyzbar', 'pdf2image'):
+            try:
+                lazy_import(name)
+            except Exception as e:
+                # QR detection is optional - a missing zbar only disables it
+                startup['errors'][name] = str(e)
+                logger.warning("Warm-up: cannot import %s: %s", name, e)
+        
+        image = _warmup_image()
+        started = time.perf_counter()
+        run_tesseract(image, WARMUP_LANGUAGE, '--oem 3 --psm 6', Cancellation())
+        timings['tesseract'] = round(time.perf_counter() - started, 3)
+        
+        pdf_buffer = io.BytesIO()
+        image.save(pdf_buffer, format='PDF')
+        started = time.perf_counter()
+        pages = PageSource(pdf_buffer.getvalue(), 'warmup.pdf', Cancellation())
+        try:
+            pages.release(pages.render(1))
+        finally:
+            pages.close()
+        timings['convert_to_images'] = round(time.perf_counter() - started, 3)
+        
+        started = time.perf_counter()
+        detect_qr_codes(image, 1)
+        timings['detect_qr_codes'] = round(time.perf_counter() - started, 3)
+        
+        timings['total'] = round(time.perf_counter() - warmup_started, 3)
+        startup['status'] = 'ready'
+        logger.info("Warm-up finished in %.2fs: %s", timings['total'], timings)
+    except Exception as e:
+        startup['status'] = 'failed'
+        startup['errors']['warmup'] = str(e)
+        logger.error("Warm-up failed: %s", e, exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if INGREDIENT_SNAPSHOT:
+        try:
+            ingredient_index.load_file(INGREDIENT_SNAPSHOT)
+        except Exception as e:
+            # Items are returned without candidates until the index is uploaded to /admin/ingredients
+            startup['errors']['ingredient_snapshot'] = str(e)
+            logger.error("Failed to load ingredient snapshot %s: %s", INGREDIENT_SNAPSHOT, e)
+    if WARMUP_ENABLED:
+        startup['status'] = 'warming_up'
+        threading.Thread(target=warm_up, name='ocr-warmup', daemon=True).start()
+    else:
+        startup['status'] = 'ready'
+    yield
+
+app = FastAPI(title="Invoice OCR Service", lifespan=lifespan)
 
 # Add CORS
 app.add_middleware(
@@ -38,6 +606,19 @@ class ProcessInvoiceRequest(BaseModel):
     file_base64: str
     file_name: str
     template_config: Dict[str, Any]
+    trace: bool = False  # Collect parsing diagnostics into the response `diagnostics` field
+    fields: Optional[List[str]] = None  # Response fields to return, e.g. ["invoice_number", "items.product_code"] (default: all)
+    include_raw_text: bool = True  # false: omit raw_text, fetch it later from GET /raw-text/{document_hash}
+    profile: bool = False  # Run under the profiler and return the top functions in the response `profile` field
+    supplier_id: Optional[str] = None  # Scopes supplier code matching against the ingredient index
+
+class IngredientCandidate(BaseModel):
+    ingredient_id: int
+    name: str
+    unit: Optional[str] = None
+    category_id: Optional[int] = None
+    score: float  # 0-1
+    match: str  # code | code_variant | name | ngram
 
 class InvoiceItem(BaseModel):
     product_code: Optional[str] = None
@@ -61,12 +642,100 @@ class InvoiceItem(BaseModel):
     package_weight_unit: Optional[str] = None  # ZEELANDIA: Obsah unit (KG/PCE/G)
     total_weight: Optional[float] = None  # ZEELANDIA: Fakt.mn (total weight value)
     total_weight_unit: Optional[str] = None  # ZEELANDIA: Fakt.mn unit (KG/PCE/G)
+    ingredient_candidates: Optional[List[IngredientCandidate]] = None  # Best ingredient index matches (when the index is loaded)
+
+class ParsedItem:
+    """
+    Line item as the parser builds it - a plain slotted record with InvoiceItem's fields and defaults
+    Parsing creates one per matched line; it is validated into InvoiceItem once, by to_invoice_item
+    """
+    __slots__ = (
+        'product_code', 'description', 'quantity', 'unit_of_measure', 'unit_price', 'line_total', 'line_amount',
+        'line_number', 'base_price', 'units_in_mu', 'vat_rate', 'vat_amount', 'total_with_vat', 'package_weight_kg',
+        'total_weight_kg', 'price_per_kg', 'item_weight', 'package_weight', 'package_weight_unit', 'total_weight',
+        'total_weight_unit', 'ingredient_candidates',
+        'amounts',  # Parser only: raw amount texts left for reconcile_amounts
+        'source_line',  # Parser only: the text line the item was read from (single-line patterns)
+    )
+
+    def __init__(
+        self,
+        product_code: Optional[str] = None,
+        description: Optional[str] = None,
+        quantity: float = 0,
+        unit_of_measure: Optional[str] = None,
+        unit_price: float = 0,
+        line_total: float = 0,
+        line_amount: Optional[float] = None,
+        line_number: int = 0,
+        base_price: Optional[float] = None,
+        units_in_mu: Optional[float] = None,
+        vat_rate: Optional[float] = None,
+        vat_amount: Optional[float] = None,
+        total_with_vat: Optional[float] = None,
+        package_weight_kg: Optional[float] = None,
+        total_weight_kg: Optional[float] = None,
+        price_per_kg: Optional[float] = None,
+        item_weight: Optional[str] = None,
+        package_weight: Optional[float] = None,
+        package_weight_unit: Optional[str] = None,
+        total_weight: Optional[float] = None,
+        total_weight_unit: Optional[str] = None,
+        ingredient_candidates: Optional[List[Dict[str, Any]]] = None,
+        amounts: Optional[Tuple[Tuple[str, str, int], ...]] = None,
+    ):
+        self.product_code = product_code
+        self.description = description
+        self.quantity = quantity
+        self.unit_of_measure = unit_of_measure
+        self.unit_price = unit_price
+        self.line_total = line_total
+        self.line_amount = line_amount
+        self.line_number = line_number
+        self.base_price = base_price
+        self.units_in_mu = units_in_mu
+        self.vat_rate = vat_rate
+        self.vat_amount = vat_amount
+        self.total_with_vat = total_with_vat
+        self.package_weight_kg = package_weight_kg
+        self.total_weight_kg = total_weight_kg
+        self.price_per_kg = price_per_kg
+        self.item_weight = item_weight
+        self.package_weight = package_weight
+        self.package_weight_unit = package_weight_unit
+        self.total_weight = total_weight
+        self.total_weight_unit = total_weight_unit
+        self.ingredient_candidates = ingredient_candidates
+        self.amounts = amounts
+        self.source_line: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return f"ParsedItem({self.product_code!r}, {self.description!r}, quantity={self.quantity!r}, line_total={self.line_total!r})"
+
+def to_invoice_item(item: ParsedItem) -> InvoiceItem:
+    """The one validation of a parsed item (coerces numbers to float like direct InvoiceItem construction did)"""
+    return InvoiceItem.model_validate(item, from_attributes=True)
 
 class QRCodeData(BaseModel):
     data: str
     type: str
     page: int
     
+class SkippedPage(BaseModel):
+    page: int
+    reason: str  # blank | duplicate | signature
+    detail: Optional[str] = None  # Ink density, the page it repeats or the matched signature's label
+
+class PageRotation(BaseModel):
+    page: int
+    degrees: int  # Clockwise turn applied before OCR: 90 | 180 | 270
+
+class ProfileEntry(BaseModel):
+    function: str  # file:line(function), built-ins by name only
+    calls: int
+    total_seconds: float  # Time in the function itself
+    cumulative_seconds: float  # Including the functions it called
+
 class ProcessInvoiceResponse(BaseModel):
     invoice_number: Optional[str] = None
     date: Optional[str] = None
@@ -77,146 +746,824 @@ class ProcessInvoiceResponse(BaseModel):
     confidence: float = 0
     raw_text: Optional[str] = None
     qr_codes: List[QRCodeData] = []
+    diagnostics: Optional[List[str]] = None  # Only present for trace=true requests
+    document_hash: Optional[str] = None  # SHA-256 of the uploaded file, key for GET /raw-text/{document_hash}
+    profile: Optional[List[ProfileEntry]] = None  # Only present for profile=true requests
+    escalated_pages: Optional[List[int]] = None  # Adaptive DPI only: pages OCR'd again at full resolution
+    skipped_pages: Optional[List[SkippedPage]] = None  # Page triage only: pages left out before OCR
+    rotated_pages: Optional[List[PageRotation]] = None  # Orientation detection only: pages turned upright before OCR
+    source_pages: Optional[List[int]] = None  # Split uploads only: pages of the upload this invoice was read from
+
+class SubmitJobResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str  # queued | running | done | failed
+    pages_done: int = 0
+    total_pages: Optional[int] = None
+    submitted_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[ProcessInvoiceResponse] = None  # Set once status is "done"
+    error: Optional[str] = None  # Set once status is "failed"
+
+class BatchInvoiceFile(BaseModel):
+    file_base64: str
+    file_name: str
+    template_config: Optional[Dict[str, Any]] = None  # Overrides the batch template_config for this file
+
+class ProcessBatchRequest(BaseModel):
+    files: List[BatchInvoiceFile]
+    template_config: Optional[Dict[str, Any]] = None  # Shared by all files without their own template_config
+    trace: bool = False
+    fields: Optional[List[str]] = None  # Projection of each result, same as ProcessInvoiceRequest.fields
+    include_raw_text: bool = True
+    supplier_id: Optional[str] = None  # Same as ProcessInvoiceRequest.supplier_id, for all files
+
+class ProfilingSettings(BaseModel):
+    sample_percent: float  # Share of requests profiled, 0-100
+
+class IngredientRow(BaseModel):
+    """Row of the ingredients table (other columns are ignored)"""
+    id: int
+    name: str
+    unit: Optional[str] = None
+    category_id: Optional[int] = None
+    active: bool = True
+
+class SupplierCodeRow(BaseModel):
+    """Row of the ingredient_supplier_codes table (other columns are ignored)"""
+    id: int
+    ingredient_id: int
+    supplier_id: str
+    product_code: str
+    supplier_ingredient_name: Optional[str] = None
+    is_active: Optional[bool] = True
+
+class IngredientSnapshot(BaseModel):
+    ingredients: List[IngredientRow] = []
+    supplier_codes: List[SupplierCodeRow] = []
+
+class IngredientUpdate(BaseModel):
+    """Incremental index change - rows are upserted by id (inactive rows are removed)"""
+    ingredients: List[IngredientRow] = []
+    supplier_codes: List[SupplierCodeRow] = []
+    deleted_ingredient_ids: List[int] = []
+    deleted_supplier_code_ids: List[int] = []
+
+class RawTextResponse(BaseModel):
+    document_hash: str
+    raw_text: str
+
+class BatchInvoiceResult(BaseModel):
+    index: int  # Position of the file in the request
+    file_name: str
+    status: str  # done | failed
+    result: Optional[ProcessInvoiceResponse] = None  # Set when status is "done"
+    error: Optional[str] = None  # Set when status is "failed"
+
+class RawTextStore:
+    """Full OCR text of recently processed documents by document hash (bounded, least recently used dropped)"""
+    
+    def __init__(self, max_documents: int):
+        self.max_documents = max_documents
+        self._texts: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def put(self, document_hash: str, raw_text: str) -> None:
+        with self._lock:
+            self._texts[document_hash] = raw_text
+            self._texts.move_to_end(document_hash)
+            while len(self._texts) > self.max_documents:
+                self._texts.popitem(last=False)
+    
+    def get(self, document_hash: str) -> Optional[str]:
+        with self._lock:
+            raw_text = self._texts.get(document_hash)
+            if raw_text is not None:
+                self._texts.move_to_end(document_hash)
+        metrics.inc('raw_text_cache_total', result='hit' if raw_text is not None else 'miss')
+        return raw_text
+    
+    def __len__(self) -> int:
+        return len(self._texts)
+
+raw_texts = RawTextStore(int(os.getenv('OCR_RAW_TEXT_CACHE_SIZE', '200')))
+
+# Ingredient matching: supplier codes, normalized names and name trigrams of all active ingredients,
+# loaded from OCR_INGREDIENT_SNAPSHOT at startup and replaced / updated on /admin/ingredients
+INGREDIENT_SNAPSHOT = os.getenv('OCR_INGREDIENT_SNAPSHOT')  # JSON file in the IngredientSnapshot format
+INGREDIENT_CANDIDATES = int(os.getenv('OCR_INGREDIENT_CANDIDATES', '3'))  # Candidates attached per item
+INGREDIENT_MIN_SCORE = float(os.getenv('OCR_INGREDIENT_MIN_SCORE', '0.4'))  # Weaker trigram matches are not reported
+CODE_VARIANT_SCORE = 0.7  # Code matched only after removing leading zeros, separators or OCR confusions
+
+_OCR_CODE_FIXES = str.maketrans('OoIlSsZB', '00115528')
+
+def normalize_ingredient_name(name: str) -> str:
+    """Lowercase, no diacritics, no "(...)" and no amounts like "25kg" - names compare on what they are"""
+    name = unicodedata.normalize('NFD', name.lower())
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    name = re.sub(r'\([^)]*\)', '', name)
+    name = re.sub(r'\d+\s*(kg|g|l|ml|ks|pce|bkt|bag|krt)', '', name)
+    return re.sub(r'\s+', ' ', name).strip()
+
+def code_variants(code: str) -> List[str]:
+    """Spellings a supplier code may have in OCR text besides the exact one"""
+    code = code.strip()
+    variants = {code.lstrip('0'), re.sub(r'[\s-]', '', code), code.translate(_OCR_CODE_FIXES)}
+    return [variant.lower() for variant in variants if variant and variant != code]
+
+def name_trigrams(normalized: str) -> frozenset:
+    """Character trigrams of the words (3+ letters) of a normalized name"""
+    return frozenset(
+        f" {word} "[i:i + 3]
+        for word in normalized.split()
+        if len(word) > 2
+        for i in range(len(word))
+    )
+
+class IngredientIndex:
+    """
+    In-memory ingredient matching index - one lookup per invoice item instead of a table scan
+    Names are indexed both whole (normalized) and by trigram, so OCR misspellings still find candidates.
+    Supplier ingredient names only match invoices of their supplier.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0  # Bumped on every change, 0 = nothing loaded
+        self.loaded_at: Optional[float] = None
+        self._reset()
+    
+    def _reset(self) -> None:
+        self._ingredients: Dict[int, IngredientRow] = {}
+        self._codes: Dict[int, SupplierCodeRow] = {}
+        self._by_code: Dict[Tuple[str, str], int] = {}  # (supplier_id, code) -> supplier code id
+        self._by_variant: Dict[Tuple[str, str], int] = {}
+        self._entries: Dict[Tuple[str, int], Tuple[int, Optional[str], str, frozenset]] = {}  # key -> (ingredient_id, supplier_id, name, trigrams)
+        self._by_name: Dict[str, set] = {}
+        self._by_trigram: Dict[str, set] = {}
+    
+    def _add_entry(self, key: Tuple[str, int], ingredient_id: int, supplier_id: Optional[str], name: Optional[str]) -> None:
+        normalized = normalize_ingredient_name(name or '')
+        if not normalized:
+            return
+        trigrams = name_trigrams(normalized)
+        self._entries[key] = (ingredient_id, supplier_id, normalized, trigrams)
+        self._by_name.setdefault(normalized, set()).add(key)
+        for trigram in trigrams:
+            self._by_trigram.setdefault(trigram, set()).add(key)
+    
+    def _drop_entry(self, key: Tuple[str, int]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for index, index_key in [(self._by_name, entry[2])] + [(self._by_trigram, trigram) for trigram in entry[3]]:
+            keys = index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[index_key]
+    
+    def _put_ingredient(self, row: IngredientRow) -> None:
+        self._drop_ingredient(row.id)
+        if not row.active:
+            return
+        self._ingredients[row.id] = row
+        self._add_entry(('ingredient', row.id), row.id, None, row.name)
+    
+    def _drop_ingredient(self, ingredient_id: int) -> None:
+        self._ingredients.pop(ingredient_id, None)
+        self._drop_entry(('ingredient', ingredient_id))
+    
+    def _put_code(self, row: SupplierCodeRow) -> None:
+        self._drop_code(row.id)
+        if row.is_active is False:
+            return
+        self._codes[row.id] = row
+        self._by_code[(row.supplier_id, row.product_code.strip().lower())] = row.id
+        for variant in code_variants(row.product_code):
+            self._by_variant.setdefault((row.supplier_id, variant), row.id)
+        self._add_entry(('supplier_code', row.id), row.ingredient_id, row.supplier_id, row.supplier_ingredient_name)
+    
+    def _drop_code(self, code_id: int) -> None:
+        row = self._codes.pop(code_id, None)
+        if row is None:
+            return
+        for index, code in [(self._by_code, row.product_code.strip().lower())] + [(self._by_variant, variant) for variant in code_variants(row.product_code)]:
+            if index.get((row.supplier_id, code)) == code_id:
+                del index[(row.supplier_id, code)]
+        self._drop_entry(('supplier_code', code_id))
+    
+    def load(self, snapshot: IngredientSnapshot) -> None:
+        """Replace the whole index"""
+        with self._lock:
+            self._reset()
+            for ingredient in snapshot.ingredients:
+                self._put_ingredient(ingredient)
+            for supplier_code in snapshot.supplier_codes:
+                self._put_code(supplier_code)
+            self.version += 1
+            self.loaded_at = time.time()
+        logger.info("Ingredient index loaded: %s", self.stats())
+    
+    def load_file(self, path: str) -> None:
+        with open(path, encoding='utf-8') as f:
+            self.load(IngredientSnapshot.model_validate(json.load(f)))
+    
+    def update(self, update: IngredientUpdate) -> None:
+        """Apply an incremental change (upserts, then deletions)"""
+        with self._lock:
+            for ingredient in update.ingredients:
+                self._put_ingredient(ingredient)
+            for supplier_code in update.supplier_codes:
+                self._put_code(supplier_code)
+            for ingredient_id in update.deleted_ingredient_ids:
+                self._drop_ingredient(ingredient_id)
+            for code_id in update.deleted_supplier_code_ids:
+                self._drop_code(code_id)
+            self.version += 1
+            self.loaded_at = time.time()
+    
+    def match(self, product_code: Optional[str], description: Optional[str], supplier_id: Optional[str], limit: int = INGREDIENT_CANDIDATES) -> List[Dict[str, Any]]:
+        """Best candidates for one invoice item, highest score first (one match per ingredient)"""
+        scores: Dict[int, Tuple[float, str]] = {}
+        
+        def offer(ingredient_id: int, score: float, match: str) -> None:
+            if ingredient_id in self._ingredients and score > scores.get(ingredient_id, (0, ''))[0]:
+                scores[ingredient_id] = (score, match)
+        
+        with self._lock:
+            # Supplier codes - items without a code (FABIO, Albert) are stored under their description
+            code = (product_code or description or '').strip()
+            if supplier_id and code:
+                code_id = self._by_code.get((supplier_id, code.lower()))
+                if code_id is not None:
+                    offer(self._codes[code_id].ingredient_id, 1.0, 'code')
+                elif product_code:
+                    variants = [(self._by_code, variant) for variant in code_variants(code)]
+                    variants += [(self._by_variant, variant) for variant in [code.lower()] + code_variants(code)]
+                    for index, variant in variants:
+                        code_id = index.get((supplier_id, variant))
+                        if code_id is not None:
+                            offer(self._codes[code_id].ingredient_id, CODE_VARIANT_SCORE, 'code_variant')
+                            break
+            
+            normalized = normalize_ingredient_name(description or '')
+            if normalized:
+                for key in self._by_name.get(normalized, ()):
+                    ingredient_id, entry_supplier, _, _ = self._entries[key]
+                    if entry_supplier is None or entry_supplier == supplier_id:
+                        offer(ingredient_id, 1.0, 'name')
+                
+                # Dice coefficient over the trigrams shared with each indexed name
+                trigrams = name_trigrams(normalized)
+                shared = Counter(key for trigram in trigrams for key in self._by_trigram.get(trigram, ()))
+                for key, count in shared.items():
+                    ingredient_id, entry_supplier, _, entry_trigrams = self._entries[key]
+                    if entry_supplier is not None and entry_supplier != supplier_id:
+                        continue
+                    score = 2 * count / (len(trigrams) + len(entry_trigrams))
+                    if score >= INGREDIENT_MIN_SCORE:
+                        offer(ingredient_id, round(score, 3), 'ngram')
+            
+            best = sorted(scores.items(), key=lambda candidate: candidate[1][0], reverse=True)[:limit]
+            return [
+                {
+                    'ingredient_id': ingredient_id,
+                    'name': self._ingredients[ingredient_id].name,
+                    'unit': self._ingredients[ingredient_id].unit,
+                    'category_id': self._ingredients[ingredient_id].category_id,
+                    'score': score,
+                    'match': match,
+                }
+                for ingredient_id, (score, match) in best
+            ]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'ingredients': len(self._ingredients),
+            'supplier_codes': len(self._codes),
+            'names': len(self._by_name),
+            'trigrams': len(self._by_trigram),
+        }
+
+ingredient_index = IngredientIndex()
+
+def response_projection(fields: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """
+    pydantic include spec for the requested response fields (None = everything)
+    "items" returns whole items, "items.product_code" only the listed item fields
+    """
+    if not fields:
+        return None
+    include: Dict[str, Any] = {}
+    item_fields = set()
+    for field in fields:
+        name, _, item_field = field.partition('.')
+        if name not in ProcessInvoiceResponse.model_fields or (
+            item_field and (name != 'items' or item_field not in InvoiceItem.model_fields)
+        ):
+            raise HTTPException(status_code=400, detail=f"Unknown response field: {field}")
+        if item_field:
+            item_fields.add(item_field)
+        else:
+            include[name] = True
+    if item_fields and 'items' not in include:
+        include['items'] = {'__all__': item_fields}
+    return include
+
+def json_response(model: BaseModel, include: Optional[Dict[str, Any]] = None, status_code: int = 200) -> Response:
+    """
+    Serialize a response model the service built itself straight to JSON
+    (skips FastAPI's response_model re-validation and the intermediate dict)
+    """
+    return Response(content=model.model_dump_json(include=include), status_code=status_code, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "invoice-ocr"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check - 200 once the startup warm-up has finished, 503 while it runs or if it failed"""
+    return JSONResponse(status_code=200 if startup['status'] == 'ready' else 503, content=startup)
+
+@app.get("/stats")
+async def get_stats():
+    """Service counters (cancelled requests, killed tesseract processes, ...) and admission queue state"""
+    return {"counters": metrics.counters(), "admission": admission.snapshot()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-stage latency histograms, counters, admission queue and cache state"""
+    state = admission.snapshot()
+    line_patterns = compile_line_pattern.cache_info()
+    ingredient_stats = ingredient_index.stats()
+    gauges = [
+        ('admission_active', 'gauge', {}, state['active']),
+        *[('admission_waiting', 'gauge', {'lane': lane}, lane_state['waiting']) for lane, lane_state in state['lanes'].items()],
+        ('raw_text_cache_documents', 'gauge', {}, len(raw_texts)),
+        ('ingredient_index_ingredients', 'gauge', {}, ingredient_stats['ingredients']),
+        ('ingredient_index_supplier_codes', 'gauge', {}, ingredient_stats['supplier_codes']),
+        ('line_pattern_cache_total', 'counter', {'result': 'hit'}, line_patterns.hits),
+        ('line_pattern_cache_total', 'counter', {'result': 'miss'}, line_patterns.misses),
+    ]
+    return Response(content=metrics.prometheus(gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def require_admin(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (OCR_ADMIN_TOKEN is not set)")
+    if not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/admin/profiling")
+async def get_profiling(x_admin_token: Optional[str] = Header(default=None)):
+    """Current profiling sample rate and the most recent request profiles"""
+    require_admin(x_admin_token)
+    return {"sample_percent": profiles.sample_percent, "profiles": profiles.recent()}
+
+@app.put("/admin/profiling")
+async def set_profiling(settings: ProfilingSettings, x_admin_token: Optional[str] = Header(default=None)):
+    """Change the share of requests that are profiled - takes effect immediately, no redeploy"""
+    require_admin(x_admin_token)
+    if not 0 <= settings.sample_percent <= 100:
+        raise HTTPException(status_code=400, detail="sample_percent must be between 0 and 100")
+    profiles.sample_percent = settings.sample_percent
+    logger.info("Profiling sample rate set to %s%%", settings.sample_percent)
+    return {"sample_percent": profiles.sample_percent}
+
+@app.get("/admin/ingredients")
+async def get_ingredient_index(x_admin_token: Optional[str] = Header(default=None)):
+    """Size and version of the ingredient matching index"""
+    require_admin(x_admin_token)
+    return ingredient_index.stats()
+
+@app.put("/admin/ingredients")
+async def load_ingredient_index(snapshot: IngredientSnapshot, x_admin_token: Optional[str] = Header(default=None)):
+    """Replace the ingredient matching index with a full snapshot of ingredients and supplier codes"""
+    require_admin(x_admin_token)
+    await run_in_threadpool(ingredient_index.load, snapshot)
+    return ingredient_index.stats()
+
+@app.patch("/admin/ingredients")
+async def update_ingredient_index(update: IngredientUpdate, x_admin_token: Optional[str] = Header(default=None)):
+    """Upsert or delete individual ingredients and supplier codes in the matching index"""
+    require_admin(x_admin_token)
+    await run_in_threadpool(ingredient_index.update, update)
+    return ingredient_index.stats()
+
+@app.get("/raw-text/{document_hash}", response_model=RawTextResponse)
+async def get_raw_text(document_hash: str):
+    """Full cleaned OCR text of a recently processed document (see ProcessInvoiceResponse.document_hash)"""
+    raw_text = raw_texts.get(document_hash)
+    if raw_text is None:
+        raise HTTPException(status_code=404, detail=f"Raw text not available: {document_hash}")
+    return json_response(RawTextResponse(document_hash=document_hash, raw_text=raw_text))
+
+async def run_until_disconnect(
+    http_request: Request,
+    cancellation: Cancellation,
+    ticket: AdmissionTicket,
+    func: Callable[[], Any]
+) -> Any:
+    """
+    Run blocking func in the threadpool once admitted (so health checks and job polling stay responsive)
+    and cancel its work - queued or running - if the client goes away before it is done
+    """
+    task = asyncio.ensure_future(run_admitted(ticket, cancellation, func))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if not cancellation.cancelled() and await http_request.is_disconnected():
+                logger.warning("Client disconnected - cancelling its OCR work")
+                cancellation.cancel('client_disconnected')
+    except asyncio.CancelledError:
+        cancellation.cancel('client_disconnected')
+        raise
+
 @app.post("/process-invoice", response_model=ProcessInvoiceResponse)
-async def process_invoice(request: ProcessInvoiceRequest):
+async def process_invoice(
+    request: ProcessInvoiceRequest,
+    http_request: Request,
+    deadline_ms: Optional[int] = Header(None, alias="X-Deadline-Ms"),
+    lane: Optional[str] = Header(None, alias="X-Request-Lane")
+):
     """
     Process invoice using template-based extraction
+    Work stops once the deadline (X-Deadline-Ms or the default) passes or the client disconnects
+    """
+    projection = response_projection(request.fields)
+    cancellation = Cancellation(request_timeout(deadline_ms))
+    try:
+        ticket = admission.enqueue(request_lane(lane))
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    try:
+        result = await run_until_disconnect(
+            http_request,
+            cancellation,
+            ticket,
+            partial(run_invoice_pipeline, request, cancellation=cancellation)
+        )
+        return json_response(result, projection)
+    except RequestCancelled as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except HTTPException:
+        # Client errors from the pipeline (unreadable file, page over the memory budget)
+        raise
+    except Exception as e:
+        logger.error("Error processing invoice: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/process-invoice/split", response_model=List[ProcessInvoiceResponse])
+async def process_invoice_split(
+    request: ProcessInvoiceRequest,
+    http_request: Request,
+    deadline_ms: Optional[int] = Header(None, alias="X-Deadline-Ms"),
+    lane: Optional[str] = Header(None, alias="X-Request-Lane")
+):
     """
+    Process a PDF that merges several invoices (e.g. a scanned stack) - one ProcessInvoiceResponse per invoice,
+    in page order, with the pages it was read from in `source_pages`. Invoices are processed concurrently.
+    Admission, deadline and disconnect handling as for /process-invoice
+    """
+    projection = response_projection(request.fields)
+    if projection:
+        projection['source_pages'] = True
+    cancellation = Cancellation(request_timeout(deadline_ms))
+    try:
+        ticket = admission.enqueue(request_lane(lane))
+    except AdmissionRejected as e:
+        raise admission_error(e)
     try:
-        logger.info(f"Processing invoice: {request.file_name}")
+        results = await run_until_disconnect(
+            http_request,
+            cancellation,
+            ticket,
+            partial(run_split_pipeline, request, cancellation=cancellation)
+        )
+        content = '[' + ','.join(result.model_dump_json(include=projection) for result in results) + ']'
+        return Response(content=content, media_type="application/json")
+    except RequestCancelled as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error processing invoice: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def resolve_header_patterns(patterns: Dict, display_layout: str) -> Dict:
+    """
+    Header patterns (invoice number, date, total, ...) with the proven supplier overrides applied
+    Returns a copy - the template configuration is left untouched
+    """
+    patterns = dict(patterns)
+    
+    # Override patterns for specific suppliers based on display_layout
+    # This ensures proven patterns are always used, regardless of template configuration
+    if display_layout == 'makro':
+        trace("🔧 Makro display_layout detected - overriding invoice_number pattern")
+        # Makro invoice number format: "Faktura č./ VS: 0874100615" or "Faktura č./VS: 0875300275"
+        # Pattern handles variations in spacing around "/" and different invoice number lengths
+        # OCR may have: "č./ VS:" (space after /), "č./VS:" (no space), "č. / VS:" (space before /), "č. /VS:" (space before /, no space after)
+        # Also handle cases where "/" might be missing: "č. VS:" or "č. VS:"
+        patterns['invoice_number'] = r'Faktura\s+č\.\s*/?\s*VS:\s*(\d{8,10})'
+        trace("   Using Makro invoice_number: %s", patterns['invoice_number'])
+    elif display_layout == 'dekos':
+        trace("🔧 Dekos display_layout detected - overriding invoice_number pattern")
+        # Override invoice number pattern to handle Czech diacritics (DAŇOVÝ vs DANOVY)
+        # Support both with and without diacritics
+        patterns['invoice_number'] = r'(?:DAŇOVÝ|DANOVY|Daňový|Danovy)\s+DOKLAD\s*-\s*faktura\s+č\.\s*(\d{5,})'
+        trace("   Using Dekos invoice_number: %s", patterns['invoice_number'])
+    elif display_layout == 'zeelandia':
+        trace("🔧 Zeelandia display_layout detected - overriding patterns (pure sequence)")
+        # Zeelandia: Labels and values are SEPARATED (labels first, values after)
+        # Extract by pure value patterns in sequence order
         
-        # Decode base64 file
-        file_bytes = base64.b64decode(request.file_base64)
+        # 1st: Invoice number - first standalone 9-digit number (after "Zeelandia" company name)
+        patterns['invoice_number'] = r'Zeelandia[\s\S]+?(\d{9})'
+        # 2nd: Total amount - first amount with space thousands separator (e.g., "33 751,78")
+        patterns['total_amount'] = r'(\d{1,3}(?:\s\d{3})*,\d{2})\s*(?:CZK|Kč)'
+        # 3rd: Date - first date in DD.MM.YYYY format (appears multiple times, take first)
+        patterns['date'] = r'(\d{1,2}\.\d{1,2}\.\d{4})'
+        # 4th: Payment type - word after all dates, not "DIČ" (look for Czech payment terms)
+        patterns['payment_type'] = r'(?:\d{1,2}\.\d{1,2}\.\d{4})\s+([A-ZÁ-Žá-žů][a-zá-žů]+(?:\s+[a-zá-žů]+)?)'
         
-        # Convert PDF to image(s)
-        images = convert_to_images(file_bytes, request.file_name)
+        # Hardcode supplier for Zeelandia
+        patterns['supplier_override'] = 'zeelandia'
         
-        if not images:
-            raise HTTPException(status_code=400, detail="Failed to convert file to images")
+        trace("   Using Zeelandia invoice_number (pure sequence): %s", patterns['invoice_number'])
+        trace("   Using Zeelandia total_amount (pure sequence): %s", patterns['total_amount'])
+        trace("   Using Zeelandia date (pure sequence): %s", patterns['date'])
+        trace("   Using Zeelandia payment_type (pure sequence): %s", patterns['payment_type'])
+        trace("   Using Zeelandia hardcoded supplier: zeelandia")
+    
+    return patterns
+
+class CompiledTemplate:
+    """
+    Template configuration prepared once and shared by every invoice processed with it
+    (a single request, or all files of a batch that use the same template)
+    """
+    
+    def __init__(self, template_config: Dict[str, Any]):
+        self.config = copy.deepcopy(template_config)
+        self.display_layout = (self.config.get('display_layout') or '').lower()
         
         # Get OCR settings from template
-        ocr_config = request.template_config.get('ocr_settings', {})
-        dpi = ocr_config.get('dpi', 300)
-        language = ocr_config.get('language', 'ces')
-        psm = ocr_config.get('psm', 6)
+        ocr_settings = self.config.get('ocr_settings', {})
+        self.language = ocr_settings.get('language', 'ces')
+        self.psm = ocr_settings.get('psm', 6)
+        self.ocr_config = f'--oem 3 --psm {self.psm}'
         
-        # Perform OCR on all pages
-        custom_config = f'--oem 3 --psm {psm}'
-        all_pages_text = []
+        self.patterns = resolve_header_patterns(self.config.get('patterns', {}), self.display_layout)
         
-        logger.info(f"Processing {len(images)} page(s)")
+        # Ruled table columns as item fields (None skips a column) - their columns are read as strips
+        table_columns = self.config.get('table_columns') or {}
+        self.table_grid: Optional[List[Optional[str]]] = None
+        if table_columns.get('grid_columns'):
+            self.table_grid = [field if field in GRID_FIELDS else None for field in table_columns['grid_columns']]
+            # Only number and text fields of InvoiceItem can be read from a cell (not line_number, ingredient_candidates)
+            unknown = [field for field in table_columns['grid_columns'] if field and field not in GRID_FIELDS]
+            if unknown:
+                logger.warning("grid_columns fields that are not number or text fields of an item are skipped: %s", unknown)
+        self.grid_header_rows = int(table_columns.get('grid_header_rows', 1))
         
-        for page_num, image in enumerate(images, 1):
-            page_text = pytesseract.image_to_string(image, lang=language, config=custom_config)
-            all_pages_text.append(f"\n--- Page {page_num} ---\n{page_text}")
-            logger.info(f"Page {page_num} OCR completed, text length: {len(page_text)}")
+        # Failing table lines are OCR'd again from higher resolution crops (see reocr_failing_lines)
+        self.line_reocr = bool(self.config.get('line_reocr', LINE_REOCR)) and LINE_REOCR_DPI > 0
         
-        # Combine all pages
-        raw_text = "\n".join(all_pages_text)
+        # Page types skipped before OCR (delivery notes, terms...) - (label, header hash, max distance)
+        self.page_signatures: List[Tuple[str, int, float]] = []
+        for signature in self.config.get('page_signatures') or []:
+            try:
+                self.page_signatures.append((
+                    signature.get('label') or 'signature',
+                    int(signature['hash'], 16),
+                    float(signature.get('max_distance', SIGNATURE_DISTANCE))
+                ))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                logger.warning("Invalid page signature is skipped: %s", signature)
         
-        logger.info(f"OCR completed for all pages, total text length: {len(raw_text)}")
+        # Table configuration per detected invoice format (Backaldrin / Makro auto-detection depends on the text)
+        self._table_configs: Dict[Tuple[bool, bool], Tuple[Dict, Dict]] = {}
+        self._lock = threading.Lock()
+    
+    def table_config(self, raw_text: str) -> Tuple[Dict, Dict]:
+        """(patterns, table_columns) for line item extraction from this invoice text"""
+        invoice_format = detect_table_format(raw_text, self.display_layout)
+        with self._lock:
+            table_config = self._table_configs.get(invoice_format)
+            if table_config is None:
+                metrics.inc('table_config_cache_total', result='miss')
+                table_config = resolve_table_config(self.config, self.display_layout, *invoice_format)
+                self._table_configs[invoice_format] = table_config
+            else:
+                metrics.inc('table_config_cache_total', result='hit')
+        return table_config
+
+@app.post("/process-invoice/stream")
+async def process_invoice_stream(
+    request: ProcessInvoiceRequest,
+    deadline_ms: Optional[int] = Header(None, alias="X-Deadline-Ms"),
+    lane: Optional[str] = Header(None, alias="X-Request-Lane")
+):
+    """
+    Streaming variant of /process-invoice (Server-Sent Events).
+    Emits partial results while the invoice is processed - started, header, items, qr_codes
+    and page events - then a final summary event with the full ProcessInvoiceResponse
+    (or an error event).
+    """
+    projection = response_projection(request.fields)
+    cancellation = Cancellation(request_timeout(deadline_ms))
+    try:
+        ticket = admission.enqueue(request_lane(lane))
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    loop = asyncio.get_running_loop()
+    messages: asyncio.Queue = asyncio.Queue()
+    
+    def emit(event: str, data: Dict[str, Any]) -> None:
+        # Called from the worker thread - serialize there, hand over to the event loop
+        message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        loop.call_soon_threadsafe(messages.put_nowait, message)
+    
+    def run() -> None:
+        result = run_invoice_pipeline(request, events=emit, cancellation=cancellation)
+        emit('summary', result.model_dump(mode='json', include=projection))
+    
+    async def work() -> None:
+        try:
+            await run_admitted(ticket, cancellation, run)
+        except RequestCancelled as e:
+            emit('error', {'detail': str(e), 'reason': e.reason})
+        except Exception as e:
+            logger.error("Error processing invoice: %s", e, exc_info=True)
+            emit('error', {'detail': getattr(e, 'detail', None) or str(e)})
+        finally:
+            # Queued behind the events the worker thread handed over
+            loop.call_soon_threadsafe(messages.put_nowait, None)
+    
+    # Started right away (not on first read) so the admission ticket is always used up
+    worker = asyncio.ensure_future(work())
+    
+    async def stream_events():
+        try:
+            while True:
+                message = await messages.get()
+                if message is None:
+                    break
+                yield message
+            await worker
+        finally:
+            # Client stopped reading (disconnect) - stop the OCR work nobody will see
+            if not worker.done():
+                cancellation.cancel('client_disconnected')
+    
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def run_invoice_pipeline(
+    request: ProcessInvoiceRequest,
+    progress: Optional[Callable[[int, int], None]] = None,
+    compiled: Optional[CompiledTemplate] = None,
+    events: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    cancellation: Optional[Cancellation] = None,
+    source_pages: Optional[List[int]] = None,
+    file_bytes: Optional[bytes] = None,
+    upload: Optional['PageSource'] = None,
+    page_window: Optional[int] = None
+) -> ProcessInvoiceResponse:
+    """
+    Run OCR and template extraction for a single invoice (blocking).
+    progress(pages_done, total_pages) is called as pages are OCR'd.
+    compiled is the already prepared template (batch requests share one), otherwise
+    request.template_config is compiled here.
+    events(event, data) receives partial results page by page (see PartialResultStream).
+    cancellation stops the work between pages and stages (RequestCancelled is raised).
+    source_pages restricts the invoice to those pages of the uploaded PDF (one invoice of a split upload);
+    page numbers in the response then count from its first page.
+    file_bytes, upload and page_window come from run_split_pipeline: the already decoded upload, its open
+    PageSource (pages are rendered from its PDF file) and this invoice's share of the upload's page window.
+    """
+    # Diagnostics are collected per request - only when the caller asked for them
+    diagnostics: Optional[List[str]] = [] if request.trace else None
+    diagnostics_token = _diagnostics.set(diagnostics)
+    if cancellation is None:
+        cancellation = Cancellation()
+    layout_token = _metric_layout.set('none')
+    # Profiled on request or when sampled - page workers pick the profile up from the context
+    profile = RequestProfile() if request.profile or profiles.sampled() else None
+    profile_token = _profile.set(profile)
+    profiler = profile.start() if profile else None
+    started = time.perf_counter()
+    pages: Optional[PageSource] = None
+    try:
+        logger.info("Processing invoice: %s", request.file_name)
         
-        # Remove page markers and clean up page breaks for seamless table extraction
-        raw_text_display = raw_text
+        # Template setup (supplier overrides, OCR settings) - done once per template
+        if compiled is None:
+            compiled = CompiledTemplate(request.template_config)
+        _metric_layout.set(compiled.display_layout or 'none')
         
-        # Remove page markers
-        raw_text_display = re.sub(r'\n--- Page \d+ ---\n', '\n', raw_text_display)
+        # Decode base64 file
+        with stage_timer('decode'):
+            if file_bytes is None:
+                file_bytes = base64.b64decode(request.file_base64)
+            document_hash = hashlib.sha256(file_bytes).hexdigest()
+        if source_pages:
+            # Each invoice of a split upload keeps its own raw text
+            document_hash = f"{document_hash}-p{source_pages[0]}"
+            trace("Invoice on page(s) %s of the upload", source_pages)
         
-        # Remove repeated footers (typically "Vystavil:" or similar at end of pages)
-        # Look for pattern: Vystavil: [text] [dashes]
-        raw_text_display = re.sub(r'Vystavil:.*?[\-—]{2,}.*?(?=\n|$)', '', raw_text_display, flags=re.MULTILINE | re.DOTALL)
+        # Open the file as a page source - pages are rasterized one at a time while they are OCR'd
+        # (kept open until failing lines were OCR'd again, with the line boxes of every page)
+        try:
+            pages = PageSource(
+                file_bytes,
+                request.file_name,
+                cancellation,
+                line_boxes=compiled.line_reocr,
+                first_pass_dpi=FIRST_PASS_DPI,
+                table_grid=compiled.table_grid,
+                grid_header_rows=compiled.grid_header_rows,
+                detect_orientation=DETECT_ORIENTATION,
+                source_pages=source_pages,
+                upload=upload
+            )
+        except Exception as e:
+            cancellation.check('convert_to_images')
+            logger.error("Error converting file: %s", e)
+            raise HTTPException(status_code=400, detail="Failed to convert file to images")
+        total_pages = pages.page_count
         
-        # Remove repeated page headers (e.g., "DAŇOVÝ DOKLAD Číslo dokladu XXX Strana: N")
-        raw_text_display = re.sub(r'DAŇOVÝ DOKLAD.*?Strana:\s*\d+\n', '', raw_text_display, flags=re.IGNORECASE)
+        # Blank, repeated and signature-matched pages are left out before OCR
+        triaged = PAGE_TRIAGE or bool(compiled.page_signatures)
+        if triaged:
+            cancellation.check('triage_pages')
+            with stage_timer('triage_pages'):
+                pages.skipped = triage_pages(pages, compiled.page_signatures, PAGE_TRIAGE)
+            if pages.skipped:
+                trace("Page triage: %s of %s page(s) skipped: %s", len(pages.skipped), total_pages,
+                      [(page.page, page.reason) for page in pages.skipped.values()])
         
-        # Remove "continuation" messages that appear between pages
-        # Example: "Tento doklad má pokračování na stránce č. 2"
-        continuation_patterns = [
-            r'Tento\s+doklad\s+má\s+pokračování\s+na\s+stránce\s+č\.\s*\d+',
-            r'pokračování\s+na\s+stránce\s+č\.\s*\d+',
-            r'continuation\s+on\s+page\s+\d+',
-        ]
-        for pattern in continuation_patterns:
-            raw_text_display = re.sub(pattern, '', raw_text_display, flags=re.IGNORECASE)
-            logger.debug(f"Removed continuation pattern: {pattern}")
+        # Pages in memory at once, within the per-request budget (shared by the invoices of a split upload)
+        window = page_window or min(PAGE_WORKERS, pages.window(PAGE_MEMORY_BUDGET_MB * 1024 * 1024))
         
-        # Find and keep ONLY the first table header, remove all subsequent ones
-        table_header_pattern = r'Označení\s+dodávky\s+Množství\s+Cena/MJ\s+DPH\s+Sleva\s+Celkem'
-        matches = list(re.finditer(table_header_pattern, raw_text_display))
+        if progress:
+            progress(0, total_pages)
         
-        if len(matches) > 1:
-            # Keep the first match, remove all others
-            logger.info(f"Found {len(matches)} table headers, keeping first and removing {len(matches) - 1} duplicates")
-            
-            # Replace all matches except the first with empty string
-            for match in reversed(matches[1:]):  # Reverse to maintain positions
-                start, end = match.span()
-                raw_text_display = raw_text_display[:start] + raw_text_display[end:]
-        
-        # Also remove "Předmět zdanitelného plnění Množství / j. v CZK bez bez DPH DPH" headers that appear on subsequent pages
-        # This is the Backaldrin table header format
-        backaldrin_header_pattern = r'Předmět\s+zdanitelného\s+plnění\s+Množství\s*/\s*j\.\s+v\s+CZK\s+bez\s+bez\s+DPH\s+DPH'
-        backaldrin_matches = list(re.finditer(backaldrin_header_pattern, raw_text_display, re.IGNORECASE))
-        if len(backaldrin_matches) > 1:
-            logger.info(f"Found {len(backaldrin_matches)} Backaldrin table headers, keeping first and removing {len(backaldrin_matches) - 1} duplicates")
-            for match in reversed(backaldrin_matches[1:]):
-                start, end = match.span()
-                raw_text_display = raw_text_display[:start] + raw_text_display[end:]
-        
-        # Clean up excessive blank lines (more than 2 consecutive newlines)
-        raw_text_display = re.sub(r'\n{3,}', '\n\n', raw_text_display)
-        
-        # Apply OCR error corrections (common Tesseract mistakes)
-        raw_text_display = fix_ocr_errors(raw_text_display)
+        # Partial results for streaming clients, emitted as pages are OCR'd
+        partial_results = PartialResultStream(compiled, total_pages, events) if events else None
+        
+        trace("Processing %s page(s), %s at a time", total_pages, window)
+        
+        # Rasterize, OCR and scan all pages for QR codes (page worker pool, results kept in page order)
+        page_results = process_pages(
+            pages,
+            compiled.language,
+            compiled.ocr_config,
+            window,
+            cancellation,
+            progress,
+            partial_results.on_page if partial_results else None,
+            partial(page_match_rate, compiled) if pages.first_pass_dpi else None
+        )
+        metrics.inc('pages_processed_total', total_pages - len(pages.skipped), display_layout=_metric_layout.get())
+        escalated_pages = sorted(pages.escalated) if pages.first_pass_dpi else None
+        if escalated_pages is not None:
+            trace("Adaptive DPI: %s of %s page(s) OCR'd again at %s DPI: %s", len(escalated_pages), total_pages, RENDER_DPI, escalated_pages)
+        rotated_pages = [PageRotation(page=page_num, degrees=pages.rotation[page_num]) for page_num in sorted(pages.rotation)]
+        if pages.detect_orientation:
+            trace("Orientation detection: %s of %s page(s) turned upright: %s", len(rotated_pages), total_pages,
+                  [(page.page, page.degrees) for page in rotated_pages])
+        
+        page_texts = [page_text for page_text, _ in page_results]
+        for page_num, page_text in enumerate(page_texts, 1):
+            trace("Page %s OCR completed, text length: %s", page_num, len(page_text))
+        
+        # Combine all pages
+        raw_text = page_marked_text(page_texts)
+        
+        trace("OCR completed for all pages, total text length: %s", len(raw_text))
+        
+        # Remove page markers and clean up page breaks for seamless table extraction
+        raw_text_display = clean_ocr_text(raw_text)
         
         # Extract data using template patterns (use cleaned text for better extraction)
-        patterns = request.template_config.get('patterns', {})
-        
-        # Override patterns for specific suppliers based on display_layout
-        # This ensures proven patterns are always used, regardless of template configuration
-        display_layout = request.template_config.get('display_layout', '')
-        if display_layout.lower() == 'makro':
-            logger.info("🔧 Makro display_layout detected - overriding invoice_number pattern")
-            # Makro invoice number format: "Faktura č./ VS: 0874100615" or "Faktura č./VS: 0875300275"
-            # Pattern handles variations in spacing around "/" and different invoice number lengths
-            # OCR may have: "č./ VS:" (space after /), "č./VS:" (no space), "č. / VS:" (space before /), "č. /VS:" (space before /, no space after)
-            # Also handle cases where "/" might be missing: "č. VS:" or "č. VS:"
-            patterns['invoice_number'] = r'Faktura\s+č\.\s*/?\s*VS:\s*(\d{8,10})'
-            logger.info(f"   Using Makro invoice_number: {patterns['invoice_number']}")
-        elif display_layout.lower() == 'dekos':
-            logger.info("🔧 Dekos display_layout detected - overriding invoice_number pattern")
-            # Override invoice number pattern to handle Czech diacritics (DAŇOVÝ vs DANOVY)
-            # Support both with and without diacritics
-            patterns['invoice_number'] = r'(?:DAŇOVÝ|DANOVY|Daňový|Danovy)\s+DOKLAD\s*-\s*faktura\s+č\.\s*(\d{5,})'
-            logger.info(f"   Using Dekos invoice_number: {patterns['invoice_number']}")
-        elif display_layout.lower() == 'zeelandia':
-            logger.info("🔧 Zeelandia display_layout detected - overriding patterns (pure sequence)")
-            # Zeelandia: Labels and values are SEPARATED (labels first, values after)
-            # Extract by pure value patterns in sequence order
-            
-            # 1st: Invoice number - first standalone 9-digit number (after "Zeelandia" company name)
-            patterns['invoice_number'] = r'Zeelandia[\s\S]+?(\d{9})'
-            # 2nd: Total amount - first amount with space thousands separator (e.g., "33 751,78")
-            patterns['total_amount'] = r'(\d{1,3}(?:\s\d{3})*,\d{2})\s*(?:CZK|Kč)'
-            # 3rd: Date - first date in DD.MM.YYYY format (appears multiple times, take first)
-            patterns['date'] = r'(\d{1,2}\.\d{1,2}\.\d{4})'
-            # 4th: Payment type - word after all dates, not "DIČ" (look for Czech payment terms)
-            patterns['payment_type'] = r'(?:\d{1,2}\.\d{1,2}\.\d{4})\s+([A-ZÁ-Žá-žů][a-zá-žů]+(?:\s+[a-zá-žů]+)?)'
-            
-            # Hardcode supplier for Zeelandia
-            patterns['supplier_override'] = 'zeelandia'
-            
-            logger.info(f"   Using Zeelandia invoice_number (pure sequence): {patterns['invoice_number']}")
-            logger.info(f"   Using Zeelandia total_amount (pure sequence): {patterns['total_amount']}")
-            logger.info(f"   Using Zeelandia date (pure sequence): {patterns['date']}")
-            logger.info(f"   Using Zeelandia payment_type (pure sequence): {patterns['payment_type']}")
-            logger.info(f"   Using Zeelandia hardcoded supplier: zeelandia")
+        # Supplier overrides were applied when the template was compiled
+        patterns = compiled.patterns
         
         invoice_number = extract_pattern(raw_text_display, patterns.get('invoice_number'))
         date = extract_pattern(raw_text_display, patterns.get('date'))
@@ -224,25 +1571,26 @@ async def process_invoice(request: ProcessInvoiceRequest):
         
         # Extract total amount with detailed logging
         total_amount_pattern = patterns.get('total_amount')
-        logger.info(f"🔍 Extracting total_amount with pattern: {total_amount_pattern}")
-        
-        # Debug: Search for "Celková částka" in the text
-        if 'celková částka' in raw_text_display.lower():
-            logger.info(f"✅ Found 'Celková částka' in text")
-            # Find all occurrences
-            lines = raw_text_display.split('\n')
-            for i, line in enumerate(lines):
-                if 'celková částka' in line.lower():
-                    logger.info(f"   Line {i}: '{line.strip()}'")
-                    # Show surrounding lines
-                    if i > 0:
-                        logger.info(f"   Previous line {i-1}: '{lines[i-1].strip()}'")
-                    if i < len(lines) - 1:
-                        logger.info(f"   Next line {i+1}: '{lines[i+1].strip()}'")
-        else:
-            logger.warning(f"❌ 'Celková částka' NOT found in text")
-            # Show first 500 chars to help debug
-            logger.warning(f"   First 500 chars of text: {raw_text_display[:500]}")
+        trace("🔍 Extracting total_amount with pattern: %s", total_amount_pattern)
+        
+        # Debug: Search for "Celková částka" in the text (diagnostics only - splits the whole text)
+        if trace_enabled():
+            if 'celková částka' in raw_text_display.lower():
+                trace("✅ Found 'Celková částka' in text")
+                # Find all occurrences
+                lines = raw_text_display.split('\n')
+                for i, line in enumerate(lines):
+                    if 'celková částka' in line.lower():
+                        trace("   Line %s: '%s'", i, line.strip())
+                        # Show surrounding lines
+                        if i > 0:
+                            trace("   Previous line %s: '%s'", i - 1, lines[i - 1].strip())
+                        if i < len(lines) - 1:
+                            trace("   Next line %s: '%s'", i + 1, lines[i + 1].strip())
+            else:
+                trace("❌ 'Celková částka' NOT found in text")
+                # Show first 500 chars to help debug
+                trace("   First 500 chars of text: %s", raw_text_display[:500])
         
         total_amount_str = extract_pattern(raw_text_display, total_amount_pattern)
         if total_amount_str:
@@ -253,64 +1601,82 @@ async def process_invoice(request: ProcessInvoiceRequest):
             total_amount = extract_number(total_amount_str)
             # Round to 2 decimal places for currency (especially important for Le-co "CELKEM")
             total_amount = round(total_amount, 2)
-            logger.info(f"💰 Total amount extracted: '{total_amount_str}' (cleaned) -> {total_amount}")
+            trace("💰 Total amount extracted: '%s' (cleaned) -> %s", total_amount_str, total_amount)
         else:
             total_amount = 0
-            logger.warning(f"⚠️ Total amount not found with pattern: {total_amount_pattern}")
+            logger.warning("⚠️ Total amount not found with pattern: %s", total_amount_pattern)
             # Try to manually test the pattern
-            if total_amount_pattern:
+            if total_amount_pattern and trace_enabled():
                 try:
                     test_match = re.search(total_amount_pattern, raw_text_display, re.IGNORECASE | re.MULTILINE)
                     if test_match:
-                        logger.warning(f"   ⚠️ BUT re.search() DID find match: '{test_match.group(1) if test_match.groups() else test_match.group(0)}'")
+                        trace("   ⚠️ BUT re.search() DID find match: '%s'", test_match.group(1) if test_match.groups() else test_match.group(0))
                     else:
-                        logger.warning(f"   ❌ re.search() also failed - pattern likely doesn't match")
+                        trace("   ❌ re.search() also failed - pattern likely doesn't match")
                         # Try simpler pattern
                         simple_test = re.search(r'Celková částka.*?(\d[\d\s,\.]+)', raw_text_display, re.IGNORECASE)
                         if simple_test:
-                            logger.warning(f"   💡 Simple pattern found: '{simple_test.group(1)}'")
+                            trace("   💡 Simple pattern found: '%s'", simple_test.group(1))
                 except Exception as e:
-                    logger.error(f"   Error testing pattern: {e}")
+                    trace("   Error testing pattern: %s", e)
         
         payment_type = extract_pattern(raw_text_display, patterns.get('payment_type'))
         
-        # Extract line items (use cleaned text for seamless multi-page extraction)
-        items = extract_line_items(
-            raw_text_display,
-            images[0],
-            request.template_config,
-            language,
-            psm
-        )
+        # Ruled table pages were read column by column; the items of the other pages come from their text,
+        # one extraction per run of consecutive text pages so tables continue across page breaks
+        items = []
+        corrected = 0
+        text_run: List[int] = []
+        for page_num in range(1, total_pages + 2):
+            if page_num <= total_pages and page_num not in pages.grid_items:
+                text_run.append(page_num)
+                continue
+            if text_run:
+                run_items, run_corrected = extract_text_items(pages, page_texts, text_run, compiled, cancellation)
+                items.extend(run_items)
+                corrected += run_corrected
+                text_run = []
+            if page_num in pages.grid_items:
+                items.extend(pages.grid_items[page_num])
+        if pages.grid_items:
+            for line_number, item in enumerate(items, 1):
+                item.line_number = line_number
+            trace("Items read from the ruled tables of page(s) %s: %s", sorted(pages.grid_items),
+                  sum(len(grid_items) for grid_items in pages.grid_items.values()))
+        if corrected:
+            raw_text_display = clean_ocr_text(page_marked_text(page_texts))
+        pages.close()
+        metrics.inc('items_extracted_total', len(items), display_layout=_metric_layout.get())
+        
+        # Ingredient candidates for every item - one index lookup each
+        if ingredient_index.version and items:
+            with stage_timer('match_ingredients'):
+                for item in items:
+                    item.ingredient_candidates = ingredient_index.match(item.product_code, item.description, request.supplier_id)
         
-        # Detect QR codes from all pages
-        qr_codes = []
-        for page_num, image in enumerate(images, 1):
-            page_qr_codes = detect_qr_codes(image, page_num)
-            qr_codes.extend(page_qr_codes)
+        # QR codes were detected on each page right after its OCR (the page images are released since)
+        qr_codes = [qr for _, page_qr_codes in page_results for qr in page_qr_codes]
         
         if qr_codes:
-            logger.info(f"Found {len(qr_codes)} QR code(s) across all pages")
+            trace("Found %s QR code(s) across all pages", len(qr_codes))
             for qr in qr_codes:
-                logger.info(f"  Page {qr.page}: {qr.type} - {qr.data[:100]}...")
+                trace("  Page %s: %s - %s...", qr.page, qr.type, qr.data[:100])
         
         # Fallback: If total_amount is 0 or very small, calculate from line items (with VAT included)
         if total_amount <= 0.01 and items:
             calculated_total = sum(item.line_total for item in items if item.line_total > 0)
             if calculated_total > 0:
                 total_amount = round(calculated_total, 2)
-                logger.info(f"💰 Total amount was 0.00, calculated from line items: {calculated_total:.2f} -> {total_amount}")
+                trace("💰 Total amount was 0.00, calculated from line items: %.2f -> %s", calculated_total, total_amount)
             else:
-                logger.warning(f"⚠️ Total amount is 0.00 and cannot be calculated from line items (no valid line_total values)")
+                logger.warning("⚠️ Total amount is 0.00 and cannot be calculated from line items (no valid line_total values)")
         
         # Le-co specific: Round up total amount to whole crowns (Czech rounding practice for cash payments)
-        display_layout = request.template_config.get('display_layout', '')
-        if display_layout.lower() in ['leco', 'le-co'] and total_amount > 0:
+        if compiled.display_layout in ['leco', 'le-co'] and total_amount > 0:
             original_total = total_amount
-            import math
             total_amount = math.ceil(total_amount)
             if total_amount != original_total:
-                logger.info(f"💰 Le-co rounding: {original_total:.2f} Kč -> {total_amount:.2f} Kč (rounded up to whole crowns)")
+                trace("💰 Le-co rounding: %.2f Kč -> %.2f Kč (rounded up to whole crowns)", original_total, total_amount)
         
         # Calculate confidence based on extracted data
         confidence = calculate_confidence({
@@ -319,7 +1685,29 @@ async def process_invoice(request: ProcessInvoiceRequest):
             'items': items,
         })
         
-        logger.info(f"Extraction complete: {len(items)} items, confidence: {confidence:.2f}")
+        logger.info("Extraction complete: %s page(s), %s items, confidence: %.2f", total_pages, len(items), confidence)
+        metrics.inc('invoices_processed_total', display_layout=_metric_layout.get())
+        
+        # Full text stays available by document hash - responses only carry it when asked to
+        raw_texts.put(document_hash, raw_text_display)
+        if request.include_raw_text:
+            raw_text = raw_text_display if len(raw_text_display) < 20000 else raw_text_display[:20000] + "\n\n... (text truncated for display)"
+        else:
+            raw_text = None
+        
+        profile_entries = None
+        if profile:
+            profiler.disable()
+            profile_entries = profile.top_functions(PROFILE_TOP_FUNCTIONS)
+            profiles.add({
+                'file_name': request.file_name,
+                'display_layout': compiled.display_layout,
+                'document_hash': document_hash,
+                'requested': request.profile,  # false: sampled
+                'duration_seconds': round(time.perf_counter() - started, 3),
+                'recorded_at': time.time(),
+                'functions': profile_entries,
+            })
         
         return ProcessInvoiceResponse(
             invoice_number=invoice_number,
@@ -327,15 +1715,496 @@ async def process_invoice(request: ProcessInvoiceRequest):
             supplier=supplier,
             total_amount=total_amount,
             payment_type=payment_type,
-            items=items,
+            items=[to_invoice_item(item) for item in items],  # The only place parsed items become API models
             confidence=confidence,
-            raw_text=raw_text_display if len(raw_text_display) < 20000 else raw_text_display[:20000] + "\n\n... (text truncated for display)",
+            raw_text=raw_text,
             qr_codes=qr_codes,
+            diagnostics=diagnostics,
+            document_hash=document_hash,
+            profile=profile_entries if request.profile else None,
+            escalated_pages=escalated_pages,
+            skipped_pages=[pages.skipped[page_num] for page_num in sorted(pages.skipped)] if triaged else None,
+            rotated_pages=rotated_pages if pages.detect_orientation else None,
+            source_pages=source_pages,
         )
+    except RequestCancelled as e:
+        metrics.inc('requests_cancelled_total', reason=e.reason, stage=e.stage)
+        metrics.inc('invoices_failed_total', display_layout=_metric_layout.get(), reason='cancelled')
+        logger.warning("Stopped processing %s: %s", request.file_name, e)
+        raise
+    except HTTPException as e:
+        metrics.inc('invoices_failed_total', display_layout=_metric_layout.get(), reason=f'http_{e.status_code}')
+        raise
+    except Exception:
+        metrics.inc('invoices_failed_total', display_layout=_metric_layout.get(), reason='error')
+        raise
+    finally:
+        if pages is not None:
+            pages.close()
+        if profiler:
+            profiler.disable()
+        _profile.reset(profile_token)
+        _metric_layout.reset(layout_token)
+        _diagnostics.reset(diagnostics_token)
+
+def run_split_pipeline(request: ProcessInvoiceRequest, cancellation: Optional[Cancellation] = None) -> List[ProcessInvoiceResponse]:
+    """
+    Process an upload that may merge several invoices (blocking) - split_invoice_pages finds where each one
+    starts, then the invoices are processed concurrently, each as its own document (run_invoice_pipeline with
+    its source_pages). Returns one response per invoice in page order; the split is traced into the first one.
+    """
+    if cancellation is None:
+        cancellation = Cancellation()
+    compiled = CompiledTemplate(request.template_config)
+    diagnostics: Optional[List[str]] = [] if request.trace else None
+    diagnostics_token = _diagnostics.set(diagnostics)
+    layout_token = _metric_layout.set(compiled.display_layout or 'none')
+    try:
+        with stage_timer('decode'):
+            file_bytes = base64.b64decode(request.file_base64)
+        try:
+            pages = PageSource(file_bytes, request.file_name, cancellation)
+        except Exception as e:
+            cancellation.check('convert_to_images')
+            logger.error("Error converting file: %s", e)
+            raise HTTPException(status_code=400, detail="Failed to convert file to images")
+        # Kept open while the invoices are processed - they render their pages from its PDF file
+        try:
+            cancellation.check('split_invoices')
+            with stage_timer('split_invoices'):
+                invoices = split_invoice_pages(pages, compiled, cancellation)
+            logger.info("Split %s: %s invoice(s) in %s page(s)", request.file_name, len(invoices), pages.page_count)
+            metrics.inc('split_invoices_total', len(invoices), display_layout=_metric_layout.get())
+            
+            # The invoices share the request's page window (and so its page budget) - as many run at once
+            # as the window has pages, each with an equal part of it
+            window = min(PAGE_WORKERS, pages.window(PAGE_MEMORY_BUDGET_MB * 1024 * 1024))
+            parallel = min(len(invoices), window)
+            trace("Processing %s invoice(s), %s at a time with %s page(s) each", len(invoices), parallel, window // parallel)
+            invoice_task = partial(
+                run_invoice_pipeline,
+                request,
+                compiled=compiled,
+                cancellation=cancellation,
+                file_bytes=file_bytes,
+                upload=pages,
+                page_window=window // parallel
+            )
+            results: Dict[int, ProcessInvoiceResponse] = {}
+            in_flight: Dict[Future, int] = {}
+            next_invoice = 0
+            try:
+                while len(results) < len(invoices):
+                    while next_invoice < len(invoices) and len(in_flight) < parallel:
+                        future = _split_executor.submit(
+                            contextvars.copy_context().run,
+                            partial(invoice_task, source_pages=invoices[next_invoice][0])
+                        )
+                        in_flight[future] = next_invoice
+                        next_invoice += 1
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[in_flight.pop(future)] = future.result()
+            except Exception:
+                for future in in_flight:
+                    future.cancel()
+                # Invoices still running stop at their next check instead of rendering from a closed upload
+                cancellation.cancel('split_invoice_failed')
+                wait(in_flight)
+                raise
+        finally:
+            pages.close()
+        results = [results[index] for index in range(len(invoices))]
+        if diagnostics is not None:
+            results[0].diagnostics = diagnostics + (results[0].diagnostics or [])
+        return results
+    finally:
+        _metric_layout.reset(layout_token)
+        _diagnostics.reset(diagnostics_token)
+
+def page_marked_text(page_texts: List[str], first_page: int = 1) -> str:
+    """OCR text of pages (numbered from first_page), each behind its page marker (clean_ocr_text removes the markers)"""
+    return "\n".join(f"\n--- Page {page_num} ---\n{page_text}" for page_num, page_text in enumerate(page_texts, first_page))
+
+def extract_text_items(
+    pages: 'PageSource',
+    page_texts: List[str],
+    page_nums: List[int],
+    compiled: 'CompiledTemplate',
+    cancellation: Cancellation
+) -> Tuple[List[ParsedItem], int]:
+    """
+    Items of consecutive pages from their OCR text - with line boxes kept (pages.line_boxes), failing table
+    lines are OCR'd again from higher resolution crops first. Returns (items, lines corrected in page_texts).
+    """
+    first_page, last_page = page_nums[0], page_nums[-1]
+    text = clean_ocr_text(page_marked_text(page_texts[first_page - 1:last_page], first_page))
+    cancellation.check('extract_line_items')
+    unmatched_lines: List[str] = []
+    with stage_timer('extract_line_items'):
+        items = extract_line_items(text, compiled.config, compiled.language, compiled.psm, compiled, unmatched_lines)
+    
+    # Failing table lines are OCR'd again from higher resolution crops - a few small regions, not another full pass
+    corrected = 0
+    if pages.line_boxes is not None:
+        cancellation.check('reocr_lines')
+        with stage_timer('reocr_lines'):
+            _, table_columns = compiled.table_config(text)
+            corrected = reocr_failing_lines(pages, page_texts, items, unmatched_lines, table_columns, page_nums,
+                                            compiled.language, compiled.ocr_config, cancellation)
+        if corrected:
+            trace("%s line(s) corrected by re-OCR, extracting the items again", corrected)
+            text = clean_ocr_text(page_marked_text(page_texts[first_page - 1:last_page], first_page))
+            with stage_timer('extract_line_items'):
+                items = extract_line_items(text, compiled.config, compiled.language, compiled.psm, compiled)
+    return items, corrected
+
+def extract_header_fields(text: str, patterns: Dict) -> Dict[str, str]:
+    """Header fields (invoice_number, date, supplier, payment_type) found in the text so far"""
+    fields = {
+        'invoice_number': extract_pattern(text, patterns.get('invoice_number')),
+        'date': extract_pattern(text, patterns.get('date')),
+        'supplier': patterns.get('supplier_override') or extract_pattern(text, patterns.get('supplier')),
+        'payment_type': extract_pattern(text, patterns.get('payment_type')),
+    }
+    return {name: value for name, value in fields.items() if value}
+
+class PartialResultStream:
+    """
+    Partial results of one invoice for the streaming endpoint.
+    After each page (in page order) the text OCR'd so far is parsed again and only what is new
+    is emitted: header fields once found, items parsed from the page and the page's QR codes.
+    The final summary event stays authoritative - items spanning a page break are only complete there.
+    """
+    
+    def __init__(self, compiled: CompiledTemplate, total_pages: int, emit: Callable[[str, Dict[str, Any]], None]):
+        self.compiled = compiled
+        self.total_pages = total_pages
+        self.emit = emit
+        self.pages_text: List[str] = []
+        self.header: Dict[str, str] = {}
+        self.items_sent = 0
+        emit('started', {'total_pages': total_pages})
+    
+    def on_page(self, page_num: int, page_text: str, page_qr_codes: List[QRCodeData]) -> None:
+        self.pages_text.append(f"\n--- Page {page_num} ---\n{page_text}")
+        
+        # Partial parses would flood the request diagnostics - only the final parse is traced
+        diagnostics_token = _diagnostics.set(None)
+        try:
+            text = clean_ocr_text("\n".join(self.pages_text))
+            
+            header = extract_header_fields(text, self.compiled.patterns)
+            new_fields = {name: value for name, value in header.items() if name not in self.header}
+            if new_fields:
+                self.header.update(new_fields)
+                self.emit('header', new_fields)
+            
+            items = extract_line_items(
+                text,
+                self.compiled.config,
+                self.compiled.language,
+                self.compiled.psm,
+                self.compiled
+            )
+        finally:
+            _diagnostics.reset(diagnostics_token)
         
+        if len(items) > self.items_sent:
+            self.emit('items', {
+                'page': page_num,
+                'items': [to_invoice_item(item).model_dump() for item in items[self.items_sent:]],
+            })
+            self.items_sent = len(items)
+        
+        if page_qr_codes:
+            self.emit('qr_codes', {'page': page_num, 'qr_codes': [qr.model_dump() for qr in page_qr_codes]})
+        
+        self.emit('page', {'page': page_num, 'total_pages': self.total_pages})
+
+class InvoiceJob:
+    """In-memory record of an invoice submitted through POST /jobs"""
+    
+    def __init__(self, request: ProcessInvoiceRequest, projection: Optional[Dict[str, Any]] = None):
+        self.job_id = uuid.uuid4().hex
+        self.request: Optional[ProcessInvoiceRequest] = request
+        self.projection = projection  # Applied to `result` (request.fields)
+        self.status = 'queued'
+        self.pages_done = 0
+        self.total_pages: Optional[int] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[ProcessInvoiceResponse] = None
+        self.error: Optional[str] = None
+    
+    def update_progress(self, pages_done: int, total_pages: int) -> None:
+        self.pages_done = pages_done
+        self.total_pages = total_pages
+    
+    def to_response(self) -> JobStatusResponse:
+        return JobStatusResponse(
+            job_id=self.job_id,
+            status=self.status,
+            pages_done=self.pages_done,
+            total_pages=self.total_pages,
+            submitted_at=self.submitted_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            result=self.result,
+            error=self.error,
+        )
+
+# Embedded job queue: pending jobs wait in the batch admission lane, _jobs keeps their state for polling
+_jobs: Dict[str, InvoiceJob] = {}
+_jobs_lock = threading.Lock()
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='ocr-job')
+_job_tasks: set = set()  # Jobs waiting for admission or running - referenced so they are not garbage collected
+
+def _prune_jobs() -> None:
+    """Forget finished jobs older than JOB_TTL_SECONDS (caller holds _jobs_lock)"""
+    cutoff = time.time() - JOB_TTL_SECONDS
+    expired = [job_id for job_id, job in _jobs.items() if job.finished_at and job.finished_at < cutoff]
+    for job_id in expired:
+        del _jobs[job_id]
+
+async def _run_job(job: InvoiceJob, ticket: AdmissionTicket) -> None:
+    """Runs the regular pipeline on the job worker pool once admitted and records the outcome on the job"""
+    def run() -> ProcessInvoiceResponse:
+        job.status = 'running'
+        job.started_at = time.time()
+        return run_invoice_pipeline(job.request, job.update_progress)
+    
+    try:
+        job.result = await run_admitted(ticket, Cancellation(), run, _job_executor)
+        job.status = 'done'
     except Exception as e:
-        logger.error(f"Error processing invoice: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error("Job %s failed: %s", job.job_id, e, exc_info=True)
+        job.error = getattr(e, 'detail', None) or str(e)
+        job.status = 'failed'
+    finally:
+        # Release the base64 payload - only the result is needed from now on
+        job.request = None
+        job.finished_at = time.time()
+        logger.info("Job %s %s in %.1fs", job.job_id, job.status, job.finished_at - (job.started_at or job.submitted_at))
+
+@app.post("/jobs", response_model=SubmitJobResponse, status_code=202)
+async def submit_job(request: ProcessInvoiceRequest):
+    """
+    Queue an invoice for asynchronous processing (same payload as /process-invoice).
+    Poll GET /jobs/{job_id} for progress and the result.
+    """
+    projection = response_projection(request.fields)
+    try:
+        ticket = admission.enqueue('batch')
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    
+    with _jobs_lock:
+        _prune_jobs()
+        job = InvoiceJob(request, projection)
+        _jobs[job.job_id] = job
+    
+    task = asyncio.ensure_future(_run_job(job, ticket))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    logger.info("Job %s queued: %s", job.job_id, request.file_name)
+    return SubmitJobResponse(job_id=job.job_id, status=job.status, status_url=f"/jobs/{job.job_id}")
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Status, page progress and (when done) the ProcessInvoiceResponse of a queued invoice"""
+    with _jobs_lock:
+        _prune_jobs()
+        job = _jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    include = None
+    if job.projection:
+        include = {name: True for name in JobStatusResponse.model_fields}
+        include['result'] = job.projection
+    return json_response(job.to_response(), include)
+
+async def _run_batch_file(
+    index: int,
+    invoice_file: BatchInvoiceFile,
+    compiled: CompiledTemplate,
+    trace_request: bool,
+    cancellation: Cancellation,
+    ticket: AdmissionTicket,
+    include_raw_text: bool = True,
+    include: Optional[Dict[str, Any]] = None,
+    supplier_id: Optional[str] = None
+) -> str:
+    """One batch file, run on the job worker pool once admitted - returns its NDJSON result line"""
+    try:
+        request = ProcessInvoiceRequest(
+            file_base64=invoice_file.file_base64,
+            file_name=invoice_file.file_name,
+            template_config=compiled.config,
+            trace=trace_request,
+            include_raw_text=include_raw_text,
+            supplier_id=supplier_id,
+        )
+        result = BatchInvoiceResult(
+            index=index,
+            file_name=invoice_file.file_name,
+            status='done',
+            result=await run_admitted(
+                ticket,
+                cancellation,
+                partial(run_invoice_pipeline, request, compiled=compiled, cancellation=cancellation),
+                _job_executor
+            ),
+        )
+    except RequestCancelled as e:
+        result = BatchInvoiceResult(index=index, file_name=invoice_file.file_name, status='failed', error=str(e))
+    except Exception as e:
+        logger.error("Batch file %s (%s) failed: %s", index, invoice_file.file_name, e, exc_info=True)
+        result = BatchInvoiceResult(
+            index=index,
+            file_name=invoice_file.file_name,
+            status='failed',
+            error=getattr(e, 'detail', None) or str(e),
+        )
+    return result.model_dump_json(include=include) + "\n"
+
+@app.post("/process-invoices/batch")
+async def process_invoice_batch(
+    request: ProcessBatchRequest,
+    deadline_ms: Optional[int] = Header(None, alias="X-Deadline-Ms")
+):
+    """
+    Process many invoices in one call.
+    Each distinct template is compiled once and shared by its files, files are processed on the
+    job worker pool and every result is streamed as an NDJSON line (BatchInvoiceResult) as soon
+    as it is ready - in completion order, use `index` to match results to files.
+    Only an explicit X-Deadline-Ms applies to the whole batch, a disconnect cancels the remaining files.
+    """
+    if not request.files:
+        raise HTTPException(status_code=400, detail="Batch contains no files")
+    projection = response_projection(request.fields)
+    include = None
+    if projection:
+        include = {name: True for name in BatchInvoiceResult.model_fields}
+        include['result'] = projection
+    
+    # Compile each distinct template once
+    compiled_templates: Dict[str, CompiledTemplate] = {}
+    file_templates: List[CompiledTemplate] = []
+    for index, invoice_file in enumerate(request.files):
+        template_config = invoice_file.template_config or request.template_config
+        if not template_config:
+            raise HTTPException(status_code=400, detail=f"No template_config for file {index} ({invoice_file.file_name})")
+        template_key = json.dumps(template_config, sort_keys=True)
+        if template_key not in compiled_templates:
+            compiled_templates[template_key] = CompiledTemplate(template_config)
+        file_templates.append(compiled_templates[template_key])
+    
+    logger.info("Batch: %s file(s), %s template(s)", len(request.files), len(compiled_templates))
+    
+    # The whole batch is admitted to the batch lane queue up front - or rejected as a whole.
+    # A batch the queue can never hold would only ever get 429, so it is refused as too large instead
+    if len(request.files) > admission.queue_limits['batch']:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(request.files)} files exceeds the batch queue limit of "
+                   f"{admission.queue_limits['batch']} files - split it into smaller batches"
+        )
+    tickets: List[AdmissionTicket] = []
+    try:
+        for _ in request.files:
+            tickets.append(admission.enqueue('batch'))
+    except AdmissionRejected as e:
+        for ticket in tickets:
+            admission.abandon(ticket)
+        raise admission_error(e)
+    
+    cancellation = Cancellation(request_timeout(deadline_ms, default=None))
+    pending = [
+        asyncio.ensure_future(_run_batch_file(
+            index,
+            invoice_file,
+            compiled,
+            request.trace,
+            cancellation,
+            ticket,
+            request.include_raw_text,
+            include,
+            request.supplier_id,
+        ))
+        for index, (invoice_file, compiled, ticket) in enumerate(zip(request.files, file_templates, tickets))
+    ]
+    
+    async def stream_results():
+        try:
+            for next_result in asyncio.as_completed(pending):
+                yield await next_result
+        finally:
+            # Client stopped reading (disconnect) - skip the files nobody will see
+            if not all(future.done() for future in pending):
+                cancellation.cancel('client_disconnected')
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def clean_ocr_text(raw_text: str) -> str:
+    """
+    Turn the page-marked OCR text into one seamless text for extraction:
+    drops page markers, repeated page headers/footers and table headers, then fixes OCR errors
+    """
+    text = raw_text
+    
+    # Remove page markers
+    text = re.sub(r'\n--- Page \d+ ---\n', '\n', text)
+    
+    # Remove repeated footers (typically "Vystavil:" or similar at end of pages)
+    # Look for pattern: Vystavil: [text] [dashes]
+    text = re.sub(r'Vystavil:.*?[\-—]{2,}.*?(?=\n|$)', '', text, flags=re.MULTILINE | re.DOTALL)
+    
+    # Remove repeated page headers (e.g., "DAŇOVÝ DOKLAD Číslo dokladu XXX Strana: N")
+    text = re.sub(r'DAŇOVÝ DOKLAD.*?Strana:\s*\d+\n', '', text, flags=re.IGNORECASE)
+    
+    # Remove "continuation" messages that appear between pages
+    # Example: "Tento doklad má pokračování na stránce č. 2"
+    continuation_patterns = [
+        r'Tento\s+doklad\s+má\s+pokračování\s+na\s+stránce\s+č\.\s*\d+',
+        r'pokračování\s+na\s+stránce\s+č\.\s*\d+',
+        r'continuation\s+on\s+page\s+\d+',
+    ]
+    for pattern in continuation_patterns:
+        text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+    
+    # Find and keep ONLY the first table header, remove all subsequent ones
+    table_header_pattern = r'Označení\s+dodávky\s+Množství\s+Cena/MJ\s+DPH\s+Sleva\s+Celkem'
+    matches = list(re.finditer(table_header_pattern, text))
+    
+    if len(matches) > 1:
+        # Keep the first match, remove all others
+        trace("Found %s table headers, keeping first and removing %s duplicates", len(matches), len(matches) - 1)
+        
+        # Replace all matches except the first with empty string
+        for match in reversed(matches[1:]):  # Reverse to maintain positions
+            start, end = match.span()
+            text = text[:start] + text[end:]
+    
+    # Also remove "Předmět zdanitelného plnění Množství / j. v CZK bez bez DPH DPH" headers that appear on subsequent pages
+    # This is the Backaldrin table header format
+    backaldrin_header_pattern = r'Předmět\s+zdanitelného\s+plnění\s+Množství\s*/\s*j\.\s+v\s+CZK\s+bez\s+bez\s+DPH\s+DPH'
+    backaldrin_matches = list(re.finditer(backaldrin_header_pattern, text, re.IGNORECASE))
+    if len(backaldrin_matches) > 1:
+        trace("Found %s Backaldrin table headers, keeping first and removing %s duplicates", len(backaldrin_matches), len(backaldrin_matches) - 1)
+        for match in reversed(backaldrin_matches[1:]):
+            start, end = match.span()
+            text = text[:start] + text[end:]
+    
+    # Clean up excessive blank lines (more than 2 consecutive newlines)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    
+    # Apply OCR error corrections (common Tesseract mistakes)
+    with stage_timer('fix_ocr_errors'):
+        text = fix_ocr_errors(text)
+    
+    return text
 
 def fix_ocr_errors(text: str) -> str:
     """
@@ -377,103 +2246,977 @@ def fix_ocr_errors(text: str) -> str:
     # Only match when there's a comma separator to avoid breaking decimals
     text = re.sub(r'(\d+,\d+)\.\s+', r'\1 ', text)
     
-    # Fix 6: VAT rate corrections - "2%" should be "12%" in most cases
-    # Pattern: space + "2%" at the end of a line or before currency
-    text = re.sub(r'\s2%(?=\s+[A-Z]{2,3}\s|$)', ' 12%', text)
+    # Fix 6: VAT rate corrections - "2%" should be "12%" in most cases
+    # Pattern: space + "2%" at the end of a line or before currency
+    text = re.sub(r'\s2%(?=\s+[A-Z]{2,3}\s|$)', ' 12%', text)
+    
+    # Fix 7: Another common VAT error - "21%" sometimes appears as "215" 
+    # Pattern: "215" followed by space and currency or end of line
+    text = re.sub(r'215(?=\s+[A-Z]{2,3}\s|$)', '21%', text)
+    
+    # Fix 8: Remove table border characters (|) used in old-school invoice designs
+    # These are visual separators that interfere with data extraction
+    # Remove at start/end of lines and between columns
+    lines = text.split('\n')
+    cleaned_lines = []
+    for line in lines:
+        # Remove leading and trailing pipes
+        line = re.sub(r'^\s*\|+\s*', '', line)
+        line = re.sub(r'\s*\|+\s*$', '', line)
+        # Replace pipes between columns with single space
+        line = re.sub(r'\s*\|\s*', ' ', line)
+        cleaned_lines.append(line)
+    text = '\n'.join(cleaned_lines)
+    
+    # Fix 9: Remove extraneous dashes before dates (Dekos format)
+    # Pattern: "Datum splatnosti: — 03.10.2025" → "Datum splatnosti: 03.10.2025"
+    # Remove em-dash (—), en-dash (–), and regular dash (-) when followed by a date
+    text = re.sub(r':\s*[—–-]+\s*(\d{1,2}\.\d{1,2}\.\d{4})', r': \1', text)
+    
+    # Fix 10: Fix capacity indicators misread as numbers (Dekos format)
+    # Pattern: "STOP BAKTER 51 108,1300" → "STOP BAKTER 5L 108,1300"
+    # BUT: "STOP BAKTER 5L 51 108,1300" → no change (51 is thousands separator, not OCR error)
+    # Strategy: Don't fix if the same digit appears in a capacity indicator earlier on the same line
+    # Process line by line to avoid cross-line matches
+    lines = text.split('\n')
+    fixed_lines = []
+    for line in lines:
+        # Find all potential X1 patterns that need fixing
+        # Pattern: NOT preceded by digit + word + space + X1 + space + price_with_4_decimals
+        # Use word boundary to avoid matching "5L 51" where "L" from "5L" would be matched
+        def replace_if_not_duplicate(match):
+            letter = match.group(1)
+            digit = match.group(2)
+            price = match.group(3)
+            # Check if "{digit}L" or "{digit}I" already exists earlier in the line
+            capacity_indicator = f"{digit}L"
+            capacity_indicator_alt = f"{digit}I"
+            line_before_match = line[:match.start()]
+            if capacity_indicator in line_before_match or capacity_indicator_alt in line_before_match:
+                # Don't change - capacity indicator already exists
+                return match.group(0)  # Return original
+            else:
+                # Fix: X1 → XL
+                return f"{letter} {digit}L {price}"
+        
+        # Pattern: word boundary + letter (not preceded by digit) + space + X1 + space + price
+        # Negative lookbehind (?<!\d) ensures the letter isn't part of a capacity indicator like "5L"
+        fixed_line = re.sub(
+            r'(?<!\d)([A-Za-zá-žÁ-Ž])\s+(\d)1\s+(\d+(?:\s\d+)?,\d{4})',
+            replace_if_not_duplicate,
+            line
+        )
+        fixed_lines.append(fixed_line)
+    text = '\n'.join(fixed_lines)
+    
+    trace("Applied OCR error corrections")
+    return text
+
+def _pdf_page_bytes(info: Dict[str, Any], page_count: int) -> List[int]:
+    """Decoded RGB size of each page at RENDER_DPI, from the pdfinfo page sizes (A4 when not reported)"""
+    page_sizes = {}
+    for key, value in info.items():
+        # "Page size" for single page output, "Page    3 size" when pdfinfo lists a page range
+        key_match = re.match(r'Page\s*(\d*)\s+size$', key)
+        size_match = re.match(r'([\d.]+) x ([\d.]+) pts', str(value))
+        if key_match and size_match:
+            page_sizes[int(key_match.group(1) or 1)] = (float(size_match.group(1)), float(size_match.group(2)))
+    
+    page_bytes = []
+    for page_num in range(1, page_count + 1):
+        width_pts, height_pts = page_sizes.get(page_num, (595.0, 842.0))
+        page_bytes.append(int(width_pts / 72 * RENDER_DPI) * int(height_pts / 72 * RENDER_DPI) * 3)
+    return page_bytes
+
+EXIF_ORIENTATION = 0x0112
+IMAGE_SCALE_TOLERANCE = 1.25  # A reduced JPEG decode this close to the normalized size is OCR'd as it is
+
+def normalized_size(image: Image.Image) -> Tuple[int, int]:
+    """
+    Size an opened image is OCR'd at (before EXIF rotation) - its decoder is set up for it, nothing is decoded yet
+    Scans with a resolution above RENDER_DPI are scaled to it, anything else - phone photos carry no meaningful
+    DPI - to a long side of IMAGE_MAX_SIDE. Images are never scaled up.
+    """
+    width, height = image.size
+    scale = 1.0
+    dpi = image.info.get('dpi')
+    if dpi and float(dpi[0]) > RENDER_DPI:
+        scale = RENDER_DPI / float(dpi[0])
+    if IMAGE_MAX_SIDE:
+        scale = min(scale, IMAGE_MAX_SIDE / max(width, height))
+    if scale >= 1:
+        return width, height
+    size = max(round(width * scale), 1), max(round(height * scale), 1)
+    # JPEG decodes straight at 1/2, 1/4 or 1/8 scale while that still covers size - no full resolution pixels
+    image.draft(None, size)
+    if max(image.size) <= max(size) * IMAGE_SCALE_TOLERANCE:
+        # Resizing the rest of the way would cost more than OCR spends on the extra pixels
+        return image.size
+    return size
+
+def normalize_image(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """Decode an opened image at size (see normalized_size) with its EXIF orientation applied"""
+    orientation = image.getexif().get(EXIF_ORIENTATION)
+    oriented = image
+    if orientation in (2, 3, 4, 5, 6, 7, 8):
+        oriented = ImageOps.exif_transpose(image)
+        if orientation >= 5:
+            # Turned by 90 degrees
+            size = size[::-1]
+    if oriented.size == size:
+        return oriented
+    # Pillow's bilinear filter antialiases when scaling down - half the cost of Lanczos, as good for text
+    normalized = oriented.resize(size, Image.BILINEAR, reducing_gap=3.0)
+    if oriented is not image:
+        oriented.close()
+    return normalized
+
+PageImage = Union[Image.Image, str]  # Rendered page: decoded image, or the path of its file in PAGE_FILES_DIR
+LineBox = Tuple[int, int, int, int]  # left, top, width, height in pixels of the page as it was OCR'd
+CLOCKWISE_TRANSPOSE = {90: Image.ROTATE_270, 180: Image.ROTATE_180, 270: Image.ROTATE_90}  # PIL turns counter-clockwise
+
+def unturned_box(box: LineBox, degrees: int, turned_size: Tuple[int, int]) -> LineBox:
+    """A box on a page turned clockwise by degrees (turned_size) as the same area of the page before it was turned"""
+    left, top, width, height = box
+    turned_width, turned_height = turned_size
+    if degrees == 90:
+        return top, turned_width - left - width, height, width
+    if degrees == 180:
+        return turned_width - left - width, turned_height - top - height, width, height
+    if degrees == 270:
+        return turned_height - top - height, left, height, width
+    return box
+
+class PageSource:
+    """
+    Uploaded invoice (PDF or image) as pages that are rasterized on demand, one page per render()
+    call - only the pages currently being worked on are held in memory
+    With line_boxes, the OCR text lines of pages are kept with their bounding boxes (for render_region) - taken from
+    the adaptive DPI pass where there is one, otherwise OCR'd when first needed (see page_lines)
+    With first_pass_dpi, PDF pages are rendered at that resolution first (see process_page)
+    With table_grid (item field per table column), ruled table pages are read column strip by column strip into grid_items
+    With PAGE_FILES_DIR set, PDF pages are rendered into files there and passed around as paths (see PageImage)
+    With detect_orientation, pages are checked and turned upright before their OCR (see process_page)
+    With source_pages, only those pages of the PDF are pages 1, 2, ... of the source (one invoice of a split upload)
+    With upload (the open source of a whole PDF upload), its PDF file and page sizes are used - nothing is written or measured again
+    """
+    
+    def __init__(
+        self,
+        file_bytes: bytes,
+        filename: str,
+        cancellation: Cancellation,
+        line_boxes: bool = False,
+        first_pass_dpi: int = 0,
+        table_grid: Optional[List[Optional[str]]] = None,
+        grid_header_rows: int = 1,
+        detect_orientation: bool = False,
+        source_pages: Optional[List[int]] = None,
+        upload: Optional['PageSource'] = None
+    ):
+        self.cancellation = cancellation
+        self.is_pdf = filename.lower().endswith('.pdf')
+        self._pdf_path: Optional[str] = None
+        self._owns_pdf = upload is None  # The upload's PDF file stays until the upload is closed
+        self._image: Optional[Image.Image] = None
+        self._image_size: Optional[Tuple[int, int]] = None  # Images: size to decode at - None once decoded
+        self.line_boxes: Optional[Dict[int, List[Tuple[str, LineBox]]]] = {} if line_boxes else None
+        self.first_pass_dpi = first_pass_dpi if self.is_pdf else 0
+        self.page_dpi: Dict[int, int] = {}  # Resolution each page was OCR'd at
+        self.escalated: List[int] = []  # Pages OCR'd again at RENDER_DPI after the first pass
+        self.table_grid = table_grid
+        self.grid_header_rows = grid_header_rows
+        self.grid_items: Dict[int, List[ParsedItem]] = {}  # Items of the pages with a ruled table
+        self.skipped: Dict[int, SkippedPage] = {}  # Pages left out by triage_pages - never rendered for OCR
+        self.detect_orientation = detect_orientation
+        self.rotation: Dict[int, int] = {}  # Clockwise turn of the pages that were not upright (see turn)
+        self._turned_size: Dict[int, Tuple[int, int]] = {}  # Size of those pages once turned, at page_dpi
+        self._source_pages = source_pages if self.is_pdf else None
+        self.page_files_dir = PAGE_FILES_DIR if self.is_pdf else ''
+        self._file_prefix = f"page_{uuid.uuid4().hex}_"
+        try:
+            if self.is_pdf and upload is not None:
+                # One invoice of a split upload - its pages are rendered from the upload's PDF file
+                self._pdf_path = upload._pdf_path
+                self.page_count = upload.page_count
+                self.page_bytes = upload.page_bytes
+            elif self.is_pdf:
+                # pdftoppm renders single pages from a file - write the PDF once instead of once per page
+                with tempfile.NamedTemporaryFile(prefix='invoice_', suffix='.pdf', delete=False) as pdf_file:
+                    pdf_file.write(file_bytes)
+                    self._pdf_path = pdf_file.name
+                pdf2image = lazy_import('pdf2image')
+                info = pdf2image.pdfinfo_from_path(
+                    self._pdf_path,
+                    first_page=1,
+                    last_page=100000,  # pdfinfo clamps the range - lists the size of every page
+                    timeout=self._timeout()
+                )
+                self.page_count = int(info['Pages'])
+                self.page_bytes = _pdf_page_bytes(info, self.page_count)
+            else:
+                # Image.open only reads the header - pixels are decoded on first use, at the normalized size
+                self._image = Image.open(io.BytesIO(file_bytes))
+                self._image_size = normalized_size(self._image)
+                self.page_count = 1
+                self.page_bytes = [self._image_size[0] * self._image_size[1] * len(self._image.getbands())]
+            if self._source_pages:
+                self.page_bytes = [self.page_bytes[source_page - 1] for source_page in self._source_pages]
+                self.page_count = len(self._source_pages)
+        except Exception:
+            self.close()
+            raise
+    
+    def _timeout(self) -> Optional[int]:
+        # Poppler is killed once it would run past the request deadline
+        remaining = self.cancellation.remaining()
+        return max(int(remaining), 1) if remaining is not None else None
+    
+    def window(self, budget_bytes: int) -> int:
+        """How many pages fit into the memory budget at once (HTTP 413 if not even one does)"""
+        largest = max(self.page_bytes)
+        if largest > budget_bytes:
+            page_num = self.page_bytes.index(largest) + 1
+            raise HTTPException(
+                status_code=413,
+                detail=f"Page {page_num} needs {largest // (1024 * 1024)} MB at {RENDER_DPI} DPI, "
+                       f"over the {budget_bytes // (1024 * 1024)} MB per-request page budget"
+            )
+        return max(budget_bytes // largest, 1)
+    
+    def _decoded_image(self) -> Image.Image:
+        """The uploaded image, decoded at its normalized size and upright on first use"""
+        if self._image_size:
+            image = normalize_image(self._image, self._image_size)
+            if image is not self._image:
+                self._image.close()
+            self._image, self._image_size = image, None
+        return self._image
+    
+    def render(self, page_num: int, dpi: int = RENDER_DPI) -> PageImage:
+        """Rasterize one page (1-based) - images are decoded once, at their normalized size (see normalized_size)"""
+        self.cancellation.check('convert_to_images')
+        if not self.is_pdf:
+            return self._decoded_image()
+        self.page_dpi[page_num] = dpi
+        image = self._rasterize(page_num, dpi)
+        # A page turned upright once is turned again whenever it is rendered (adaptive DPI escalation)
+        return self._turn(page_num, image) if page_num in self.rotation else image
+    
+    def _source_page(self, page_num: int) -> int:
+        """Page number in the PDF"""
+        return self._source_pages[page_num - 1] if self._source_pages else page_num
+    
+    def _rasterize(self, page_num: int, dpi: int) -> PageImage:
+        source_page = self._source_page(page_num)
+        try:
+            if self.page_files_dir:
+                # Written once by poppler and read by tesseract from there - no decode, no second encode
+                return lazy_import('pdf2image').convert_from_path(
+                    self._pdf_path,
+                    dpi=dpi,
+                    first_page=source_page,
+                    last_page=source_page,
+                    output_folder=self.page_files_dir,
+                    output_file=f"{self._file_prefix}{page_num}_{dpi}",
+                    single_file=True,
+                    grayscale=True,
+                    paths_only=True,
+                    timeout=self._timeout()
+                )[0]
+            return lazy_import('pdf2image').convert_from_path(
+                self._pdf_path,
+                dpi=dpi,
+                first_page=source_page,
+                last_page=source_page,
+                timeout=self._timeout()
+            )[0]
+        except Exception:
+            # A poppler timeout means the deadline passed
+            self.cancellation.check('convert_to_images')
+            raise
+    
+    def turn(self, page_num: int, image: PageImage, degrees: int) -> PageImage:
+        """Turn a rendered page clockwise by degrees (90, 180 or 270) - the page is rendered turned from now on"""
+        self.rotation[page_num] = degrees
+        if not self.is_pdf:
+            self._image = self._turn(page_num, self._decoded_image())
+            return self._image
+        return self._turn(page_num, image)
+    
+    def _turn(self, page_num: int, image: PageImage) -> PageImage:
+        method = CLOCKWISE_TRANSPOSE[self.rotation[page_num]]
+        if isinstance(image, str):
+            # Page files are turned in place
+            with Image.open(image) as page:
+                turned = page.transpose(method)
+            turned.save(image)
+            self._turned_size[page_num] = turned.size
+            turned.close()
+            return image
+        turned = image.transpose(method)
+        self._turned_size[page_num] = turned.size
+        image.close()
+        return turned
+    
+    def triage_images(self, dpi: int) -> List[Any]:
+        """Grayscale pixels (numpy arrays) of every page at a low resolution for triage_pages - one poppler run"""
+        np = lazy_import('numpy')
+        if not self.is_pdf:
+            # Images are reduced to about the size of an A4 page at dpi
+            gray = self._decoded_image().convert('L')
+            return [np.array(gray.reduce(max(max(gray.size) // int(11.7 * dpi), 1)))]
+        first_page, last_page = self._source_page(1), self._source_page(self.page_count)
+        try:
+            images = lazy_import('pdf2image').convert_from_path(
+                self._pdf_path, dpi=dpi, first_page=first_page, last_page=last_page, grayscale=True, timeout=self._timeout()
+            )
+        except Exception:
+            self.cancellation.check('triage_pages')
+            raise
+        return [np.array(images[self._source_page(page_num) - first_page]) for page_num in range(1, self.page_count + 1)]
+    
+    def render_region(self, page_num: int, box: LineBox, dpi: int) -> Image.Image:
+        """Part of a page (box as in line_boxes) rasterized at dpi - pdftoppm renders only the cropped area"""
+        self.cancellation.check('reocr_lines')
+        left, top, width, height = box
+        scale = dpi / self.page_dpi.get(page_num, RENDER_DPI)
+        if not self.is_pdf:
+            # Images have no higher resolution - the crop is upscaled instead
+            region = self._decoded_image().crop((left, top, left + width, top + height))
+            return region.resize((max(int(width * scale), 1), max(int(height * scale), 1)), Image.LANCZOS)
+        degrees = self.rotation.get(page_num)
+        if degrees:
+            # Line boxes are on the page turned upright - pdftoppm crops the page as it is in the PDF
+            left, top, width, height = unturned_box(box, degrees, self._turned_size[page_num])
+        source_page = self._source_page(page_num)
+        command = [
+            'pdftoppm', '-r', str(dpi), '-f', str(source_page), '-l', str(source_page),
+            '-x', str(int(left * scale)), '-y', str(int(top * scale)),
+            '-W', str(int(width * scale)), '-H', str(int(height * scale)),
+            '-gray', self._pdf_path
+        ]
+        try:
+            # Without an output file pdftoppm writes the (single page) image to stdout
+            output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=self._timeout()).stdout
+        except subprocess.TimeoutExpired:
+            self.cancellation.check('reocr_lines')
+            raise
+        region = Image.open(io.BytesIO(output))
+        return region.transpose(CLOCKWISE_TRANSPOSE[degrees]) if degrees else region
+    
+    def page_lines(self, page_num: int, language: str, config: str) -> List[Tuple[str, LineBox]]:
+        """OCR text lines of a page with their boxes - the page is OCR'd again, at its resolution, on first use"""
+        if page_num not in self.line_boxes:
+            image = self.render(page_num, self.page_dpi.get(page_num, RENDER_DPI))
+            try:
+                _, self.line_boxes[page_num], _ = run_tesseract_lines(image, language, config, self.cancellation)
+            finally:
+                self.release(image)
+        return self.line_boxes[page_num]
+    
+    def release(self, image: PageImage) -> None:
+        """Free a rendered page once its OCR and QR detection are done"""
+        if isinstance(image, str):
+            try:
+                os.unlink(image)
+            except OSError:
+                pass
+        elif self.is_pdf:
+            image.close()
+    
+    def close(self) -> None:
+        if self._pdf_path and self._owns_pdf:
+            try:
+                os.unlink(self._pdf_path)
+            except OSError:
+                pass
+        self._pdf_path = None
+        if self.page_files_dir and os.path.isdir(self.page_files_dir):
+            # Pages left behind by a poppler run killed at the deadline
+            for name in os.listdir(self.page_files_dir):
+                if name.startswith(self._file_prefix):
+                    try:
+                        os.unlink(os.path.join(self.page_files_dir, name))
+                    except OSError:
+                        pass
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+
+def _run_tesseract_process(command: List[str], cancellation: Cancellation) -> bytes:
+    """Run a tesseract command line, killing it as soon as the request is cancelled; returns its stdout"""
+    try:
+        # Own process group, so a kill also reaches children of wrapper scripts (tesseract_cmd)
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=(os.name == 'posix')
+        )
+    except FileNotFoundError:
+        raise pytesseract.TesseractNotFoundError()
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=TESSERACT_POLL_SECONDS)
+            break
+        except subprocess.TimeoutExpired:
+            if cancellation.cancelled():
+                if os.name == 'posix':
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+                process.communicate()
+                metrics.inc('tesseract_processes_killed_total', reason=cancellation.reason)
+                raise RequestCancelled(cancellation.reason, 'ocr')
+    if process.returncode:
+        raise pytesseract.TesseractError(process.returncode, stderr.decode('utf-8', errors='replace').strip())
+    return stdout
+
+@contextmanager
+def tesseract_input(image: PageImage):
+    """
+    (output base, input file) for a tesseract run: a decoded image is written to a temp file first,
+    a rendered page file is passed as it is. The time this takes is recorded as the page_io stage.
+    """
+    started = time.perf_counter()
+    with pytesseract.pytesseract.save(image) as files:
+        record_stage('page_io', time.perf_counter() - started)
+        yield files
+
+def run_tesseract(image: PageImage, language: str, config: str, cancellation: Cancellation) -> str:
+    """
+    OCR one page - same output as pytesseract.image_to_string, but the tesseract process is
+    killed as soon as the request is cancelled or past its deadline
+    """
+    cancellation.check('ocr')
+    with tesseract_input(image) as (_, input_filename):
+        command = [pytesseract.pytesseract.tesseract_cmd, input_filename, 'stdout', '-l', language] + shlex.split(config)
+        return _run_tesseract_process(command, cancellation).decode('utf-8')
+
+def tsv_lines(tsv: str) -> Tuple[List[Tuple[str, LineBox]], Optional[float]]:
+    """
+    Text lines of tesseract's TSV output (words joined as in its text output) with their boxes, in reading order,
+    and the mean word confidence (None when no word was read)
+    """
+    boxes: Dict[Tuple[str, ...], LineBox] = {}
+    words: Dict[Tuple[str, ...], List[str]] = {}
+    confidences = []
+    for row in tsv.split('\n')[1:]:
+        # level, page_num, block_num, par_num, line_num, word_num, left, top, width, height, conf, text
+        columns = row.split('\t')
+        if len(columns) < 12:
+            continue
+        key = tuple(columns[1:5])
+        if columns[0] == '4':
+            boxes[key] = tuple(int(value) for value in columns[6:10])
+        elif columns[0] == '5' and columns[11].strip():
+            words.setdefault(key, []).append(columns[11].strip())
+            confidences.append(float(columns[10]))
+    lines = [(' '.join(words[key]), box) for key, box in boxes.items() if key in words]
+    return lines, sum(confidences) / len(confidences) if confidences else None
+
+def run_tesseract_lines(
+    image: PageImage,
+    language: str,
+    config: str,
+    cancellation: Cancellation
+) -> Tuple[str, List[Tuple[str, LineBox]], Optional[float]]:
+    """
+    run_tesseract plus the bounding box of every text line and the mean word confidence -
+    the text and TSV outputs come from one tesseract run
+    """
+    cancellation.check('ocr')
+    with tesseract_input(image) as (output_base, input_filename):
+        # Output files next to the temp input are removed with it
+        command = [pytesseract.pytesseract.tesseract_cmd, input_filename, output_base, '-l', language] + shlex.split(config) + ['txt', 'tsv']
+        _run_tesseract_process(command, cancellation)
+        with open(f"{output_base}.txt", encoding='utf-8') as f:
+            text = f.read()
+        with open(f"{output_base}.tsv", encoding='utf-8') as f:
+            lines, confidence = tsv_lines(f.read())
+    return text, lines, confidence
+
+_page_executor = ThreadPoolExecutor(max_workers=max(PAGE_WORKERS, 1), thread_name_prefix='ocr-page')
+# Invoices of split uploads - they mostly wait for their pages on _page_executor
+_split_executor = ThreadPoolExecutor(max_workers=max(PAGE_WORKERS, 1), thread_name_prefix='ocr-split')
+
+def ocr_page(
+    pages: 'PageSource',
+    page_num: int,
+    image: PageImage,
+    language: str,
+    config: str,
+    cancellation: Cancellation
+) -> Tuple[str, Optional[float]]:
+    """
+    OCR one rendered page - (page_text, mean word confidence), the confidence only when adaptive DPI needs it
+    Line boxes come with the confidence (TSV output) - without adaptive DPI they are only read for pages
+    with failing lines (see PageSource.page_lines)
+    """
+    with stage_timer('tesseract'):
+        if not pages.first_pass_dpi:
+            return run_tesseract(image, language, config, cancellation), None
+        page_text, lines, confidence = run_tesseract_lines(image, language, config, cancellation)
+        if pages.line_boxes is not None:
+            pages.line_boxes[page_num] = lines
+        return page_text, confidence
+
+def escalation_reason(
+    page_text: str,
+    confidence: Optional[float],
+    match_rate: Optional[Callable[[str], Optional[float]]]
+) -> Optional[str]:
+    """Why a page OCR'd at the first pass resolution has to be OCR'd again at RENDER_DPI (None: it does not)"""
+    if confidence is None:
+        return 'no_text'
+    if confidence < ESCALATE_CONFIDENCE:
+        return 'confidence'
+    rate = match_rate(page_text) if match_rate else None
+    if rate is not None and rate < ESCALATE_MATCH_RATE:
+        return 'match_rate'
+    return None
+
+ORIENTATION_MAX_SIDE = 1600  # Pages are checked at about 140 DPI (A4) - enough text for OSD at a quarter of the pixels
+OSD_ROTATE = re.compile(r'^Rotate:\s*(\d+)', re.MULTILINE)
+OSD_CONFIDENCE = re.compile(r'^Orientation confidence:\s*([\d.]+)', re.MULTILINE)
+
+def detect_rotation(image: PageImage, cancellation: Cancellation) -> int:
+    """
+    Clockwise turn (0, 90, 180 or 270) that makes a page upright - tesseract's orientation and script detection
+    (--psm 0) on a grayscale copy downscaled to ORIENTATION_MAX_SIDE. Pages OSD is not sure about
+    (below ORIENTATION_CONFIDENCE, or too little text) are left as they are.
+    """
+    cancellation.check('detect_orientation')
+    gray = page_gray(image)
+    scale = ORIENTATION_MAX_SIDE / max(gray.shape)
+    if scale < 1:
+        cv2 = lazy_import('cv2')
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    with tesseract_input(Image.fromarray(gray)) as (_, input_filename):
+        command = [pytesseract.pytesseract.tesseract_cmd, input_filename, 'stdout', '--psm', '0', '-l', 'osd']
+        try:
+            osd = _run_tesseract_process(command, cancellation).decode('utf-8')
+        except pytesseract.TesseractError as e:
+            # "Too few characters" - blank or nearly blank pages
+            trace("Orientation not detected: %s", e)
+            return 0
+    rotate, confidence = OSD_ROTATE.search(osd), OSD_CONFIDENCE.search(osd)
+    if not rotate or not confidence or float(confidence.group(1)) < ORIENTATION_CONFIDENCE:
+        return 0
+    return int(rotate.group(1)) % 360
+
+def process_page(
+    pages: 'PageSource',
+    page_num: int,
+    language: str,
+    config: str,
+    cancellation: Cancellation,
+    match_rate: Optional[Callable[[str], Optional[float]]] = None
+) -> Tuple[str, List[QRCodeData]]:
+    """
+    Rasterize one page, OCR it, read its ruled table (pages.table_grid) and detect its QR codes -
+    the page image is released right after
+    With pages.detect_orientation the page is turned upright first (see detect_rotation)
+    With adaptive DPI (pages.first_pass_dpi) the page is rendered at the lower resolution first and only
+    rendered and OCR'd again at RENDER_DPI when its word confidence or match_rate(page_text) is below threshold
+    """
+    dpi = pages.first_pass_dpi or RENDER_DPI
+    with stage_timer('convert_to_images'):
+        image = pages.render(page_num, dpi)
+    try:
+        if pages.detect_orientation:
+            with stage_timer('detect_orientation'):
+                degrees = detect_rotation(image, cancellation)
+                if degrees:
+                    trace("Page %s turned %s degrees clockwise to be upright", page_num, degrees)
+                    metrics.inc('pages_rotated_total', display_layout=_metric_layout.get(), degrees=str(degrees))
+                    image = pages.turn(page_num, image, degrees)
+        page_text, confidence = ocr_page(pages, page_num, image, language, config, cancellation)
+        if dpi != RENDER_DPI:
+            reason = escalation_reason(page_text, confidence, match_rate)
+            if reason:
+                trace("Page %s escalated from %s to %s DPI (%s, confidence %s)", page_num, dpi, RENDER_DPI, reason,
+                      round(confidence, 1) if confidence is not None else None)
+                metrics.inc('pages_escalated_total', display_layout=_metric_layout.get(), reason=reason)
+                pages.escalated.append(page_num)
+                pages.release(image)
+                with stage_timer('convert_to_images'):
+                    image = pages.render(page_num)
+                page_text, _ = ocr_page(pages, page_num, image, language, config, cancellation)
+        if pages.table_grid:
+            cancellation.check('detect_table_grid')
+            grid_items = read_table_grid(image, page_num, pages.table_grid, pages.grid_header_rows, language, cancellation)
+            if grid_items is not None:
+                pages.grid_items[page_num] = grid_items
+        cancellation.check('detect_qr_codes')
+        with stage_timer('detect_qr_codes'):
+            qr_codes = detect_qr_codes(image, page_num)
+        return page_text, qr_codes
+    finally:
+        pages.release(image)
+
+def process_pages(
+    pages: 'PageSource',
+    language: str,
+    config: str,
+    window: int,
+    cancellation: Cancellation,
+    progress: Optional[Callable[[int, int], None]] = None,
+    on_page: Optional[Callable[[int, str, List[QRCodeData]], None]] = None,
+    match_rate: Optional[Callable[[str], Optional[float]]] = None
+) -> List[Tuple[str, List[QRCodeData]]]:
+    """
+    Process all pages of an invoice on the page worker pool, at most `window` pages in memory at a time
+    Pages skipped by triage count as done with no text and no QR codes
+    Returns (page_text, qr_codes) per page in page order; progress(pages_done, total_pages) is called as
+    pages finish, on_page(page_num, page_text, qr_codes) strictly in page order as soon as all earlier pages are done
+    match_rate(page_text) judges first pass pages with adaptive DPI (see process_page)
+    """
+    total_pages = pages.page_count
+    profile = _profile.get()
+    page_task = profile.wrap(process_page) if profile else process_page
+    results: Dict[int, Tuple[str, List[QRCodeData]]] = {}
+    in_flight: Dict[Future, int] = {}
+    next_page = 1
+    next_in_order = 1
+    try:
+        while len(results) < total_pages:
+            # Keep the window full - a new page is only rendered once an earlier one was released
+            while next_page <= total_pages and len(in_flight) < window:
+                if next_page in pages.skipped:
+                    # Left out by page triage - no rendering, OCR or QR detection
+                    results[next_page] = ('', [])
+                    if progress:
+                        progress(len(results), total_pages)
+                else:
+                    # Page workers run in the request's context (metric labels, diagnostics)
+                    future = _page_executor.submit(
+                        contextvars.copy_context().run,
+                        page_task, pages, next_page, language, config, cancellation, match_rate
+                    )
+                    in_flight[future] = next_page
+                next_page += 1
+            
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_num = in_flight.pop(future)
+                results[page_num] = future.result()
+                if progress:
+                    progress(len(results), total_pages)
+            
+            # Hand out the finished pages that are next in order
+            while next_in_order in results:
+                if on_page:
+                    on_page(next_in_order, *results[next_in_order])
+                next_in_order += 1
+    except Exception:
+        for future in in_flight:
+            future.cancel()
+        raise
+    return [results[page_num] for page_num in range(1, total_pages + 1)]
+
+TRIAGE_MARGIN = 0.04  # Page edges left out of the ink density - scanner shadows, punch holes
+TRIAGE_INK_LEVEL = 200  # Darker pixels are ink; lighter ones are paper tint, bleed-through and scanner noise
+TRIAGE_HASH_SIZE = 32  # Duplicates: 32 x 32 cells of an A4 page hold a few words each, so different pages differ widely
+SIGNATURE_HASH_SIZE = 16  # Signatures: a coarse hash of the page header matches its layout, not its content
+SIGNATURE_REGION = 0.25  # Top share of the page a signature covers
+SIGNATURE_DISTANCE = 0.15  # Default share of signature bits a page may differ in
+
+def ink_density(gray: Any) -> float:
+    """
+    Share of the page (margins excluded) covered by ink - the darkness of ink pixels is summed,
+    so thin text that low resolution rendering turned grey still counts in full
+    """
+    np = lazy_import('numpy')
+    height, width = gray.shape
+    top, left = int(height * TRIAGE_MARGIN), int(width * TRIAGE_MARGIN)
+    inner = gray[top:height - top, left:width - left]
+    if not inner.size:
+        return 0.0
+    darkness = np.where(inner < TRIAGE_INK_LEVEL, 255 - inner.astype(np.int32), 0)
+    return float(darkness.sum()) / (255 * inner.size)
+
+def difference_hash(gray: Any, size: int) -> int:
+    """Perceptual hash of size x size bits: whether each cell of the downscaled page is brighter than its right neighbour"""
+    cv2 = lazy_import('cv2')
+    cells = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (cells[:, 1:] > cells[:, :-1]).flatten()
+    return int.from_bytes(lazy_import('numpy').packbits(bits).tobytes(), 'big')
+
+def hash_distance(a: int, b: int, size: int) -> float:
+    """Share of the size x size bits two hashes differ in"""
+    return bin(a ^ b).count('1') / (size * size)
+
+def header_hash(gray: Any) -> int:
+    """Signature of a page: difference hash of its top SIGNATURE_REGION"""
+    return difference_hash(gray[:max(int(gray.shape[0] * SIGNATURE_REGION), 1)], SIGNATURE_HASH_SIZE)
+
+def triage_pages(pages: PageSource, signatures: List[Tuple[str, int, float]], skip_blank_and_duplicates: bool) -> Dict[int, SkippedPage]:
+    """
+    Pages not worth OCR, decided in page order on all pages rendered at TRIAGE_DPI: blank pages (ink density
+    below TRIAGE_BLANK_INK), repeats of an earlier page that is OCR'd (difference hash within
+    TRIAGE_DUPLICATE_DISTANCE) and pages whose header matches one of the template's signatures
+    Every page's signature is traced, so one can be copied into page_signatures from a trace=true response
+    """
+    skipped: Dict[int, SkippedPage] = {}
+    kept_hashes: List[Tuple[int, int]] = []
+    for page_num, gray in enumerate(pages.triage_images(TRIAGE_DPI), 1):
+        header = header_hash(gray)
+        trace("Page %s signature: %0*x", page_num, SIGNATURE_HASH_SIZE * SIGNATURE_HASH_SIZE // 4, header)
+        label = next((label for label, value, max_distance in signatures
+                      if hash_distance(header, value, SIGNATURE_HASH_SIZE) <= max_distance), None)
+        if label:
+            skipped[page_num] = SkippedPage(page=page_num, reason='signature', detail=label)
+        elif skip_blank_and_duplicates:
+            ink = ink_density(gray)
+            if ink < TRIAGE_BLANK_INK:
+                skipped[page_num] = SkippedPage(page=page_num, reason='blank', detail=f"ink density {ink:.5f}")
+                continue
+            page_hash = difference_hash(gray, TRIAGE_HASH_SIZE)
+            original = next((kept for kept, kept_hash in kept_hashes
+                             if hash_distance(page_hash, kept_hash, TRIAGE_HASH_SIZE) <= TRIAGE_DUPLICATE_DISTANCE), None)
+            if original and TRIAGE_DUPLICATE_DISTANCE > 0:
+                skipped[page_num] = SkippedPage(page=page_num, reason='duplicate', detail=f"repeats page {original}")
+            else:
+                kept_hashes.append((page_num, page_hash))
+    for page in skipped.values():
+        metrics.inc('pages_skipped_total', display_layout=_metric_layout.get(), reason=page.reason)
+    return skipped
+
+SPLIT_DPI = 150  # Merged uploads: pages are rendered at this resolution to find where each invoice starts
+SPLIT_HEADER_SHARE = 0.4  # Top share of the page OCR'd for the invoice number
+
+def read_page_header(pages: PageSource, page_num: int, compiled: 'CompiledTemplate', cancellation: Cancellation) -> Tuple[Optional[str], int]:
+    """(invoice number, header hash) of one page - only the top SPLIT_HEADER_SHARE is OCR'd, at SPLIT_DPI"""
+    with stage_timer('convert_to_images'):
+        image = pages.render(page_num, SPLIT_DPI)
+    try:
+        gray = page_gray(image)
+    finally:
+        pages.release(image)
+    header = Image.fromarray(gray[:max(int(gray.shape[0] * SPLIT_HEADER_SHARE), 1)])
+    with stage_timer('tesseract'):
+        text = run_tesseract(header, compiled.language, compiled.ocr_config, cancellation)
+    return extract_pattern(clean_ocr_text(text), compiled.patterns.get('invoice_number')), header_hash(gray)
+
+def split_invoice_pages(pages: PageSource, compiled: 'CompiledTemplate', cancellation: Cancellation) -> List[Tuple[List[int], str]]:
+    """
+    Invoices of a merged upload as (page numbers, why the first one starts an invoice), in page order
+    A page starts a new invoice when its header holds an invoice number other than the one already read for the
+    current invoice - a page without a number continues it. Only when no page has a readable number, a page starts
+    a new invoice when its header matches the first page of an invoice seen so far (signature distance within
+    SIGNATURE_DISTANCE). Headers are read on the page worker pool.
+    """
+    if pages.page_count == 1:
+        return [([1], 'first_page')]
+    profile = _profile.get()
+    header_task = profile.wrap(read_page_header) if profile else read_page_header
+    futures = [
+        _page_executor.submit(contextvars.copy_context().run, header_task, pages, page_num, compiled, cancellation)
+        for page_num in range(1, pages.page_count + 1)
+    ]
+    try:
+        headers = [future.result() for future in futures]
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+    
+    invoices: List[Tuple[List[int], str]] = []
+    first_page_hashes: List[int] = []
+    current_number: Optional[str] = None
+    numbered = any(number for number, _ in headers)
+    for page_num, (number, page_hash) in enumerate(headers, 1):
+        if page_num == 1:
+            reason = 'first_page'
+        elif numbered:
+            # The first number read for an invoice is its own, whichever page it is on
+            reason = 'invoice_number' if number and current_number and number != current_number else None
+        else:
+            reason = 'signature' if any(
+                hash_distance(page_hash, first_hash, SIGNATURE_HASH_SIZE) <= SIGNATURE_DISTANCE for first_hash in first_page_hashes
+            ) else None
+        if reason:
+            invoices.append(([page_num], reason))
+            first_page_hashes.append(page_hash)
+            current_number = number
+        else:
+            invoices[-1][0].append(page_num)
+            current_number = current_number or number
+        trace("Page %s header: invoice number %s%s", page_num, number, f" - starts an invoice ({reason})" if reason else '')
+    return invoices
+
+ARITHMETIC_CHECK_SHARE = 0.75  # Lines failing quantity × unit_price are only re-OCR'd where most lines of the invoice pass it
+AMOUNT_TOKEN = re.compile(r'\d[.,]\d{2,4}(?![\d.,])')
+
+def _compact(line: str) -> str:
+    """Line text without spacing and table borders - what OCR and clean_ocr_text most often disagree on"""
+    return re.sub(r'[\s|]+', '', line)
+
+def page_match_rate(compiled: 'CompiledTemplate', page_text: str) -> Optional[float]:
+    """
+    Share of a page's amount lines (two or more amounts) that the template's line pattern turned into items -
+    None when the page has none. Judges adaptive DPI first passes; a parse of the page alone, not traced.
+    """
+    diagnostics_token = _diagnostics.set(None)
+    try:
+        text = fix_ocr_errors(page_text)
+        _, table_columns = compiled.table_config(text)
+        unmatched_lines: List[str] = []
+        items = extract_items_from_text(text, table_columns, unmatched_lines)
+    finally:
+        _diagnostics.reset(diagnostics_token)
+    misses = sum(1 for line in unmatched_lines if len(AMOUNT_TOKEN.findall(line)) >= 2)
+    return len(items) / (len(items) + misses) if items or misses else None
+
+def failing_lines(items: List[ParsedItem], unmatched_lines: List[str]) -> List[Tuple[str, bool]]:
+    """
+    Table lines worth a second OCR as (line, arithmetic): items whose quantity × unit_price misses their
+    line_total, then lines that matched no item pattern but carry at least two amounts.
+    Layouts that print package prices or totals with VAT fail the arithmetic on most lines - there it is not used.
+    """
+    priced = [item for item in items if item.source_line and item.quantity > 0 and item.unit_price > 0 and item.line_total > 0]
+    inconsistent = [item.source_line for item in priced if not amounts_match(item.quantity, item.unit_price, item.line_total)]
+    lines = []
+    if len(inconsistent) <= len(priced) * (1 - ARITHMETIC_CHECK_SHARE):
+        lines = [(line, True) for line in inconsistent]
+    lines += [(line, False) for line in unmatched_lines if len(AMOUNT_TOKEN.findall(line)) >= 2]
+    return lines
+
+def reocr_failing_lines(
+    pages: 'PageSource',
+    page_texts: List[str],
+    items: List[ParsedItem],
+    unmatched_lines: List[str],
+    table_columns: Dict,
+    page_nums: List[int],
+    language: str,
+    config: str,
+    cancellation: Cancellation
+) -> int:
+    """
+    OCR the failing table lines again, each from a crop of its page at LINE_REOCR_DPI (pages need line_boxes),
+    and put the readings that parse into a consistent item back into page_texts.
+    Only page_nums are searched for the lines - the line boxes of the pages holding one are read on first use
+    (PageSource.page_lines, with the page's language and config).
+    Returns the number of replaced lines - the caller extracts the items again when there are any.
+    """
+    suspects = failing_lines(items, unmatched_lines)
+    if not suspects:
+        return 0
+    if len(suspects) > LINE_REOCR_MAX_LINES:
+        trace("%s failing lines, only the first %s are OCR'd again", len(suspects), LINE_REOCR_MAX_LINES)
+        suspects = suspects[:LINE_REOCR_MAX_LINES]
+    
+    # Pages holding a failing line - only these need their line boxes
+    suspect_lines = [_compact(line) for line, _ in suspects]
+    box_pages = [
+        page_num for page_num in page_nums
+        if any(difflib.get_close_matches(line, [_compact(text) for text in page_texts[page_num - 1].split('\n')], n=1, cutoff=0.8)
+               for line in suspect_lines)
+    ]
+    futures = [
+        _page_executor.submit(contextvars.copy_context().run, pages.page_lines, page_num, language, config)
+        for page_num in box_pages
+    ]
+    try:
+        page_lines = [future.result() for future in futures]
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
     
-    # Fix 7: Another common VAT error - "21%" sometimes appears as "215" 
-    # Pattern: "215" followed by space and currency or end of line
-    text = re.sub(r'215(?=\s+[A-Z]{2,3}\s|$)', '21%', text)
+    # OCR lines of those pages by compacted text - cleaned lines are found among them by similarity
+    # (a line repeated on several pages is used once per failing line, in page order)
+    located: Dict[str, List[Tuple[int, str, LineBox]]] = {}
+    for page_num, lines in zip(box_pages, page_lines):
+        for text, box in lines:
+            located.setdefault(_compact(text), []).append((page_num, text, box))
+    regions = []
+    for line, arithmetic in suspects:
+        match = difflib.get_close_matches(_compact(line), located, n=1, cutoff=0.8)
+        if match:
+            regions.append((line, arithmetic) + located[match[0]].pop(0))
+            if not located[match[0]]:
+                del located[match[0]]
+        else:
+            metrics.inc('lines_reocr_total', display_layout=_metric_layout.get(), outcome='not_located')
+            trace("Failing line not found among the OCR lines: %s", line[:80])
     
-    # Fix 8: Remove table border characters (|) used in old-school invoice designs
-    # These are visual separators that interfere with data extraction
-    # Remove at start/end of lines and between columns
-    lines = text.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        # Remove leading and trailing pipes
-        line = re.sub(r'^\s*\|+\s*', '', line)
-        line = re.sub(r'\s*\|+\s*$', '', line)
-        # Replace pipes between columns with single space
-        line = re.sub(r'\s*\|\s*', ' ', line)
-        cleaned_lines.append(line)
-    text = '\n'.join(cleaned_lines)
+    def reocr(page_num: int, box: LineBox) -> str:
+        # Some margin around the tight line box - tesseract needs background around the glyphs
+        left, top, width, height = box
+        margin = max(height // 4, 2)
+        region = (max(left - margin, 0), max(top - margin, 0), width + 2 * margin, height + 2 * margin)
+        return ' '.join(run_tesseract(pages.render_region(page_num, region, LINE_REOCR_DPI), language, LINE_REOCR_CONFIG, cancellation).split())
     
-    # Fix 9: Remove extraneous dashes before dates (Dekos format)
-    # Pattern: "Datum splatnosti: — 03.10.2025" → "Datum splatnosti: 03.10.2025"
-    # Remove em-dash (—), en-dash (–), and regular dash (-) when followed by a date
-    text = re.sub(r':\s*[—–-]+\s*(\d{1,2}\.\d{1,2}\.\d{4})', r': \1', text)
+    # The crops are OCR'd in parallel on the page worker pool
+    futures = [
+        _page_executor.submit(contextvars.copy_context().run, reocr, page_num, box)
+        for _, _, page_num, _, box in regions
+    ]
+    try:
+        readings = [future.result() for future in futures]
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
     
-    # Fix 10: Fix capacity indicators misread as numbers (Dekos format)
-    # Pattern: "STOP BAKTER 51 108,1300" → "STOP BAKTER 5L 108,1300"
-    # BUT: "STOP BAKTER 5L 51 108,1300" → no change (51 is thousands separator, not OCR error)
-    # Strategy: Don't fix if the same digit appears in a capacity indicator earlier on the same line
-    # Process line by line to avoid cross-line matches
-    lines = text.split('\n')
-    fixed_lines = []
-    for line in lines:
-        # Find all potential X1 patterns that need fixing
-        # Pattern: NOT preceded by digit + word + space + X1 + space + price_with_4_decimals
-        # Use word boundary to avoid matching "5L 51" where "L" from "5L" would be matched
-        def replace_if_not_duplicate(match):
-            letter = match.group(1)
-            digit = match.group(2)
-            price = match.group(3)
-            # Check if "{digit}L" or "{digit}I" already exists earlier in the line
-            capacity_indicator = f"{digit}L"
-            capacity_indicator_alt = f"{digit}I"
-            line_before_match = line[:match.start()]
-            if capacity_indicator in line_before_match or capacity_indicator_alt in line_before_match:
-                # Don't change - capacity indicator already exists
-                return match.group(0)  # Return original
+    corrected = 0
+    for (_, arithmetic, page_num, ocr_line, _), reading in zip(regions, readings):
+        item = None
+        if reading and _compact(reading) != _compact(ocr_line):
+            item = extract_item_from_line(fix_ocr_errors(reading).strip(), table_columns, 0)
+            if item and item.amounts:
+                reconcile_amounts([item])
+        accepted = bool(item and (item.product_code or item.description)
+                        and (not arithmetic or amounts_match(item.quantity, item.unit_price, item.line_total)))
+        if accepted:
+            page_lines = page_texts[page_num - 1].split('\n')
+            for index, page_line in enumerate(page_lines):
+                if page_line.strip() == ocr_line:
+                    page_lines[index] = reading
+                    page_texts[page_num - 1] = '\n'.join(page_lines)
+                    corrected += 1
+                    break
             else:
-                # Fix: X1 → XL
-                return f"{letter} {digit}L {price}"
-        
-        # Pattern: word boundary + letter (not preceded by digit) + space + X1 + space + price
-        # Negative lookbehind (?<!\d) ensures the letter isn't part of a capacity indicator like "5L"
-        fixed_line = re.sub(
-            r'(?<!\d)([A-Za-zá-žÁ-Ž])\s+(\d)1\s+(\d+(?:\s\d+)?,\d{4})',
-            replace_if_not_duplicate,
-            line
-        )
-        fixed_lines.append(fixed_line)
-    text = '\n'.join(fixed_lines)
-    
-    logger.info("Applied OCR error corrections")
-    return text
+                accepted = False
+        metrics.inc('lines_reocr_total', display_layout=_metric_layout.get(), outcome='corrected' if accepted else 'rejected')
+        trace("Line re-OCR at %s DPI %s: '%s' -> '%s'", LINE_REOCR_DPI, 'accepted' if accepted else 'rejected', ocr_line[:80], reading[:80])
+    return corrected
 
-def convert_to_images(file_bytes: bytes, filename: str) -> List[Image.Image]:
-    """Convert PDF or image file to PIL Image(s)"""
-    try:
-        # Try as PDF first
-        if filename.lower().endswith('.pdf'):
-            images = pdf2image.convert_from_bytes(file_bytes, dpi=300)
-            return images
-        else:
-            # Try as image
-            image = Image.open(io.BytesIO(file_bytes))
-            return [image]
-    except Exception as e:
-        logger.error(f"Error converting file: {e}")
-        return []
+def page_gray(image: PageImage) -> Any:
+    """Grayscale pixels of a page as a numpy array - rendered page files are read straight into it"""
+    if isinstance(image, str):
+        cv2 = lazy_import('cv2')
+        return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+    return lazy_import('numpy').array(image.convert('L'))
 
-def detect_qr_codes(image: Image.Image, page_num: int) -> List[QRCodeData]:
+def detect_qr_codes(image: PageImage, page_num: int) -> List[QRCodeData]:
     """
     Detect and decode QR codes from an image
     """
     qr_codes = []
     
     try:
-        # Convert PIL Image to numpy array for OpenCV
-        img_array = np.array(image)
-        
-        # Convert RGB to BGR (OpenCV uses BGR)
-        if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+        np = lazy_import('numpy')
+        cv2 = lazy_import('cv2')
+        pyzbar = lazy_import('pyzbar.pyzbar')
         
-        # Convert to grayscale for better QR detection
-        gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+        if isinstance(image, str):
+            # Rendered page file (already grayscale)
+            gray = page_gray(image)
+        else:
+            # Convert PIL Image to numpy array for OpenCV
+            img_array = np.array(image)
+            
+            # Convert RGB to BGR (OpenCV uses BGR)
+            if len(img_array.shape) == 3 and img_array.shape[2] == 3:
+                img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+            
+            # Convert to grayscale for better QR detection
+            gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
         
         # Detect QR codes using pyzbar
         decoded_objects = pyzbar.decode(gray)
@@ -489,29 +3232,178 @@ def detect_qr_codes(image: Image.Image, page_num: int) -> List[QRCodeData]:
                     type=qr_type,
                     page=page_num
                 ))
-                logger.info(f"Detected {qr_type} on page {page_num}: {qr_data[:100]}")
+                logger.info("Detected %s on page %s: %s", qr_type, page_num, qr_data[:100])
             else:
-                logger.debug(f"Skipping barcode {qr_type} on page {page_num}: {qr_data[:100]}")
+                logger.debug("Skipping barcode %s on page %s: %s", qr_type, page_num, qr_data[:100])
     
     except Exception as e:
-        logger.error(f"Error detecting QR codes on page {page_num}: {e}")
+        logger.error("Error detecting QR codes on page %s: %s", page_num, e)
     
     return qr_codes
 
+# Ruled tables (template table_columns.grid_columns): cells are read column by column, each with settings for its field
+# Cell fields follow the InvoiceItem types - number cells are parsed (cell_number), text cells are kept as read
+GRID_NUMERIC_FIELDS = {name for name, field in InvoiceItem.model_fields.items() if field.annotation in (float, Optional[float])}
+GRID_TEXT_FIELDS = {name for name, field in InvoiceItem.model_fields.items() if field.annotation in (str, Optional[str])}
+GRID_FIELDS = GRID_NUMERIC_FIELDS | GRID_TEXT_FIELDS
+GRID_NUMERIC_CONFIG = '--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789,.-%'
+GRID_TEXT_CONFIG = '--oem 3 --psm 6'
+GRID_RULE_INSET = 4  # Pixels kept clear of the ruling lines when a column is cropped
+
+_cell_executor = ThreadPoolExecutor(max_workers=max(PAGE_WORKERS, 1) * 2, thread_name_prefix='ocr-cell')
+
+def _line_positions(profile: Any, threshold: float) -> List[int]:
+    """Centers of the runs of a projection profile above threshold - ruling lines are a few pixels thick"""
+    positions = []
+    run: List[int] = []
+    for index in lazy_import('numpy').flatnonzero(profile > threshold):
+        if run and index > run[-1] + 2:
+            positions.append((run[0] + run[-1]) // 2)
+            run = []
+        run.append(int(index))
+    if run:
+        positions.append((run[0] + run[-1]) // 2)
+    return positions
+
+def detect_table_grid(gray: Any) -> Optional[Tuple[List[int], List[int], Any]]:
+    """
+    Ruled table on a grayscale page (numpy array) as (row rule y positions, column rule x positions, rule mask)
+    Vertical rules are found first; the table spans their height and the horizontal rules are the ones across them.
+    A table with rules only around its header and body still gives two rows - see table_rows. None: no ruled table.
+    """
+    np = lazy_import('numpy')
+    cv2 = lazy_import('cv2')
+    height, width = gray.shape
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    # Opening with a long thin kernel keeps only the straight runs - glyph strokes are far shorter
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(height // 30, 10))))
+    columns = _line_positions(vertical.sum(axis=0) / 255, height // 10)
+    if len(columns) < 3:
+        return None
+    covered = np.flatnonzero(vertical[:, columns].max(axis=1))
+    top, bottom = int(covered[0]), int(covered[-1])
+    table_width = columns[-1] - columns[0]
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(table_width // 2, 10), 1)))
+    rows = [
+        y for y in _line_positions(horizontal[:, columns[0]:columns[-1]].sum(axis=1) / 255, table_width * 0.5)
+        if top - GRID_RULE_INSET <= y <= bottom + GRID_RULE_INSET
+    ]
+    # Vertical rules may end in the frame without a closing horizontal rule
+    if not rows or rows[0] > top + GRID_RULE_INSET:
+        rows.insert(0, top)
+    if rows[-1] < bottom - GRID_RULE_INSET:
+        rows.append(bottom)
+    if len(rows) < 2:
+        return None
+    rules = cv2.dilate(cv2.bitwise_or(vertical, horizontal), np.ones((3, 3), np.uint8))
+    return rows, columns, rules
+
+def cell_number(text: str) -> float:
+    """Amount read from a numeric cell - whole cells may carry a % sign or dots as thousands separators"""
+    text = text.replace('%', '').strip()
+    if '.' in text and ',' in text:
+        text = text.replace('.', '')
+    return extract_number(text)
+
+def table_rows(bands: List[Tuple[int, int]], reference_lines: List[Tuple[str, int]]) -> List[Tuple[int, int]]:
+    """
+    Item rows of the table body: the bands between horizontal rules, split where a band holds several text lines
+    of the reference column (tables ruled only between columns have the whole body in one band)
+    """
+    rows = []
+    for band_top, band_bottom in bands:
+        centers = [center for _, center in reference_lines if band_top <= center < band_bottom]
+        if len(centers) < 2:
+            rows.append((band_top, band_bottom))
+            continue
+        bounds = [band_top] + [(upper + lower) // 2 for upper, lower in zip(centers, centers[1:])] + [band_bottom]
+        rows.extend(zip(bounds, bounds[1:]))
+    return rows
+
+def read_table_grid(
+    image: PageImage,
+    page_num: int,
+    fields: List[Optional[str]],
+    header_rows: int,
+    language: str,
+    cancellation: Cancellation
+) -> Optional[List[ParsedItem]]:
+    """
+    Items of a ruled table page read straight from its cells: every column (fields[i], None to skip it) is OCR'd
+    as one strip with its own settings - digits only for amounts - in parallel, and the text lines are put into
+    cells by position. None when the page has no ruled table with len(fields) columns.
+    """
+    with stage_timer('detect_table_grid'):
+        gray = page_gray(image)
+        grid = detect_table_grid(gray)
+    if grid is None or len(grid[1]) - 1 != len(fields):
+        metrics.inc('table_grids_total', display_layout=_metric_layout.get(), outcome='none' if grid is None else 'column_mismatch')
+        trace("Page %s: no ruled table with %s columns (%s)", page_num, len(fields), 'none found' if grid is None else f"{len(grid[1]) - 1} columns")
+        return None
+    rows, columns, rules = grid
+    if len(rows) - 1 <= header_rows:
+        metrics.inc('table_grids_total', display_layout=_metric_layout.get(), outcome='no_body')
+        return None
+    metrics.inc('table_grids_total', display_layout=_metric_layout.get(), outcome='found')
+    
+    # Ruling lines are whitened so tesseract does not read them as | or -
+    gray[rules > 0] = 255
+    body_top, body_bottom = rows[header_rows], rows[-1]
+    
+    def read_column(index: int) -> List[Tuple[str, int]]:
+        left, right = columns[index] + GRID_RULE_INSET, columns[index + 1] - GRID_RULE_INSET
+        strip = Image.fromarray(gray[body_top:body_bottom, left:right])
+        config = GRID_NUMERIC_CONFIG if fields[index] in GRID_NUMERIC_FIELDS else GRID_TEXT_CONFIG
+        _, lines, _ = run_tesseract_lines(strip, language, config, cancellation)
+        return [(text, body_top + top + line_height // 2) for text, (_, top, _, line_height) in lines]
+    
+    with stage_timer('ocr_table_cells'):
+        futures = {
+            fields[index]: _cell_executor.submit(contextvars.copy_context().run, read_column, index)
+            for index in range(len(fields)) if fields[index]
+        }
+        try:
+            column_lines = {field: future.result() for field, future in futures.items()}
+        except Exception:
+            for future in futures.values():
+                future.cancel()
+            raise
+    
+    # Rows follow the amounts column when the body has no rules between items
+    reference = next((field for field in ('line_total', 'unit_price', 'quantity') if field in column_lines), None)
+    bands = list(zip(rows[header_rows:-1], rows[header_rows + 1:]))
+    item_rows = table_rows(bands, column_lines[reference]) if reference else bands
+    
+    items = []
+    for row_top, row_bottom in item_rows:
+        cells = {
+            field: ' '.join(text for text, center in lines if row_top <= center < row_bottom)
+            for field, lines in column_lines.items()
+        }
+        values: Dict[str, Any] = {
+            field: cell_number(text) if field in GRID_NUMERIC_FIELDS else (text.strip() or None)
+            for field, text in cells.items()
+        }
+        if not (values.get('product_code') or values.get('description')):
+            continue
+        items.append(ParsedItem(**values, line_number=len(items) + 1))
+    trace("Page %s: ruled table with %s columns, %s rows read from cells, %s items", page_num, len(fields), len(item_rows), len(items))
+    return items
+
 def extract_pattern(text: str, pattern: Optional[str]) -> Optional[str]:
     """Extract data using regex pattern"""
     if not pattern or not text:
-        logger.debug(f"extract_pattern: Missing pattern or text (pattern={pattern is not None}, text_len={len(text) if text else 0})")
+        trace("extract_pattern: Missing pattern or text (pattern=%s, text_len=%s)", pattern is not None, len(text) if text else 0)
         return None
     
-    # Special logging for total_amount pattern
-    is_total_amount_pattern = 'Celková částka' in pattern or 'celková částka' in pattern.lower() if pattern else False
+    # Special logging for total_amount pattern (diagnostics only)
+    is_total_amount_pattern = trace_enabled() and 'celková částka' in pattern.lower()
     
     if is_total_amount_pattern:
-        logger.info(f"🎯 extract_pattern called for total_amount")
-        logger.info(f"   Pattern: '{pattern}'")
-        logger.info(f"   Text length: {len(text)} chars")
-        logger.info(f"   Pattern length: {len(pattern)} chars")
+        trace("🎯 extract_pattern called for total_amount")
+        trace("   Pattern: '%s'", pattern)
+        trace("   Text length: %s chars", len(text))
+        trace("   Pattern length: %s chars", len(pattern))
     
     try:
         # Compile pattern first to catch syntax errors
@@ -521,52 +3413,52 @@ def extract_pattern(text: str, pattern: Optional[str]) -> Optional[str]:
         if match:
             extracted = match.group(1) if match.groups() else match.group(0)
             if is_total_amount_pattern:
-                logger.info(f"✅✅✅ Pattern MATCHED for total_amount: '{extracted}'")
-                logger.info(f"   Full match: '{match.group(0)}'")
-                logger.info(f"   Groups: {match.groups()}")
+                trace("✅✅✅ Pattern MATCHED for total_amount: '%s'", extracted)
+                trace("   Full match: '%s'", match.group(0))
+                trace("   Groups: %s", match.groups())
             else:
-                logger.info(f"✅ Pattern matched: '{pattern[:50]}...' -> '{extracted}'")
+                trace("✅ Pattern matched: '%s...' -> '%s'", pattern[:50], extracted)
             return extracted
         else:
             # Pattern didn't match
             if is_total_amount_pattern:
-                logger.warning(f"❌❌❌ Pattern did NOT match for total_amount")
-                logger.warning(f"   Pattern: '{pattern}'")
+                trace("❌❌❌ Pattern did NOT match for total_amount")
+                trace("   Pattern: '%s'", pattern)
                 
                 # Show the actual line with Celková částka
                 lines = text.split('\n')
                 for i, line in enumerate(lines):
                     if 'celková částka' in line.lower():
-                        logger.warning(f"   Found 'Celková částka' at line {i}: '{line.strip()}'")
-                        logger.warning(f"   Line length: {len(line)} chars")
+                        trace("   Found 'Celková částka' at line %s: '%s'", i, line.strip())
+                        trace("   Line length: %s chars", len(line))
                         
                         # Try to match just this line
                         line_match = compiled_pattern.search(line)
                         if line_match:
-                            logger.warning(f"   ⚠️ BUT pattern DOES match when searching just this line!")
-                            logger.warning(f"   Line match: '{line_match.group(1) if line_match.groups() else line_match.group(0)}'")
+                            trace("   ⚠️ BUT pattern DOES match when searching just this line!")
+                            trace("   Line match: '%s'", line_match.group(1) if line_match.groups() else line_match.group(0))
                         else:
-                            logger.warning(f"   ❌ Pattern doesn't match even on this line alone")
+                            trace("   ❌ Pattern doesn't match even on this line alone")
                             
                             # Show character codes for debugging
-                            logger.warning(f"   Line bytes: {line.encode('utf-8')}")
+                            trace("   Line bytes: %s", line.encode('utf-8'))
                         
                         # Show surrounding lines
                         if i > 0:
-                            logger.warning(f"   Previous line {i-1}: '{lines[i-1].strip()}'")
+                            trace("   Previous line %s: '%s'", i - 1, lines[i - 1].strip())
                         if i < len(lines) - 1:
-                            logger.warning(f"   Next line {i+1}: '{lines[i+1].strip()}'")
+                            trace("   Next line %s: '%s'", i + 1, lines[i + 1].strip())
                         break
                 else:
-                    logger.warning(f"   'Celková částka' NOT found in text at all!")
-                    logger.warning(f"   First 500 chars: {text[:500]}")
+                    trace("   'Celková částka' NOT found in text at all!")
+                    trace("   First 500 chars: %s", text[:500])
             else:
-                logger.warning(f"❌ Pattern did NOT match: '{pattern[:80]}'")
-                logger.warning(f"   Searched in text (first 200 chars): {text[:200]}")
+                trace("❌ Pattern did NOT match: '%s'", pattern[:80])
+                trace("   Searched in text (first 200 chars): %s", text[:200])
     except re.error as e:
-        logger.error(f"❌ Regex syntax error in pattern '{pattern}': {e}")
+        logger.error("❌ Regex syntax error in pattern '%s': %s", pattern, e)
     except Exception as e:
-        logger.error(f"Error extracting pattern '{pattern}': {e}", exc_info=True)
+        logger.error("Error extracting pattern '%s': %s", pattern, e, exc_info=True)
     
     return None
 
@@ -591,11 +3483,13 @@ def extract_weight_from_description(description: str) -> Optional[float]:
         if unit in ['g', 'ml']:
             weight = weight / 1000
         
-        logger.debug(f"Extracted weight: {weight} kg from '{description}'")
+        trace("Extracted weight: %s kg from '%s'", weight, description)
         return weight
     
     return None
 
+_CURRENCY_SUFFIX = re.compile(r'[A-Z]{2,}$')
+
 def extract_number(text: Optional[str]) -> float:
     """Extract number from text, handling Czech number format"""
     if not text:
@@ -603,7 +3497,7 @@ def extract_number(text: Optional[str]) -> float:
     
     # Handle Czech number format: "7 579,00" -> 7579.00
     # First, remove any currency codes (CZK, EUR, etc.)
-    cleaned = re.sub(r'[A-Z]{2,}$', '', text.strip())
+    cleaned = _CURRENCY_SUFFIX.sub('', text.strip())
     
     # Then replace Czech decimal comma with period
     cleaned = cleaned.replace(',', '.')
@@ -616,30 +3510,132 @@ def extract_number(text: Optional[str]) -> float:
     except:
         return 0
 
-def extract_line_items(
-    raw_text: str,
-    image: Image.Image,
-    template_config: Dict,
-    language: str,
-    psm: int
-) -> List[InvoiceItem]:
+# Amount columns of Dekos lines in column order: (field, group index, decimal places printed)
+DEKOS_AMOUNT_COLUMNS = (('unit_price', 2, 4), ('quantity', 3, 3), ('line_total', 6, 2))
+AMOUNT_TOLERANCE = 0.002  # quantity × unit_price may differ from line_total by rounding (relative, at least 0.011)
+
+def amounts_match(quantity: float, unit_price: float, line_total: float) -> bool:
+    """quantity × unit_price ≈ line_total, within rounding"""
+    return quantity > 0 and unit_price > 0 and abs(quantity * unit_price - line_total) <= max(0.011, line_total * AMOUNT_TOLERANCE)
+
+def number_readings(text: str) -> List[Tuple[float, int, int]]:
     """
-    Extract line items from invoice using template configuration
+    Possible values of an OCR'd amount as (value, decimal places, penalty), the plain Czech reading first
+    Alternatives: dots as thousands separators ("1.660,00") and a leading token that was merged in from the
+    previous column ("51 108,1300" - the "5" of "5L" read twice, "21 1 660,00" - the VAT rate)
     """
-    items = []
-    patterns = template_config.get('patterns', {})
-    table_columns = template_config.get('table_columns', {})
-    
-    # Override patterns for specific suppliers based on display_layout
-    # This ensures proven patterns are always used, regardless of template configuration
-    display_layout = template_config.get('display_layout', '')
+    text = text.strip()
+    decimal_match = re.search(r'[,.](\d+)$', text)
+    decimals = len(decimal_match.group(1)) if decimal_match else 0
+    readings = [(extract_number(text), decimals, 0)]
+    if '.' in text and ',' in text:
+        readings.append((extract_number(text.replace('.', '')), decimals, 1))
+    head, _, rest = text.partition(' ')
+    if rest and head.isdigit():
+        readings.append((extract_number(rest), decimals, 2))
+    return readings
+
+def amount_candidates(amounts: Tuple[Tuple[str, str, int], ...]) -> List[Tuple[int, Dict[str, float]]]:
+    """
+    Every combination of the readings of a line's amounts as (penalty, {field: value}), best first
+    A trailing token of one column may also belong to the next ("1,6600 1" + "000,000" = 1,66 and 1 000,000)
+    """
+    texts = [text.strip() for _, text, _ in amounts]
+    tails = [re.match(r'^(.*\S)\s+(\d{1,3})$', text) for text in texts[:-1]]
+    candidates = []
+    for splits in product(*[(False, True) if tail else (False,) for tail in tails]):
+        columns = []
+        for index, ((field, _, expected_decimals), text) in enumerate(zip(amounts, texts)):
+            if index < len(splits) and splits[index]:
+                text = tails[index].group(1)
+            if index > 0 and splits[index - 1]:
+                text = f"{tails[index - 1].group(2)} {text}"
+            # Columns print a fixed number of decimals - other counts are kept, but as worse readings
+            columns.append([
+                (field, value, penalty + (0 if decimals in (expected_decimals, 0) else 1))
+                for value, decimals, penalty in number_readings(text)
+            ])
+        for readings in product(*columns):
+            candidates.append((sum(splits) + sum(penalty for _, _, penalty in readings), {field: value for field, value, _ in readings}))
+    return sorted(candidates, key=lambda candidate: candidate[0])
+
+DECIMAL_SHIFTS = (-3, -2, -1, 0, 1, 2, 3)  # Powers of ten a misread decimal separator moves an amount by
+
+def shifted_amounts(item: 'ParsedItem') -> Optional[Dict[str, float]]:
+    """
+    The one reading of a line's parsed amounts with lost or misplaced decimal separators ("42,9O" read as 429,
+    "1 000,000" as 1,0) that satisfies quantity × unit_price ≈ line_total - None when there is none, or several
+    equally likely ones. Every shifted place counts, on line_total twice (the amount the invoice total adds up),
+    and a whole quantity turned into a fraction counts once more.
+    """
+    matches = []
+    for shifts in product(DECIMAL_SHIFTS, repeat=3):
+        quantity, unit_price, line_total = (
+            round(value * 10 ** shift, 6) for value, shift in zip((item.quantity, item.unit_price, item.line_total), shifts)
+        )
+        # Relative tolerance only - shifted down far enough, any amounts would match within a few hellers
+        if abs(quantity * unit_price - line_total) <= line_total * AMOUNT_TOLERANCE:
+            penalty = abs(shifts[0]) + abs(shifts[1]) + 2 * abs(shifts[2])
+            if item.quantity == int(item.quantity) and quantity != int(quantity):
+                penalty += 1  # Counted pieces more likely lost no decimals than became fractions
+            matches.append((penalty, {'quantity': quantity, 'unit_price': unit_price, 'line_total': line_total}))
+    if not matches:
+        return None
+    best = min(penalty for penalty, _ in matches)
+    readings = [values for penalty, values in matches if penalty == best]
+    return readings[0] if len(readings) == 1 else None
+
+def reconcile_amounts(items: List['ParsedItem']) -> int:
+    """
+    Resolve the amounts of all parsed lines in one pass: the reading consistent with
+    quantity × unit_price ≈ line_total wins, otherwise the one matching the printed decimals.
+    Lines of every layout that fail the check are then read with their decimal separators shifted
+    (see shifted_amounts) - only where most lines of the invoice pass it, as for line re-OCR.
+    Returns the number of lines whose amounts differ from the plain reading.
+    """
+    changed = 0
+    for item in items:
+        if not item.amounts:
+            continue
+        plain = {field: extract_number(text) for field, text, _ in item.amounts}
+        candidates = amount_candidates(item.amounts)
+        chosen = candidates[0][1]
+        for _, values in candidates:
+            if amounts_match(values.get('quantity', 0), values.get('unit_price', 0), values.get('line_total', 0)):
+                chosen = values
+                break
+        if chosen != plain:
+            changed += 1
+            trace("Amounts of line %s reconciled: %s -> %s", item.line_number, [text for _, text, _ in item.amounts], chosen)
+        item.quantity = chosen.get('quantity', 0)
+        item.unit_price = chosen.get('unit_price', 0)
+        item.line_total = chosen.get('line_total', 0)
+        item.amounts = None
     
+    priced = [item for item in items if item.quantity > 0 and item.unit_price > 0 and item.line_total > 0]
+    inconsistent = [item for item in priced if not amounts_match(item.quantity, item.unit_price, item.line_total)]
+    if len(inconsistent) > len(priced) * (1 - ARITHMETIC_CHECK_SHARE):
+        return changed
+    for item in inconsistent:
+        shifted = shifted_amounts(item)
+        if shifted:
+            changed += 1
+            trace("Amounts of line %s reconciled: %s -> %s", item.line_number,
+                  [item.quantity, item.unit_price, item.line_total], shifted)
+            item.quantity, item.unit_price, item.line_total = shifted['quantity'], shifted['unit_price'], shifted['line_total']
+    return changed
+
+def detect_table_format(raw_text: str, display_layout: str) -> Tuple[bool, bool]:
+    """
+    Detect Backaldrin and Makro invoices from display_layout or the invoice content
+    Returns (is_backaldrin_invoice, is_makro_invoice)
+    """
     # Auto-detect Backaldrin invoices FIRST (before Makro) to prevent false positives
     # Backaldrin has 8-digit codes, Makro has 4-7 digit codes
     is_backaldrin_invoice = False
-    if display_layout.lower() == 'backaldrin':
+    if display_layout == 'backaldrin':
         is_backaldrin_invoice = True
-        logger.info("🔧 Backaldrin display_layout detected")
+        trace("🔧 Backaldrin display_layout detected")
     else:
         # Auto-detect Backaldrin by looking for characteristic patterns:
         # 1. "backaldrin" company name in text
@@ -650,35 +3646,15 @@ def extract_line_items(
         ]
         if any(backaldrin_indicators):
             is_backaldrin_invoice = True
-            logger.info("🔧 Backaldrin invoice auto-detected from invoice content")
-    
-    if is_backaldrin_invoice:
-        logger.info("🔧 Using proven Backaldrin patterns (permanent)")
-        # Backaldrin pattern: 9 groups (with optional pipe separator before VAT)
-        # Format: CODE DESCRIPTION QTY1 UNIT1 QTY2 UNIT2 UNIT_PRICE TOTAL VAT%
-        # Example: "02289250 Růhrmix LC 25 kg 25 kg 91,400 2 285,00 12%"
-        # Example: "02550250 Maková náplň standard 25 kg 75kg 69,200 5 190,00 12%"
-        # Note: Description can contain package size (e.g., "standard 25 kg", "Blue 8 kg")
-        # Pattern captures: code(8 digits), description, qty1, unit1, qty2, unit2, unit_price, total, vat_percent
-        # Czech number format: "2 285,00" (space as thousands separator, comma as decimal separator)
-        # Optional pipe "|" before VAT% (some invoices have it, some don't)
-        # Description: Use negative lookahead to stop before "DIGIT UNIT DIGIT UNIT PRICE" pattern
-        table_columns['line_pattern'] = r'^(\d{8})\s+(.+?)\s+(\d+)\s*(kg|ks|l|g)\s+(\d+)\s*(kg|ks|l|g)\s+([\d,]+)\s+([\d\s,]+)\s*\|?\s*(\d+)%'
-        logger.info(f"   Using Backaldrin line_pattern (9 groups): {table_columns['line_pattern']}")
-        
-        # Backaldrin table boundaries
-        patterns['table_start'] = r'Předmět\s+zdanitelného\s+plnění'
-        patterns['table_end'] = r'(?:Částky\s+v\s+CZK|Dodací\s+listy)'
-        logger.info(f"   Using Backaldrin table_start: {patterns['table_start']}")
-        logger.info(f"   Using Backaldrin table_end: {patterns['table_end']}")
+            trace("🔧 Backaldrin invoice auto-detected from invoice content")
     
     # Auto-detect Makro invoices by checking for Makro-specific patterns in the text
     # This makes the Makro pattern permanent - it will always be applied for Makro invoices
     # Check Makro AFTER Backaldrin to avoid false positives
     is_makro_invoice = False
-    if not is_backaldrin_invoice and display_layout.lower() == 'makro':
+    if not is_backaldrin_invoice and display_layout == 'makro':
         is_makro_invoice = True
-        logger.info("🔧 Makro display_layout detected")
+        trace("🔧 Makro display_layout detected")
     elif not is_backaldrin_invoice:
         # Auto-detect Makro by looking for characteristic patterns:
         # 1. "MAKRO" company name in text
@@ -689,10 +3665,48 @@ def extract_line_items(
         ]
         if any(makro_indicators):
             is_makro_invoice = True
-            logger.info("🔧 Makro invoice auto-detected from invoice content")
+            trace("🔧 Makro invoice auto-detected from invoice content")
+    
+    return is_backaldrin_invoice, is_makro_invoice
+
+def resolve_table_config(
+    template_config: Dict,
+    display_layout: str,
+    is_backaldrin_invoice: bool,
+    is_makro_invoice: bool
+) -> Tuple[Dict, Dict]:
+    """
+    Apply the proven supplier table/line patterns on top of the template configuration
+    Works on copies - the template itself is shared by every invoice that uses it
+    Returns (patterns, table_columns)
+    """
+    patterns = dict(template_config.get('patterns', {}))
+    table_columns = dict(template_config.get('table_columns', {}))
+    
+    # Override patterns for specific suppliers based on display_layout
+    # This ensures proven patterns are always used, regardless of template configuration
+    if is_backaldrin_invoice:
+        trace("🔧 Using proven Backaldrin patterns (permanent)")
+        # Backaldrin pattern: 9 groups (with optional pipe separator before VAT)
+        # Format: CODE DESCRIPTION QTY1 UNIT1 QTY2 UNIT2 UNIT_PRICE TOTAL VAT%
+        # Example: "02289250 Růhrmix LC 25 kg 25 kg 91,400 2 285,00 12%"
+        # Example: "02550250 Maková náplň standard 25 kg 75kg 69,200 5 190,00 12%"
+        # Note: Description can contain package size (e.g., "standard 25 kg", "Blue 8 kg")
+        # Pattern captures: code(8 digits), description, qty1, unit1, qty2, unit2, unit_price, total, vat_percent
+        # Czech number format: "2 285,00" (space as thousands separator, comma as decimal separator)
+        # Optional pipe "|" before VAT% (some invoices have it, some don't)
+        # Description: Use negative lookahead to stop before "DIGIT UNIT DIGIT UNIT PRICE" pattern
+        table_columns['line_pattern'] = r'^(\d{8})\s+(.+?)\s+(\d+)\s*(kg|ks|l|g)\s+(\d+)\s*(kg|ks|l|g)\s+([\d,]+)\s+([\d\s,]+)\s*\|?\s*(\d+)%'
+        trace("   Using Backaldrin line_pattern (9 groups): %s", table_columns['line_pattern'])
+        
+        # Backaldrin table boundaries
+        patterns['table_start'] = r'Předmět\s+zdanitelného\s+plnění'
+        patterns['table_end'] = r'(?:Částky\s+v\s+CZK|Dodací\s+listy)'
+        trace("   Using Backaldrin table_start: %s", patterns['table_start'])
+        trace("   Using Backaldrin table_end: %s", patterns['table_end'])
     
     if is_makro_invoice:
-        logger.info("🔧 Using proven Makro patterns (permanent)")
+        trace("🔧 Using proven Makro patterns (permanent)")
         # Makro pattern: 10 groups (code, quantity, description, base_price, units_in_mu, price_per_mu, total, vat_rate, vat_amount, total_with_vat)
         # Format handles two types:
         # - Format A: Regular items with package weight (e.g., "100g 12x")
@@ -702,9 +3716,9 @@ def extract_line_items(
         # Description: Match until we see a decimal price pattern (e.g., "42,90" or "42.90") followed by space and integer
         # This pattern identifies the start of base_price field (first numeric field after description)
         table_columns['line_pattern'] = r'^(\d{4,7})\s+([\d,\.]+)\s+([*]?(?:(?!\s+\d+[,\.]\d{1,2}\s+\d+).)+?)\s+([\d,\.]+)\s+(\d+)\s+([\d,\.]+)\s+([\d,\.]+)\s+([\d,\.]+)\s+([\d,\.]+)\s+([\d,\.]+)'
-        logger.info(f"   Using Makro line_pattern (10 groups, stops at decimal price pattern): {table_columns['line_pattern']}")
-    elif display_layout.lower() == 'dekos':
-        logger.info("🔧 Dekos display_layout detected - using proven Dekos table/line patterns")
+        trace("   Using Makro line_pattern (10 groups, stops at decimal price pattern): %s", table_columns['line_pattern'])
+    elif display_layout == 'dekos':
+        trace("🔧 Dekos display_layout detected - using proven Dekos table/line patterns")
         # For Dekos, items appear right after the payment/delivery info, before any table header
         # Look for "Zp.dopravy:" or "Forma úhrady:" which comes right before the items start
         # Then items follow immediately (e.g., "3.1003 Krabice dortová...")
@@ -714,25 +3728,25 @@ def extract_line_items(
         table_columns['line_pattern'] = r'^(\d+\.\d+(?:-\d+)?)\s+([A-Za-zá-žÁ-Ž/](?:[\wá-žÁ-Ž.,%()/+-]|\s(?!\d+,\d{4}))+?)\s+([\d\s,\.]+)\s+([\d\s,\.]+)\s+([A-Za-z0-9]{1,10})\s+(\d+)\s+([\d\s,\.]+)'
         # For table_end, use the "FAKTURA č." line that appears before the summary on page 2
         patterns['table_end'] = r'(?:FAKTURA|Faktura)\s+č\.'
-        logger.info(f"   Using Dekos table_start: {patterns['table_start']}")
-        logger.info(f"   Using Dekos table_end: {patterns.get('table_end')}")
-        logger.info(f"   Using Dekos line_pattern (7 groups): {table_columns['line_pattern']}")
-    elif display_layout.lower() in ['leco', 'le-co']:
-        logger.info("🔧 Le-co display_layout detected - using proven Le-co patterns")
+        trace("   Using Dekos table_start: %s", patterns['table_start'])
+        trace("   Using Dekos table_end: %s", patterns.get('table_end'))
+        trace("   Using Dekos line_pattern (7 groups): %s", table_columns['line_pattern'])
+    elif display_layout in ['leco', 'le-co']:
+        trace("🔧 Le-co display_layout detected - using proven Le-co patterns")
         # Le-co pattern: 9 groups (code, description, quantity, unit, unit_price, line_total, vat_rate, vat_amount, total_with_vat)
         # Czech number format: "1 603,50" (space as thousands separator, comma as decimal separator)
         # Pattern for Czech numbers: \d+(?:,\d+)? (e.g., "106,90" or "15")
         # Pattern for Czech numbers with spaces: \d{1,3}(?:\s\d{3})*(?:,\d+)? (e.g., "1 603,50" or "192,42")
         table_columns['line_pattern'] = r'^(\d+)\s+([A-Za-zá-žÁ-Ž][A-Za-zá-žÁ-Ž0-9\s.,%()-]+?)\s+(\d+(?:,\d+)?)\s+([A-Za-z]{1,5})\s+(\d+(?:,\d+)?)\s+(\d{1,3}(?:\s\d{3})*(?:,\d+)?)\s+(\d+)\s+(\d{1,3}(?:\s\d{3})*(?:,\d+)?)\s+(\d{1,3}(?:\s\d{3})*(?:,\d+)?)'
-        logger.info(f"   Using Le-co line_pattern (9 groups): {table_columns['line_pattern']}")
+        trace("   Using Le-co line_pattern (9 groups): %s", table_columns['line_pattern'])
         
         # Le-co total amount pattern: "CELKEM" with space thousands separator
         # Example: "Vystavil(a): Michala Dobešová CELKEM 1 796,00 Kč" -> captures "1 796,00"
         # Use word boundary to ensure we match "CELKEM" as a whole word
         patterns['total_amount'] = r'\bCELKEM\s+(\d{1,3}(?:\s\d{3})*,\d{2})\s*(?:Kč|CZK)'
-        logger.info(f"   Using Le-co total_amount: {patterns['total_amount']}")
-    elif display_layout.lower() == 'pesek':
-        logger.info("🔧 Pešek display_layout detected - using proven Pešek multi-line patterns")
+        trace("   Using Le-co total_amount: %s", patterns['total_amount'])
+    elif display_layout == 'pesek':
+        trace("🔧 Pešek display_layout detected - using proven Pešek multi-line patterns")
         # Pešek pattern: 6 groups (multi-line format)
         # Format: Description on line 1, then on line 2: Code Quantity Unit Price VAT% Total
         # Example:
@@ -740,9 +3754,9 @@ def extract_line_items(
         #   Line 2: "0201 50kg 6,80 12 % 340,00"
         # Pattern captures: description, code, quantity, unit, unit_price, line_total
         table_columns['line_pattern'] = r'^([^\n]+?)\s*\n\s*(\d+)\s+([\d,]+)\s*([a-zA-Z]{1,5})\s+([\d,\s]+)\s+\d+\s*%?\s*\d*\s+([\d,\.\s]+)'
-        logger.info(f"   Using Pešek multi-line pattern (6 groups): {table_columns['line_pattern']}")
-    elif display_layout.lower() == 'goodmills':
-        logger.info("🔧 Goodmills display_layout detected - using proven Goodmills multi-line patterns")
+        trace("   Using Pešek multi-line pattern (6 groups): %s", table_columns['line_pattern'])
+    elif display_layout == 'goodmills':
+        trace("🔧 Goodmills display_layout detected - using proven Goodmills multi-line patterns")
         # Goodmills pattern: 7 groups (multi-line format)
         # Format: Data on line 1, description on line 2
         # Line 1: Code VAT% Quantity Unit UnitPrice LineTotal
@@ -752,9 +3766,9 @@ def extract_line_items(
         #   Line 2: "Pš.m.hl.světlá T530 volná"
         # Pattern captures: code, vat_rate, quantity, unit, unit_price, line_total, description
         table_columns['line_pattern'] = r'^(\d{6})\s+(\d+)%\s+([\d\.]+)\s+([A-Z]{2,4})\s+([\d\.]+)\s+([\d\.]+)\s*\n\s*(.+?)(?:\n|$)'
-        logger.info(f"   Using Goodmills multi-line pattern (7 groups): {table_columns['line_pattern']}")
-    elif display_layout.lower() == 'albert':
-        logger.info("🔧 Albert display_layout detected - using proven Albert patterns")
+        trace("   Using Goodmills multi-line pattern (7 groups): %s", table_columns['line_pattern'])
+    elif display_layout == 'albert':
+        trace("🔧 Albert display_layout detected - using proven Albert patterns")
         # Albert pattern: 4 groups (retail format without product codes)
         # Format: Description Weight Price VAT_Letter
         # Example: "RYBÍZ ČERVENÝ 1250 39,90 A"
@@ -762,9 +3776,9 @@ def extract_line_items(
         # VAT mapping: A=21%, B=15%, C=10%, D=0%
         # Weight corrections applied via description_corrections (e.g., "1250" → "125g")
         table_columns['line_pattern'] = r'^(?:[A-Z]\s+)?([A-ZĚŠČŘŽÝÁÍÉÚŮĎŤŇĹ\s]+?)\s+(\d{3,5})\s+([\d,]+)\s+([A-D])\s*$'
-        logger.info(f"   Using Albert pattern (4 groups, no product codes): {table_columns['line_pattern']}")
-    elif display_layout.lower() == 'fabio':
-        logger.info("🔧 FABIO display_layout detected - using proven FABIO patterns")
+        trace("   Using Albert pattern (4 groups, no product codes): %s", table_columns['line_pattern'])
+    elif display_layout == 'fabio':
+        trace("🔧 FABIO display_layout detected - using proven FABIO patterns")
         # FABIO pattern: 7 groups (description, quantity, unit, unit_price, line_total_no_vat, vat_rate, line_total_with_vat)
         # Format: Description Quantity Unit UnitPrice LineTotal VATRate LineTotalWithVAT
         # Example: "Řepkový rafinovaný olej 580 kg kontejner (006) 1,00 ks 19 082,0000 19082,00 12 21 371,84"
@@ -781,7 +3795,7 @@ def extract_line_items(
         # The key is: quantity MUST be followed by unit AND unit_price with 4 decimals
         # Line amounts can be with OR without space thousands separator: "19082,00" or "2 280,00"
         table_columns['line_pattern'] = r'^(.+?)\s+(\d+,\d{2})\s+(ks|kg|I|KRT|l)\s+(\d+(?:\s\d{3})*,\d{4})\s+(\d+(?:\s\d{3})*,\d{2})\s+(\d{1,2})\s+(\d+(?:\s\d{3})*,\d{2})'
-        logger.info(f"   Using FABIO line_pattern (7 groups): {table_columns['line_pattern']}")
+        trace("   Using FABIO line_pattern (7 groups): %s", table_columns['line_pattern'])
         
         # FABIO patterns
         patterns['invoice_number'] = r'(\d{5,})'  # Matches any 5+ digit number (variable symbol)
@@ -790,14 +3804,14 @@ def extract_line_items(
         patterns['payment_type'] = r'Forma úhrady:\s*©?\s*(.+?)(?:\s+\d+\s*[a-zA-Zá-žÁ-Ž]+)?'  # Captures payment type
         patterns['table_start'] = r'Dodací\s+list'
         patterns['table_end'] = r'Fakturace\s+celkem'
-        logger.info(f"   Using FABIO invoice_number: {patterns['invoice_number']}")
-        logger.info(f"   Using FABIO date: {patterns['date']}")
-        logger.info(f"   Using FABIO total_amount: {patterns['total_amount']}")
-        logger.info(f"   Using FABIO payment_type: {patterns['payment_type']}")
-        logger.info(f"   Using FABIO table_start: {patterns['table_start']}")
-        logger.info(f"   Using FABIO table_end: {patterns['table_end']}")
-    elif display_layout.lower() == 'zeelandia':
-        logger.info("🔧 Zeelandia display_layout detected - using pure sequence patterns")
+        trace("   Using FABIO invoice_number: %s", patterns['invoice_number'])
+        trace("   Using FABIO date: %s", patterns['date'])
+        trace("   Using FABIO total_amount: %s", patterns['total_amount'])
+        trace("   Using FABIO payment_type: %s", patterns['payment_type'])
+        trace("   Using FABIO table_start: %s", patterns['table_start'])
+        trace("   Using FABIO table_end: %s", patterns['table_end'])
+    elif display_layout == 'zeelandia':
+        trace("🔧 Zeelandia display_layout detected - using pure sequence patterns")
         # Zeelandia: Labels and values are SEPARATED (labels first, values after)
         # Extract by pure value patterns in sequence order
         
@@ -813,11 +3827,11 @@ def extract_line_items(
         # Hardcode supplier for Zeelandia
         patterns['supplier_override'] = 'zeelandia'
         
-        logger.info(f"   Using Zeelandia invoice_number (pure sequence): {patterns['invoice_number']}")
-        logger.info(f"   Using Zeelandia total_amount (pure sequence): {patterns['total_amount']}")
-        logger.info(f"   Using Zeelandia date (pure sequence): {patterns['date']}")
-        logger.info(f"   Using Zeelandia payment_type (pure sequence): {patterns['payment_type']}")
-        logger.info(f"   Using Zeelandia hardcoded supplier: zeelandia")
+        trace("   Using Zeelandia invoice_number (pure sequence): %s", patterns['invoice_number'])
+        trace("   Using Zeelandia total_amount (pure sequence): %s", patterns['total_amount'])
+        trace("   Using Zeelandia date (pure sequence): %s", patterns['date'])
+        trace("   Using Zeelandia payment_type (pure sequence): %s", patterns['payment_type'])
+        trace("   Using Zeelandia hardcoded supplier: zeelandia")
         
         # Zeelandia pattern: 12 groups (single-line format with detailed packaging info)
         # Format: Code Description Quantity Unit Obsah Obsah_Unit Fakt.mn Fakt.mn_Unit UnitPrice TotalPrice Currency VAT%
@@ -827,7 +3841,7 @@ def extract_line_items(
         # Pattern captures: code(7-8 digits), description, quantity, unit(BAG/BKT/PCE), obsah, obsah_unit, fakt_mn, fakt_mn_unit, unit_price, total_price, currency, vat_rate
         # Czech number format: use \d+(?:\s\d+)* to match numbers with space thousands separators (e.g., "7 579,00")
         table_columns['line_pattern'] = r'^(\d{7,8})\s+([A-Za-zá-žÁ-Ž0-9\s.,%()-]+?)\s+(\d+)\s+(BAG|BKT|PCE)\s+([\d,\.]+)\s+(KG|PCE|G)\s+([\d\s,\.]+)\s+(KG|PCE|G)\s+(\d+(?:\s\d+)*,\d+)\s+(\d+(?:\s\d+)*,\d+)\s*([A-Z]{2,3})\s+(\d+)%'
-        logger.info(f"   Using Zeelandia line_pattern (12 groups with Czech number format): {table_columns['line_pattern']}")
+        trace("   Using Zeelandia line_pattern (12 groups with Czech number format): %s", table_columns['line_pattern'])
         
         # Zeelandia-specific description corrections
         table_columns['description_corrections'] = {
@@ -838,7 +3852,26 @@ def extract_line_items(
                 {'pattern': r'^Carlo 15!\s', 'replacement': 'Carlo 15L '},
             ]
         }
-        logger.info("   Applied Zeelandia description corrections: Rosette 1 → Rosette 1L, Carlo 15! → Carlo 15L")
+        trace("   Applied Zeelandia description corrections: Rosette 1 → Rosette 1L, Carlo 15! → Carlo 15L")
+    
+    return patterns, table_columns
+
+def extract_line_items(
+    raw_text: str,
+    template_config: Dict,
+    language: str,
+    psm: int,
+    compiled: Optional['CompiledTemplate'] = None,
+    unmatched_lines: Optional[List[str]] = None
+) -> List[ParsedItem]:
+    """
+    Extract line items from invoice using template configuration
+    Pass the CompiledTemplate when one is at hand so supplier overrides are not resolved again
+    unmatched_lines collects the table lines that passed the line filters but matched no item
+    """
+    if compiled is None:
+        compiled = CompiledTemplate(template_config)
+    patterns, table_columns = compiled.table_config(raw_text)
     
     # Find table start and end
     table_start_pattern = patterns.get('table_start')
@@ -846,7 +3879,7 @@ def extract_line_items(
     
     if not table_start_pattern:
         # Fallback: extract from entire text
-        return extract_items_from_text(raw_text, table_columns)
+        return extract_items_from_text(raw_text, table_columns, unmatched_lines)
     
     # Extract table section
     items = []
@@ -880,65 +3913,61 @@ def extract_line_items(
                     if not is_continuation:
                         valid_end_matches.append(match)
                     else:
-                        logger.debug(f"Skipping continuation marker as table_end: {match_text[:50]}")
+                        trace("Skipping continuation marker as table_end: %s", match_text[:50])
                 
                 if valid_end_matches:
                     # Use the last valid match (for multi-page tables)
                     end_pos = valid_end_matches[-1].start()
-                    logger.info(f"Found {len(end_matches)} table end markers ({len(valid_end_matches)} valid, {len(end_matches) - len(valid_end_matches)} continuation), using the last valid one")
+                    trace("Found %s table end markers (%s valid, %s continuation), using the last valid one", len(end_matches), len(valid_end_matches), len(end_matches) - len(valid_end_matches))
                 elif end_matches:
                     # All matches were continuations, use end of text
                     end_pos = len(raw_text)
-                    logger.info(f"All {len(end_matches)} table end markers were continuation messages, using end of text")
+                    trace("All %s table end markers were continuation messages, using end of text", len(end_matches))
                 else:
                     end_pos = len(raw_text)
-                    logger.info("No table end marker found, using end of text")
+                    trace("No table end marker found, using end of text")
             else:
                 end_pos = len(raw_text)
-                logger.info("No table end pattern configured, using end of text")
+                trace("No table end pattern configured, using end of text")
             
             table_text = raw_text[start_pos:end_pos]
             
-            logger.info(f"Extracted table section: {len(table_text)} characters from position {start_pos} to {end_pos}")
-            logger.info(f"Table text preview (first 500 chars): {table_text[:500]}")
-            logger.info(f"Table text preview (last 500 chars): {table_text[-500:]}")
+            trace("Extracted table section: %s characters from position %s to %s", len(table_text), start_pos, end_pos)
             
-            # Check if second page is included (look for "Stranač. 2" or "Strana 2" or page 2 markers)
-            second_page_markers = [
-                'Stranač. 2',
-                'Strana 2',
-                'page 2',
-                'Dodavatel: backaldrin',
-                '01395050',  # First item from second page
-                '01250120',  # Second item from second page
-            ]
-            second_page_found = any(marker in table_text for marker in second_page_markers)
-            logger.info(f"Second page detected in table_text: {second_page_found}")
-            if second_page_found:
-                # Find position of second page items
-                for marker in second_page_markers:
-                    pos = table_text.find(marker)
-                    if pos >= 0:
-                        logger.info(f"Found second page marker '{marker}' at position {pos} in table_text")
-                        # Log context around marker
-                        context_start = max(0, pos - 100)
-                        context_end = min(len(table_text), pos + 200)
-                        logger.info(f"Context around marker: {table_text[context_start:context_end]}")
-                        break
+            # Table previews and second page checks are diagnostics only - skip them unless tracing
+            if trace_enabled():
+                trace("Table text preview (first 500 chars): %s", table_text[:500])
+                trace("Table text preview (last 500 chars): %s", table_text[-500:])
+                
+                # Check if second page is included (look for "Stranač. 2" or "Strana 2" or page 2 markers)
+                second_page_found = any(marker in table_text for marker in SECOND_PAGE_MARKERS)
+                trace("Second page detected in table_text: %s", second_page_found)
+                if second_page_found:
+                    # Find position of second page items
+                    for marker in SECOND_PAGE_MARKERS:
+                        pos = table_text.find(marker)
+                        if pos >= 0:
+                            trace("Found second page marker '%s' at position %s in table_text", marker, pos)
+                            # Log context around marker
+                            context_start = max(0, pos - 100)
+                            context_end = min(len(table_text), pos + 200)
+                            trace("Context around marker: %s", table_text[context_start:context_end])
+                            break
             
             # Extract items from table text
-            items = extract_items_from_text(table_text, table_columns)
+            items = extract_items_from_text(table_text, table_columns, unmatched_lines)
         else:
-            logger.warning(f"Table start pattern not found: {table_start_pattern}")
+            logger.warning("Table start pattern not found: %s", table_start_pattern)
             
     except Exception as e:
-        logger.error(f"Error extracting table section: {e}")
+        logger.error("Error extracting table section: %s", e)
     
     return items
 
-def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]:
+def extract_items_from_text(text: str, table_columns: Dict, unmatched_lines: Optional[List[str]] = None) -> List[ParsedItem]:
     """
     Extract items from table text using line-by-line or multi-line parsing
+    unmatched_lines collects lines that matched no item (single-line patterns only)
     """
     items = []
     item_pattern = table_columns.get('line_pattern')
@@ -951,8 +3980,8 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
     
     # Check if it's a multi-line pattern (contains \n in pattern)
     if item_pattern and '\\n' in item_pattern:
-        logger.info(f"Using multi-line pattern extraction")
-        logger.info(f"Multi-line pattern: {item_pattern[:100]}...")
+        trace("Using multi-line pattern extraction")
+        trace("Multi-line pattern: %s...", item_pattern[:100])
         
         # Use regex with MULTILINE and DOTALL flags for better multi-line matching
         try:
@@ -967,11 +3996,11 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                 for ignore_pattern in ignore_patterns:
                     try:
                         if re.match(ignore_pattern, matched_text, re.IGNORECASE):
-                            logger.debug(f"Skipping multi-line match (matches ignore pattern '{ignore_pattern}'): {matched_text[:50]}")
+                            trace("Skipping multi-line match (matches ignore pattern '%s'): %s", ignore_pattern, matched_text[:50])
                             should_ignore = True
                             break
                     except Exception as e:
-                        logger.warning(f"Invalid ignore pattern '{ignore_pattern}': {e}")
+                        logger.warning("Invalid ignore pattern '%s': %s", ignore_pattern, e)
                 
                 if should_ignore:
                     continue
@@ -996,11 +4025,11 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                                 if len(quantity_str) >= 2:
                                     quantity = float(quantity_str[:-1])  # Remove last digit
                                     unit = 'lt'  # Change t to lt
-                                    logger.info(f"Fixed OCR: {quantity_raw}t → {quantity} lt")
+                                    trace("Fixed OCR: %st → %s lt", quantity_raw, quantity)
                             except:
                                 pass  # Keep original if conversion fails
                         
-                        item = InvoiceItem(
+                        item = ParsedItem(
                             description=groups[0].strip() if groups[0] else None,
                             product_code=groups[1].strip() if len(groups) > 1 else None,
                             quantity=quantity,
@@ -1012,7 +4041,7 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                         
                         if item.product_code:
                             items.append(item)
-                            logger.debug(f"Extracted multi-line item (6 groups): {item.product_code} - {item.description}")
+                            trace("Extracted multi-line item (6 groups): %s - %s", item.product_code, item.description)
                     
                     # Format 2: Backaldrin multi-line: code+description on line 1, data on line 2
                     # Example: "02543250 Kobliha 20 %" / "25 kg 25 kg 166,000 4 150,00 | 12%"
@@ -1033,7 +4062,7 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                         quantity = quantity2 if quantity2 > 0 else quantity1
                         unit_of_measure = unit2 if unit2 else unit1
                         
-                        item = InvoiceItem(
+                        item = ParsedItem(
                             product_code=product_code,
                             description=description,
                             quantity=quantity,
@@ -1046,7 +4075,7 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                         
                         if item.product_code:
                             items.append(item)
-                            logger.debug(f"Extracted multi-line Backaldrin item (9 groups): {item.product_code} - {item.description}")
+                            trace("Extracted multi-line Backaldrin item (9 groups): %s - %s", item.product_code, item.description)
                     
                     # Format 3: Goodmills format - data on line 1, description on line 2
                     # Example: "512001 12% 7160.00 KG 8.9000 63724.00" / "Pš.m.hl.světlá T530 volná"
@@ -1060,7 +4089,7 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                         line_total = extract_number(groups[5]) if len(groups) > 5 else 0
                         description = groups[6].strip() if len(groups) > 6 else None
                         
-                        item = InvoiceItem(
+                        item = ParsedItem(
                             product_code=product_code,
                             description=description,
                             quantity=quantity,
@@ -1073,11 +4102,11 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                         
                         if item.product_code:
                             items.append(item)
-                            logger.debug(f"Extracted multi-line Goodmills item (7 groups): {item.product_code} - {item.description}")
+                            trace("Extracted multi-line Goodmills item (7 groups): %s - %s", item.product_code, item.description)
                     
                     else:
                         # Generic multi-line format - try to extract what we can
-                        logger.info(f"Generic multi-line format with {len(groups)} groups, attempting extraction")
+                        trace("Generic multi-line format with %s groups, attempting extraction", len(groups))
                         # Try to identify fields by position and content
                         product_code = None
                         description = None
@@ -1125,7 +4154,7 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                                 unit_of_measure = unit_match.group(1)
                         
                         if product_code:
-                            item = InvoiceItem(
+                            item = ParsedItem(
                                 product_code=product_code,
                                 description=description,
                                 quantity=quantity,
@@ -1135,28 +4164,30 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                                 line_number=match_no,
                             )
                             items.append(item)
-                            logger.debug(f"Extracted generic multi-line item: {item.product_code} - {item.description}")
+                            trace("Extracted generic multi-line item: %s - %s", item.product_code, item.description)
             
-            logger.info(f"Extracted {len(items)} items using multi-line pattern")
+            trace("Extracted %s items using multi-line pattern", len(items))
             return items
             
         except Exception as e:
-            logger.error(f"Error with multi-line pattern: {e}")
+            logger.error("Error with multi-line pattern: %s", e)
             # Fall back to line-by-line
     
     # Single-line processing (original method)
     lines = text.strip().split('\n')
-    logger.info(f"Processing {len(lines)} lines for items")
-    
-    # Log if we see second page markers in the text
-    text_lower = text.lower()
-    second_page_in_text = any(marker in text_lower for marker in ['stranač. 2', 'strana 2', 'dodavatel: backaldrin', '01395050', '01250120'])
-    logger.info(f"Second page markers found in text: {second_page_in_text}")
-    if second_page_in_text:
-        # Find lines containing second page markers
-        for idx, line in enumerate(lines):
-            if any(marker in line.lower() for marker in ['01395050', '01250120', 'vídeňské chlebové koření', 'bas tmavý']):
-                logger.info(f"Found second page item at line {idx + 1}: {line[:100]}")
+    trace("Processing %s lines for items", len(lines))
+    
+    # Log if we see second page markers in the text (diagnostics only)
+    tracing = trace_enabled()
+    if tracing:
+        text_lower = text.lower()
+        second_page_in_text = any(marker.lower() in text_lower for marker in SECOND_PAGE_MARKERS)
+        trace("Second page markers found in text: %s", second_page_in_text)
+        if second_page_in_text:
+            # Find lines containing second page markers
+            for idx, line in enumerate(lines):
+                if any(marker in line.lower() for marker in ['01395050', '01250120', 'vídeňské chlebové koření', 'bas tmavý']):
+                    trace("Found second page item at line %s: %s", idx + 1, line[:100])
     
     # Get ignore patterns from config
     ignore_patterns = table_columns.get('ignore_patterns', [])
@@ -1174,7 +4205,7 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
         
         # Skip this line if it's the second line of a multi-line item
         if skip_next_line:
-            logger.debug(f"Skipping line {line_no} (second line of multi-line item): {line[:50]}")
+            trace("Skipping line %s (second line of multi-line item): %s", line_no, line[:50])
             skip_next_line = False
             continue
         
@@ -1184,11 +4215,11 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
             try:
                 # Use both match (start of line) and search (anywhere) for flexibility
                 if re.match(ignore_pattern, line, re.IGNORECASE) or re.search(ignore_pattern, line, re.IGNORECASE):
-                    logger.debug(f"Skipping line (matches ignore pattern '{ignore_pattern}'): {line[:50]}")
+                    trace("Skipping line (matches ignore pattern '%s'): %s", ignore_pattern, line[:50])
                     should_ignore = True
                     break
             except Exception as e:
-                logger.warning(f"Invalid ignore pattern '{ignore_pattern}': {e}")
+                logger.warning("Invalid ignore pattern '%s': %s", ignore_pattern, e)
         
         if should_ignore:
             continue
@@ -1198,25 +4229,25 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
         # Also skip "Šarže Počet Jednotka" header rows
         if re.match(r'^[A-Z]{2,}\s+(GTIN|Šarže)', line, re.IGNORECASE) or \
            re.match(r'^Šarže\s+Počet\s+Jednotka', line, re.IGNORECASE):
-            logger.debug(f"Skipping metadata/header line: {line[:50]}")
+            trace("Skipping metadata/header line: %s", line[:50])
             continue
         
         # Skip batch/date lines: 8-digit batch number followed by date (DD.MM.YYYY) and quantity
         # Example: "02498362 10.07.2026 25 kg" - these appear after product lines in backaldrin format
         if re.match(r'^\d{8}\s+\d{1,2}\.\d{1,2}\.\d{4}\s+\d+', line):
-            logger.debug(f"Skipping batch/date line: {line[:50]}")
+            trace("Skipping batch/date line: %s", line[:50])
             continue
         
         # Skip production/expiration info lines (Goodmills format)
         # Example: "Vyrobeno: 21/10/2025, DMT: 22/07/2026"
         if re.match(r'^Vyrobeno:', line, re.IGNORECASE) or re.match(r'^DMT:', line, re.IGNORECASE):
-            logger.debug(f"Skipping production info line: {line[:50]}")
+            trace("Skipping production info line: %s", line[:50])
             continue
         
         # Skip section headers (lines with only uppercase letters and spaces, but SHORT - likely headers)
         # But allow longer lines (likely product descriptions)
         if re.match(r'^[A-ZĚŠČŘŽÝÁÍÉÚŮĎŤŇĹ\s]+$', line) and len(line) < 30:
-            logger.debug(f"Skipping header line: {line}")
+            trace("Skipping header line: %s", line)
             continue
         
         # Check if pattern requires product code at start (starts with ^\d)
@@ -1227,7 +4258,7 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
             # Skip lines that don't start with a digit (product codes should be numeric)
             # Only enforce this for suppliers that use product codes
             if not re.match(r'^\d', line):
-                logger.debug(f"Skipping non-product line (no code): {line[:50]}")
+                trace("Skipping non-product line (no code): %s", line[:50])
                 continue
             
             # Check if line starts with a product code (digits with optional dot and dash)
@@ -1235,16 +4266,17 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
             # Examples: "8.5340-1", "7.6550-2", "35.2010-1", "35.0400"
             code_match = re.match(r'^(\d+\.?\d*-?\d*)', line)
             if not code_match:
-                logger.debug(f"Skipping line without valid product code format: {line[:50]}")
+                trace("Skipping line without valid product code format: %s", line[:50])
                 continue
         
-        # Log lines from second page for debugging
-        if '01395050' in line or '01250120' in line or 'Vídeňské chlebové koření' in line or 'BAS tmavý' in line:
-            logger.info(f"⚠️ Processing line from second page (line {line_no}): {line[:100]}")
-        
-        # Log lines with codes containing dash for debugging (e.g., "8.5340-1", "7.6550-2")
-        if re.match(r'^\d+\.\d+-\d+', line):
-            logger.info(f"🔍 Processing line with dash code (line {line_no}): {line[:100]}")
+        if tracing:
+            # Log lines from second page for debugging
+            if '01395050' in line or '01250120' in line or 'Vídeňské chlebové koření' in line or 'BAS tmavý' in line:
+                trace("⚠️ Processing line from second page (line %s): %s", line_no, line[:100])
+            
+            # Log lines with codes containing dash for debugging (e.g., "8.5340-1", "7.6550-2")
+            if re.match(r'^\d+\.\d+-\d+', line):
+                trace("🔍 Processing line with dash code (line %s): %s", line_no, line[:100])
         
         # Check for multi-line Albert items (description + weight on line 1, quantity × price on line 2)
         # Example:
@@ -1293,11 +4325,11 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                         combined_line = f"{description} {weight} {unit_price_str} {vat_letter}"
                         multiline_item_detected = True
                         skip_next_line = True  # Mark next line for skipping
-                        logger.info(f"🔗 Multi-line Albert item detected (lines {line_no}-{line_no+1}):")
-                        logger.info(f"   Line 1: {line}")
-                        logger.info(f"   Line 2: {next_line}")
-                        logger.info(f"   Combined: {combined_line}")
-                        logger.info(f"   Quantity: {quantity}, Unit Price: {unit_price_str}, Total: {line_total}")
+                        trace("🔗 Multi-line Albert item detected (lines %s-%s):", line_no, line_no+1)
+                        trace("   Line 1: %s", line)
+                        trace("   Line 2: %s", next_line)
+                        trace("   Combined: %s", combined_line)
+                        trace("   Quantity: %s, Unit Price: %s, Total: %s", quantity, unit_price_str, line_total)
         
         # Try to extract item from line (or combined line for multi-line items)
         item = extract_item_from_line(combined_line, table_columns, line_no)
@@ -1311,40 +4343,51 @@ def extract_items_from_text(text: str, table_columns: Dict) -> List[InvoiceItem]
                 if multiline_match:
                     item.quantity = int(multiline_match.group(1))
                     item.line_total = extract_number(multiline_match.group(3))
-                    logger.info(f"   → Updated item: quantity={item.quantity}, line_total={item.line_total}")
+                    trace("   → Updated item: quantity=%s, line_total=%s", item.quantity, item.line_total)
             except Exception as e:
-                logger.warning(f"Failed to update multi-line item quantity/total: {e}")
+                logger.warning("Failed to update multi-line item quantity/total: %s", e)
         
         # Accept items with product_code OR description (for retail formats like Albert)
         if item and (item.product_code or item.description):
+            item.source_line = line
             items.append(item)
             if multiline_item_detected:
-                logger.info(f"✅ Added multi-line item: {item.description}, qty={item.quantity}, price={item.unit_price}, total={item.line_total}")
+                trace("✅ Added multi-line item: %s, qty=%s, price=%s, total=%s", item.description, item.quantity, item.unit_price, item.line_total)
             else:
-                logger.debug(f"Extracted item: {item.product_code or 'no-code'} - {item.description}")
-        elif re.match(r'^\d+\.\d+-\d+', line):
-            # Log if lines with dash codes don't match pattern
-            logger.warning(f"❌ Line with dash code did not match pattern (line {line_no}): {line[:100]}")
-            logger.warning(f"   Pattern used: {table_columns.get('line_pattern', 'None')}")
-        elif '01395050' in line or '01250120' in line:
-            # Log if second page items don't match
-            logger.warning(f"❌ Line from second page did not match pattern (line {line_no}): {line[:100]}")
-            logger.warning(f"   Pattern used: {table_columns.get('line_pattern', 'None')}")
-        elif line_no % 50 == 0:  # Log every 50th line to see progress
-            logger.debug(f"Line {line_no} did not match pattern: {line[:80]}")
-    
-    logger.info(f"Extracted {len(items)} valid items (started with {items_before_extraction}, processed {len(lines)} lines)")
-    
-    # Log all extracted items for debugging
-    for idx, item in enumerate(items, 1):
-        logger.info(f"Item {idx}: desc={item.description}, code={item.product_code}, qty={item.quantity}, price={item.unit_price}, total={item.line_total}, weight={item.item_weight}")
-    
-    # Check if second page items are missing
-    extracted_codes = {item.product_code for item in items}
-    second_page_codes = {'01395050', '01250120'}
-    missing_second_page = second_page_codes - extracted_codes
-    if missing_second_page:
-        logger.warning(f"Missing second page items with codes: {missing_second_page}")
+                trace("Extracted item: %s - %s", item.product_code or 'no-code', item.description)
+        else:
+            if unmatched_lines is not None:
+                unmatched_lines.append(line)
+            if tracing:
+                if re.match(r'^\d+\.\d+-\d+', line):
+                    # Log if lines with dash codes don't match pattern
+                    trace("❌ Line with dash code did not match pattern (line %s): %s", line_no, line[:100])
+                    trace("   Pattern used: %s", table_columns.get('line_pattern', 'None'))
+                elif '01395050' in line or '01250120' in line:
+                    # Log if second page items don't match
+                    trace("❌ Line from second page did not match pattern (line %s): %s", line_no, line[:100])
+                    trace("   Pattern used: %s", table_columns.get('line_pattern', 'None'))
+                elif line_no % 50 == 0:  # Log every 50th line to see progress
+                    trace("Line %s did not match pattern: %s", line_no, line[:80])
+    
+    trace("Extracted %s valid items (started with %s, processed %s lines)", len(items), items_before_extraction, len(lines))
+    
+    # Ambiguous amounts (Dekos) and decimal separator misreads (all layouts) are resolved for all lines at once
+    reconciled = reconcile_amounts(items)
+    if reconciled:
+        trace("Reconciled the amounts of %s line(s) against quantity × unit_price ≈ line_total", reconciled)
+    
+    if tracing:
+        # Log all extracted items for debugging
+        for idx, item in enumerate(items, 1):
+            trace("Item %s: desc=%s, code=%s, qty=%s, price=%s, total=%s, weight=%s", idx, item.description, item.product_code, item.quantity, item.unit_price, item.line_total, item.item_weight)
+        
+        # Check if second page items are missing
+        extracted_codes = {item.product_code for item in items}
+        second_page_codes = {'01395050', '01250120'}
+        missing_second_page = second_page_codes - extracted_codes
+        if missing_second_page:
+            trace("Missing second page items with codes: %s", missing_second_page)
     
     return items
 
@@ -1364,7 +4407,7 @@ def apply_code_corrections(product_code: str, corrections: Dict) -> str:
     for starts_with, prepend_text in prepend_rules.items():
         if product_code.startswith(starts_with):
             corrected = prepend_text + product_code
-            logger.info(f"Code correction: {product_code} -> {corrected} (prepended '{prepend_text}')")
+            trace("Code correction: %s -> %s (prepended '%s')", product_code, corrected, prepend_text)
             return corrected
     
     # Rule 2: Regex pattern replacements
@@ -1375,7 +4418,7 @@ def apply_code_corrections(product_code: str, corrections: Dict) -> str:
         if pattern:
             corrected = re.sub(pattern, replacement, product_code)
             if corrected != product_code:
-                logger.info(f"Code correction: {product_code} -> {corrected} (pattern: {pattern})")
+                trace("Code correction: %s -> %s (pattern: %s)", product_code, corrected, pattern)
                 return corrected
     
     return product_code
@@ -1398,12 +4441,44 @@ def apply_description_corrections(description: str, corrections: Dict) -> str:
         if pattern:
             corrected = re.sub(pattern, replacement, description)
             if corrected != description:
-                logger.info(f"Description correction: {description} -> {corrected} (pattern: {pattern})")
+                trace("Description correction: %s -> %s (pattern: %s)", description, corrected, pattern)
                 return corrected
     
     return description
 
-def extract_item_from_line(line: str, table_columns: Dict, line_number: int) -> Optional[InvoiceItem]:
+@lru_cache(maxsize=256)
+def compile_line_pattern(item_pattern: str) -> Tuple[str, re.Pattern, Tuple[str, ...]]:
+    """
+    Extend a template line_pattern with the automatic fixes below and compile it
+    Cached, so each distinct pattern is prepared once instead of once per table line
+    Returns (final_pattern, compiled_pattern, applied_extensions); raises re.error for invalid patterns
+    """
+    extensions = []
+    
+    # Automatically extend pattern to support codes with optional dash (e.g., "8.5340-1")
+    # Convert ^(\d+\.\d+) to ^(\d+\.\d+(?:-\d+)?) to support both "35.0400" and "8.5340-1"
+    if '^(\\d+\\.\\d+)' in item_pattern and '(?:-\\d+)?' not in item_pattern:
+        item_pattern = item_pattern.replace('^(\\d+\\.\\d+)', '^(\\d+\\.\\d+(?:-\\d+)?)')
+        extensions.append('dash_codes')
+    
+    # Automatically extend pattern to support + in descriptions (e.g., "20+8x33cm")
+    # Add + to description character classes if missing
+    if '[A-Za-zá-žÁ-Ž0-9\\s.,%()-]' in item_pattern and '+' not in item_pattern:
+        item_pattern = item_pattern.replace('[A-Za-zá-žÁ-Ž0-9\\s.,%()-]', '[A-Za-zá-žÁ-Ž0-9\\s.,%()+-]')
+        extensions.append('plus_descriptions')
+    
+    # Automatically improve description pattern to capture capacity indicators like "5L", "10kg"
+    # Convert simple non-greedy pattern to one with negative lookahead
+    # Old: [\wá-žÁ-Ž\s.,%()/+-]+?
+    # New: (?:[\wá-žÁ-Ž.,%()/+-]|\s(?!\d{2,}[\s,]))+?
+    # This stops before "space + 2+ digits with comma" (unit price pattern like "108,1300")
+    if '[\\wá-žÁ-Ž\\s.,%()/+-]+?' in item_pattern and '(?!\\d{2,}[\\s,])' not in item_pattern:
+        item_pattern = item_pattern.replace('[\\wá-žÁ-Ž\\s.,%()/+-]+?', '(?:[\\wá-žÁ-Ž.,%()/+-]|\\s(?!\\d{2,}[\\s,]))+?')
+        extensions.append('capacity_indicators')
+    
+    return item_pattern, re.compile(item_pattern), tuple(extensions)
+
+def extract_item_from_line(line: str, table_columns: Dict, line_number: int) -> Optional[ParsedItem]:
     """
     Extract single item from a line of text
     Uses configurable patterns or whitespace splitting
@@ -1415,65 +4490,41 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
     # Method 1: Use regex patterns if configured
     item_pattern = table_columns.get('line_pattern')
     if item_pattern:
-        # Automatically extend pattern to support codes with optional dash (e.g., "8.5340-1")
-        # Convert ^(\d+\.\d+) to ^(\d+\.\d+(?:-\d+)?) to support both "35.0400" and "8.5340-1"
+        # Extend and compile the configured pattern (cached - done once per distinct line_pattern)
         original_pattern = item_pattern
-        pattern_was_extended = False
-        if '^(\\d+\\.\\d+)' in item_pattern and '(?:-\\d+)?' not in item_pattern:
-            item_pattern = item_pattern.replace('^(\\d+\\.\\d+)', '^(\\d+\\.\\d+(?:-\\d+)?)')
-            pattern_was_extended = True
-            logger.info(f"🔧 Extended pattern to support dash codes")
-            logger.info(f"   Original: {original_pattern}")
-            logger.info(f"   Extended: {item_pattern}")
-        
-        # Automatically extend pattern to support + in descriptions (e.g., "20+8x33cm")
-        # Add + to description character classes if missing
-        description_pattern_extended = False
-        if '[A-Za-zá-žÁ-Ž0-9\\s.,%()-]' in item_pattern and '+' not in item_pattern:
-            item_pattern = item_pattern.replace('[A-Za-zá-žÁ-Ž0-9\\s.,%()-]', '[A-Za-zá-žÁ-Ž0-9\\s.,%()+-]')
-            description_pattern_extended = True
-            pattern_was_extended = True
-        
-        # Automatically improve description pattern to capture capacity indicators like "5L", "10kg"
-        # Convert simple non-greedy pattern to one with negative lookahead
-        # Old: [\wá-žÁ-Ž\s.,%()/+-]+?
-        # New: (?:[\wá-žÁ-Ž.,%()/+-]|\s(?!\d{2,}[\s,]))+?
-        # This stops before "space + 2+ digits with comma" (unit price pattern like "108,1300")
-        capacity_pattern_improved = False
-        if '[\\wá-žÁ-Ž\\s.,%()/+-]+?' in item_pattern and '(?!\\d{2,}[\\s,])' not in item_pattern:
-            item_pattern = item_pattern.replace('[\\wá-žÁ-Ž\\s.,%()/+-]+?', '(?:[\\wá-žÁ-Ž.,%()/+-]|\\s(?!\\d{2,}[\\s,]))+?')
-            capacity_pattern_improved = True
-            pattern_was_extended = True
+        try:
+            item_pattern, compiled_pattern, extensions = compile_line_pattern(original_pattern)
+        except re.error as pattern_error:
+            logger.error("Invalid regex pattern: %s", pattern_error)
+            logger.error("Pattern: %s", pattern_error.pattern)
+            return None
+        pattern_was_extended = bool(extensions)
         
         # Log the extensions
-        if description_pattern_extended:
-            logger.info(f"🔧 Extended pattern to support + in descriptions")
-        if capacity_pattern_improved:
-            logger.info(f"🔧 Improved description pattern to capture capacity indicators (5L, 10kg, etc.)")
+        if 'dash_codes' in extensions:
+            trace("🔧 Extended pattern to support dash codes")
+            trace("   Original: %s", original_pattern)
+            trace("   Extended: %s", item_pattern)
+        if 'plus_descriptions' in extensions:
+            trace("🔧 Extended pattern to support + in descriptions")
+        if 'capacity_indicators' in extensions:
+            trace("🔧 Improved description pattern to capture capacity indicators (5L, 10kg, etc.)")
         if pattern_was_extended:
-            logger.info(f"   Final pattern: {item_pattern}")
+            trace("   Final pattern: %s", item_pattern)
         
-        logger.info(f"Using line_pattern: {item_pattern}")
-        logger.info(f"Testing against line: {line[:100]}")
+        trace("Using line_pattern: %s", item_pattern)
+        trace("Testing against line: %s", line[:100])
         try:
-            # Validate pattern before using it
-            try:
-                re.compile(item_pattern)
-            except re.error as pattern_error:
-                logger.error(f"Invalid regex pattern: {pattern_error}")
-                logger.error(f"Pattern: {item_pattern}")
-                return None
-            
-            match = re.match(item_pattern, line)
+            match = compiled_pattern.match(line)
             
             if match:
-                logger.info(f"✅ Pattern matched! Groups: {len(match.groups())}")
+                trace("✅ Pattern matched! Groups: %s", len(match.groups()))
                 if pattern_was_extended:
-                    logger.info(f"   (Match succeeded with extended pattern)")
+                    trace("   (Match succeeded with extended pattern)")
             else:
-                logger.warning(f"❌ Pattern did NOT match")
+                trace("❌ Pattern did NOT match")
                 if pattern_was_extended:
-                    logger.warning(f"   (Even extended pattern failed to match)")
+                    trace("   (Even extended pattern failed to match)")
             
             # Only use Dekos fallback pattern if main pattern doesn't match
             # This respects each supplier's configured pattern first
@@ -1496,8 +4547,8 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     if dekos_match and len(dekos_match.groups()) == 7:
                         # Use Dekos pattern as fallback only if main pattern didn't match
                         match = dekos_match
-                        logger.info(f"✅ Dekos fallback pattern matched (7 groups) for line: {line[:80]}")
-                        logger.info(f"   Using Dekos fallback pattern (main pattern didn't match)")
+                        trace("✅ Dekos fallback pattern matched (7 groups) for line: %s", line[:80])
+                        trace("   Using Dekos fallback pattern (main pattern didn't match)")
             
             # If primary pattern doesn't match, try alternative Backaldrin patterns for edge cases
             if not match and r'\d{8}' in item_pattern:
@@ -1507,7 +4558,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                 alternative_pattern = r'^(\d{8})\s+([A-Za-zá-žÁ-Ž]+(?:\s+[A-Za-zá-žÁ-Ž]+)*(?:\s+\d+\s*%)?)\s+([\d,]+)\s*([a-zA-Z]{1,5})\s+(?:\d{8,}\s+)?([\d,]+)\s*([a-zA-Z]{1,5})\s+([\d,\s]+)\s+([\d\s,]+)\s*\|\s*(\d+)%'
                 match = re.match(alternative_pattern, line)
                 if match:
-                    logger.info(f"✅ Alternative Backaldrin pattern matched (flexible spacing + optional batch): {line[:80]}")
+                    trace("✅ Alternative Backaldrin pattern matched (flexible spacing + optional batch): %s", line[:80])
             
             # If primary pattern doesn't match, try Le-co fallback pattern (9 groups format)
             # Le-co format: code, description, quantity, unit, unit_price, line_total, vat_rate, vat_amount, total_with_vat
@@ -1523,19 +4574,19 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                 if leco_match and len(leco_match.groups()) == 9:
                     # Use Le-co pattern as fallback only if main pattern didn't match
                     match = leco_match
-                    logger.info(f"✅ Le-co fallback pattern matched (9 groups) for line: {line[:80]}")
-                    logger.info(f"   Using Le-co fallback pattern (main pattern didn't match)")
+                    trace("✅ Le-co fallback pattern matched (9 groups) for line: %s", line[:80])
+                    trace("   Using Le-co fallback pattern (main pattern didn't match)")
             
             if match:
                 try:
                     groups = match.groups()
-                    logger.info(f"✅ Pattern matched with {len(groups)} groups for line: {line[:80]}")
-                    logger.info(f"Groups (all {len(groups)}): {groups}")
-                    logger.info(f"Group breakdown: code={groups[0] if len(groups) > 0 else None}, description={groups[1] if len(groups) > 1 else None}, ...")
+                    trace("✅ Pattern matched with %s groups for line: %s", len(groups), line[:80])
+                    trace("Groups (all %s): %s", len(groups), groups)
+                    trace("Group breakdown: code=%s, description=%s, ...", groups[0] if len(groups) > 0 else None, groups[1] if len(groups) > 1 else None)
                 except Exception as e:
-                    logger.error(f"Error getting groups from match: {e}")
-                    logger.error(f"Pattern: {item_pattern}")
-                    logger.error(f"Line: {line[:100]}")
+                    logger.error("Error getting groups from match: %s", e)
+                    logger.error("Pattern: %s", item_pattern)
+                    logger.error("Line: %s", line[:100])
                     return None
                 
                 # Handle different pattern formats:
@@ -1582,12 +4633,12 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                             
                             # This weight represents the weight per piece
                             weight_per_piece_kg = weight_value
-                            logger.info(f"🔍 Zeelandia piece-based item: Description '{description}' indicates {weight_per_piece_kg} kg per piece")
+                            trace("🔍 Zeelandia piece-based item: Description '%s' indicates %s kg per piece", description, weight_per_piece_kg)
                             
                             # Calculate total weight: quantity × weight_per_piece
                             calculated_total_weight_kg = quantity * weight_per_piece_kg if quantity else weight_per_piece_kg
                             total_weight_kg = calculated_total_weight_kg
-                            logger.info(f"   Total weight: {quantity} BKT/BAG × {weight_per_piece_kg} kg/piece = {total_weight_kg} kg")
+                            trace("   Total weight: %s BKT/BAG × %s kg/piece = %s kg", quantity, weight_per_piece_kg, total_weight_kg)
                     
                     # Zeelandia OCR Error Fix: Validate total_weight against quantity × package_weight
                     # This handles OCR errors where leading digits are dropped (e.g., "12,00" → "2,00")
@@ -1596,12 +4647,12 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         
                         # If total_weight is missing, zero, or significantly different from calculation, use calculated value
                         if total_weight is None or total_weight == 0:
-                            logger.info(f"⚠️ OCR Error Correction: total_weight was {total_weight}, calculating: {quantity} × {package_weight} = {calculated_total_weight}")
+                            trace("⚠️ OCR Error Correction: total_weight was %s, calculating: %s × %s = %s", total_weight, quantity, package_weight, calculated_total_weight)
                             total_weight = calculated_total_weight
                         elif abs(total_weight - calculated_total_weight) > 0.1:
                             # If difference > 0.1, likely OCR error (e.g., "12,00" read as "2,00")
-                            logger.warning(f"⚠️ OCR Error Detected: total_weight {total_weight} != expected {calculated_total_weight} (diff: {abs(total_weight - calculated_total_weight)})")
-                            logger.info(f"   Correcting: {total_weight} → {calculated_total_weight} (using quantity × package_weight)")
+                            trace("⚠️ OCR Error Detected: total_weight %s != expected %s (diff: %s)", total_weight, calculated_total_weight, abs(total_weight - calculated_total_weight))
+                            trace("   Correcting: %s → %s (using quantity × package_weight)", total_weight, calculated_total_weight)
                             total_weight = calculated_total_weight
                         
                         # Set total_weight_kg for normal items (when unit is KG)
@@ -1617,17 +4668,17 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         # For piece-based items with weight in description
                         # unit_price is per piece, so price_per_kg = unit_price / weight_per_piece
                         price_per_kg = unit_price / weight_per_piece_kg
-                        logger.info(f"   Price per kg: {unit_price} Kč/piece ÷ {weight_per_piece_kg} kg/piece = {price_per_kg:.2f} Kč/kg")
+                        trace("   Price per kg: %s Kč/piece ÷ %s kg/piece = %.2f Kč/kg", unit_price, weight_per_piece_kg, price_per_kg)
                     elif total_weight_kg and total_weight_kg > 0 and line_total > 0:
                         # Standard calculation: price_per_kg = line_total / total_weight_kg
                         price_per_kg = line_total / total_weight_kg
-                        logger.info(f"   Price per kg: {line_total} Kč ÷ {total_weight_kg} kg = {price_per_kg:.2f} Kč/kg")
+                        trace("   Price per kg: %s Kč ÷ %s kg = %.2f Kč/kg", line_total, total_weight_kg, price_per_kg)
                     
                     # Calculate line_total from total_weight * unit_price for more accuracy
                     # This avoids OCR errors in the total price field
                     calculated_line_total = total_weight * unit_price if total_weight and unit_price else line_total
                     
-                    logger.info(f"Extracting Zeelandia format - quantity: {quantity}, unit: {unit_of_measure}, package_weight: {package_weight}, total_weight: {total_weight}, unit_price: {unit_price}, calculated_total: {calculated_line_total}")
+                    trace("Extracting Zeelandia format - quantity: %s, unit: %s, package_weight: %s, total_weight: %s, unit_price: %s, calculated_total: %s", quantity, unit_of_measure, package_weight, total_weight, unit_price, calculated_line_total)
                     
                     # Apply code corrections if configured
                     corrected_code = apply_code_corrections(product_code, code_corrections) if product_code else None
@@ -1636,7 +4687,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     description_corrections = table_columns.get('description_corrections', {})
                     corrected_description = apply_description_corrections(description, description_corrections) if description else None
                     
-                    return InvoiceItem(
+                    return ParsedItem(
                         product_code=corrected_code,
                         description=corrected_description,
                         quantity=quantity,
@@ -1663,8 +4714,8 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     # Alternative Backaldrin format with 6 groups: "02874010 Sahnissimo neutrál kg 8kg | 12%"
                     if len(groups) == 6 and is_backaldrin:
                         # Alternative Backaldrin format - 6 groups: code, description, unit1, qty2 (from combined "8kg"), unit2 (from combined), vat_percent
-                        logger.info(f"Detected Alternative Backaldrin format with 6 groups - line: {line[:80]}")
-                        logger.info(f"All groups: {groups}")
+                        trace("Detected Alternative Backaldrin format with 6 groups - line: %s", line[:80])
+                        trace("All groups: %s", groups)
                         product_code = groups[0] if len(groups) > 0 else None
                         description = groups[1].strip() if len(groups) > 1 else None
                         unit1 = groups[2] if len(groups) > 2 else None  # Standalone unit (e.g., "kg")
@@ -1684,9 +4735,9 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                             unit_pattern = re.compile(r'\s+' + re.escape(unit1) + r'$', re.IGNORECASE)
                             if unit_pattern.search(description):
                                 description = unit_pattern.sub('', description).strip()
-                                logger.info(f"Removed trailing unit '{unit1}' from description, new description: '{description}'")
+                                trace("Removed trailing unit '%s' from description, new description: '%s'", unit1, description)
                         
-                        logger.info(f"Extracting Alternative Backaldrin format - code: {product_code}, description: {description}, quantity: {quantity} {unit_of_measure}, vat_rate: {vat_rate}")
+                        trace("Extracting Alternative Backaldrin format - code: %s, description: %s, quantity: %s %s, vat_rate: %s", product_code, description, quantity, unit_of_measure, vat_rate)
                         
                         # Apply code corrections if configured
                         corrected_code = apply_code_corrections(product_code, code_corrections) if product_code else None
@@ -1695,7 +4746,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         description_corrections = table_columns.get('description_corrections', {})
                         corrected_description = apply_description_corrections(description, description_corrections) if description else None
                         
-                        return InvoiceItem(
+                        return ParsedItem(
                             product_code=corrected_code,
                             description=corrected_description,
                             quantity=quantity,
@@ -1709,11 +4760,11 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     if len(groups) == 9 and is_backaldrin:
                         # Backaldrin format - 9 groups: code, description (with optional "20 %"), qty1, unit1, qty2, unit2, unit_price, total, vat_percent
                         # Note: "20 %" in description like "Kobliha 20 %" is part of product name, not separate VAT field
-                        logger.info(f"Detected Backaldrin format with 9 groups - line: {line[:80]}")
-                        logger.info(f"All groups: {groups}")
+                        trace("Detected Backaldrin format with 9 groups - line: %s", line[:80])
+                        trace("All groups: %s", groups)
                         product_code = groups[0] if len(groups) > 0 else None
                         description = groups[1].strip() if len(groups) > 1 else None  # Includes "20 %" if present
-                        logger.info(f"Extracted - code: {product_code}, description: {description}, group[1] raw: '{groups[1] if len(groups) > 1 else None}'")
+                        trace("Extracted - code: %s, description: %s, group[1] raw: '%s'", product_code, description, groups[1] if len(groups) > 1 else None)
                         quantity1 = extract_number(groups[2]) if len(groups) > 2 else 0
                         unit1 = groups[3] if len(groups) > 3 else None
                         quantity2 = extract_number(groups[4]) if len(groups) > 4 else 0
@@ -1739,7 +4790,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                                 # Description ends with unit, remove it and use as unit_of_measure
                                 unit_of_measure = unit_match.group(1).lower()
                                 description = re.sub(unit_pattern, '', description, flags=re.IGNORECASE).strip()
-                                logger.info(f"Removed trailing unit '{unit_of_measure}' from description, new description: '{description}'")
+                                trace("Removed trailing unit '%s' from description, new description: '%s'", unit_of_measure, description)
                         
                         # If quantity is still 0 but we have unit2, check if unit2 contains quantity (e.g., "8kg")
                         if quantity == 0 and unit2:
@@ -1748,15 +4799,15 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                             if qty_unit_match:
                                 quantity = extract_number(qty_unit_match.group(1))
                                 unit_of_measure = qty_unit_match.group(2).lower()
-                                logger.info(f"Extracted quantity {quantity} and unit '{unit_of_measure}' from combined '{unit2}'")
+                                trace("Extracted quantity %s and unit '%s' from combined '%s'", quantity, unit_of_measure, unit2)
                         
                         # Calculate line_total from quantity * unit_price for accuracy
                         # OCR often has errors with spaces in Czech number format (e.g., "4 150,00" vs "4150,00")
                         line_total = quantity * unit_price if quantity and unit_price else line_total_ocr
                         if line_total != line_total_ocr and line_total_ocr > 0:
-                            logger.info(f"Calculated line_total: {line_total} (OCR was: {line_total_ocr}, using calculation instead)")
+                            trace("Calculated line_total: %s (OCR was: %s, using calculation instead)", line_total, line_total_ocr)
                         
-                        logger.info(f"Extracting Backaldrin format - code: {product_code}, description: {description}, quantity: {quantity} {unit_of_measure}, unit_price: {unit_price}, total: {line_total}")
+                        trace("Extracting Backaldrin format - code: %s, description: %s, quantity: %s %s, unit_price: %s, total: %s", product_code, description, quantity, unit_of_measure, unit_price, line_total)
                         
                         # Apply code corrections if configured
                         corrected_code = apply_code_corrections(product_code, code_corrections) if product_code else None
@@ -1765,7 +4816,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         description_corrections = table_columns.get('description_corrections', {})
                         corrected_description = apply_description_corrections(description, description_corrections) if description else None
                         
-                        return InvoiceItem(
+                        return ParsedItem(
                             product_code=corrected_code,
                             description=corrected_description,
                             quantity=quantity,
@@ -1797,12 +4848,12 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         description_corrections = table_columns.get('description_corrections', {})
                         corrected_weight = apply_description_corrections(weight_raw, description_corrections) if weight_raw else None
                         
-                        logger.info(f"Extracting Albert format (4 groups) - description: {description}, weight: {weight_raw} → {corrected_weight}, unit_price: {unit_price}, vat_letter: {vat_letter} ({vat_rate}%)")
+                        trace("Extracting Albert format (4 groups) - description: %s, weight: %s → %s, unit_price: %s, vat_letter: %s (%s%%)", description, weight_raw, corrected_weight, unit_price, vat_letter, vat_rate)
                         
                         # Apply description corrections to name as well
                         corrected_description = apply_description_corrections(description, description_corrections) if description else None
                         
-                        return InvoiceItem(
+                        return ParsedItem(
                             product_code=None,  # No product codes for Albert
                             description=corrected_description,
                             quantity=quantity,
@@ -1818,7 +4869,6 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     # Frontend generates patterns with fields in left-to-right order
                     # Common formats:
                     #   5-7 groups: code, description, quantity, unit, unit_price, line_total, vat_rate
-                    #   7 groups (Dekos): code, description, unit_price, quantity, unit, vat_rate, line_total
                     #   9 groups (Leco): code, description, quantity, unit, unit_price, line_total, vat_rate, vat_amount, total_with_vat
                     if len(groups) >= 5 and len(groups) <= 9:
                         product_code = None
@@ -1831,17 +4881,9 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         vat_amount = None
                         total_with_vat = None
                         
-                        # Detect Dekos format: code contains dot (e.g., "35.0400") and has 7 groups
-                        # Dekos order: code, description, unit_price, quantity, unit, vat_rate, line_total
-                        is_dekos_format = len(groups) == 7 and groups[0] and '.' in str(groups[0])
-                        
                         # Standard field order from frontend (based on left-to-right position)
                         # But we'll be flexible - map based on position first, then validate
-                        if is_dekos_format:
-                            # Dekos format: code, description, unit_price, quantity, unit, vat_rate, line_total
-                            field_order = ['code', 'description', 'unit_price', 'quantity', 'unit', 'vat_rate', 'line_total']
-                            logger.debug(f"Detected Dekos format (7 groups with code containing dot): {groups[0]}")
-                        elif len(groups) == 9:
+                        if len(groups) == 9:
                             # Leco format: code, description, quantity, unit, unit_price, line_total, vat_rate, vat_amount, total_with_vat
                             field_order = ['code', 'description', 'quantity', 'unit', 'unit_price', 'line_total', 'vat_rate', 'vat_amount', 'total_with_vat']
                         else:
@@ -1849,28 +4891,28 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                             field_order = ['code', 'description', 'quantity', 'unit', 'unit_price', 'line_total', 'vat_rate', 'vat_amount', 'total_with_vat']
                         
                         # First pass: map fields based on position with validation
-                        logger.debug(f"Mapping {len(groups)} groups for Dekos format: {groups}")
+                        trace("Mapping %s groups: %s", len(groups), groups)
                         for idx, group_str in enumerate(groups):
                             if not group_str or idx >= len(field_order):
                                 continue
                             group_str = str(group_str).strip()
                             field_type = field_order[idx]
-                            logger.debug(f"Group {idx+1}: '{group_str}' -> field_type: {field_type}")
+                            trace("Group %s: '%s' -> field_type: %s", idx+1, group_str, field_type)
                             
                             if field_type == 'code':
-                                # Product code: all digits, 3-7 digits, or digits with dot (Dekos format: "35.0400")
+                                # Product code: all digits, 3-7 digits, or digits with dot (e.g., "35.0400")
                                 # Also support codes with dash (e.g., "8.5340-1", "7.6550-2", "35.2010-1")
                                 if group_str.isdigit() and len(group_str) >= 3 and len(group_str) <= 7:
                                     product_code = group_str
-                                    logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> code: {product_code}")
+                                    trace("Group %s (position %s): %s -> code: %s", idx+1, idx, group_str, product_code)
                                 elif '.' in group_str and (re.match(r'^\d+\.\d+$', group_str) or re.match(r'^\d+\.\d+-\d+$', group_str)):
-                                    # Dekos format: code with dot (e.g., "35.0400") or with dot and dash (e.g., "8.5340-1")
+                                    # Code with dot (e.g., "35.0400") or with dot and dash (e.g., "8.5340-1")
                                     product_code = group_str
-                                    logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> code (Dekos format): {product_code}")
+                                    trace("Group %s (position %s): %s -> code (dotted): %s", idx+1, idx, group_str, product_code)
                                 elif group_str.isdigit():
                                     # Fallback: accept any digit-only code
                                     product_code = group_str
-                                    logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> code (fallback): {product_code}")
+                                    trace("Group %s (position %s): %s -> code (fallback): %s", idx+1, idx, group_str, product_code)
                             
                             elif field_type == 'description':
                                 # Description: contains letters (even if mixed with numbers like "14g")
@@ -1880,69 +4922,27 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                                 is_number_format = re.match(r'^\d+[,\\.]\d+$', group_str.strip())
                                 if not is_number_format and any(c.isalpha() or c in 'áčďéěíňóřšťúůýžÁČĎÉĚÍŇÓŘŠŤÚŮÝŽ' for c in group_str):
                                     description = group_str
-                                    logger.debug(f"Group {idx+1} (position {idx}): {group_str[:30]}... -> description: {description[:30] if description else ''}...")
-                                elif is_dekos_format and is_number_format and idx == 1:
-                                    # For Dekos format, if position 1 (description) contains a number with comma/dot,
-                                    # check if it has 4 decimal places (unit_price pattern)
-                                    # If so, treat this as unit_price and assign it, then we'll find description in fallback
-                                    decimal_match = re.search(r'[,\\.](\d+)$', group_str.strip())
-                                    decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                                    if decimal_places == 4:
-                                        logger.warning(f"Group {idx+1} (position {idx}, Dekos description): '{group_str}' has 4 decimals (unit_price pattern), not description. Pattern may be incorrect. Assigning as unit_price.")
-                                        num_val = extract_number(group_str)
-                                        if num_val > 0 and not unit_price:
-                                            unit_price = num_val
-                                            logger.debug(f"Group {idx+1} (position {idx}, reassigned from description to unit_price): {group_str} -> unit_price: {unit_price} (4 decimals)")
-                                    else:
-                                        logger.warning(f"Group {idx+1} (position {idx}, Dekos description): '{group_str}' is a number but doesn't match unit_price (4 decimals) or quantity (3 decimals) pattern. Pattern may be incorrect.")
+                                    trace("Group %s (position %s): %s... -> description: %s...", idx+1, idx, group_str[:30], description[:30] if description else '')
                                 # If description position doesn't match, we'll try to find it later
                             
                             elif field_type == 'quantity':
                                 # Quantity: number, typically 0.1 - 10000
-                                # For Dekos format: quantity has exactly 3 decimal places (e.g., "8,000" or "1 000,000" with spaces between thousands)
                                 # Quantity may contain spaces between thousands in Czech format (e.g., "1 000,000")
                                 quantity_str = group_str.strip()
-                                # For Czech format, spaces are thousands separators, so extract_number will handle them correctly
-                                decimal_match = re.search(r'[,\\.](\d+)$', quantity_str)
-                                decimal_places = len(decimal_match.group(1)) if decimal_match else 0
                                 num_val = extract_number(quantity_str)
                                 if num_val > 0 and num_val <= 10000:
-                                    if is_dekos_format:
-                                        # Check decimal places for Dekos format
-                                        # Quantity should have 3 decimals (e.g., "8,000" or "1 000,000")
-                                        # Should NOT have 4 decimals (that's unit_price) or 2 decimals (that's line_total)
-                                        if decimal_places == 3:
-                                            quantity = num_val
-                                            logger.debug(f"Group {idx+1} (position {idx}): '{quantity_str}' -> quantity: {quantity} (3 decimals - Dekos format)")
-                                        elif decimal_places == 0:
-                                            # Integer quantity is also valid
-                                            quantity = num_val
-                                            logger.debug(f"Group {idx+1} (position {idx}): '{quantity_str}' -> quantity: {quantity} (integer - Dekos format)")
-                                        elif decimal_places == 4:
-                                            # This might be unit_price, not quantity
-                                            logger.debug(f"Group {idx+1} (position {idx}): '{quantity_str}' -> skipping quantity (has 4 decimals, likely unit_price)")
-                                            continue
-                                        elif decimal_places == 2:
-                                            # This might be line_total, not quantity
-                                            logger.debug(f"Group {idx+1} (position {idx}): '{quantity_str}' -> skipping quantity (has 2 decimals, likely line_total)")
-                                            continue
-                                        else:
-                                            logger.debug(f"Group {idx+1} (position {idx}): '{quantity_str}' -> skipping quantity (has {decimal_places} decimals, expected 3 for Dekos)")
-                                            continue
-                                    else:
-                                        quantity = num_val
-                                        logger.debug(f"Group {idx+1} (position {idx}): '{quantity_str}' -> quantity: {quantity}")
+                                    quantity = num_val
+                                    trace("Group %s (position %s): '%s' -> quantity: %s", idx+1, idx, quantity_str, quantity)
                             
                             elif field_type == 'unit':
                                 # Unit: short string (1-10 chars), letters or combination of digits and letters (e.g., "1ks", "bal", "tis")
                                 # Must contain at least one letter to distinguish from pure numbers
                                 if len(group_str) <= 10 and any(c.isalpha() or c in 'áčďéěíňóřšťúůýžÁČĎÉĚÍŇÓŘŠŤÚŮÝŽ' for c in group_str):
                                     unit_of_measure = group_str.lower()
-                                    logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> unit: {unit_of_measure}")
+                                    trace("Group %s (position %s): %s -> unit: %s", idx+1, idx, group_str, unit_of_measure)
                             
                             elif field_type == 'unit_price':
                                 # Unit price: number, typically 1-10000
-                                # For Dekos format: unit_price has exactly 4 decimal places (e.g., "79,0000")
                                 # Unit_price may contain spaces or additional numbers (e.g., "1,6600 1")
                                 # Extract only the part before space or before any additional number
                                 unit_price_str = group_str.strip()
@@ -1950,46 +4950,15 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                                 unit_price_str = re.sub(r'\s+\d+$', '', unit_price_str).strip()
                                 num_val = extract_number(unit_price_str)
                                 if num_val > 0:
-                                    if is_dekos_format:
-                                        # Check decimal places for Dekos format
-                                        decimal_match = re.search(r'[,\\.](\d+)$', unit_price_str)
-                                        decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                                        if decimal_places == 4:
-                                            unit_price = num_val
-                                            logger.debug(f"Group {idx+1} (position {idx}): '{group_str}' -> cleaned: '{unit_price_str}' -> unit_price: {unit_price} (4 decimals - Dekos format)")
-                                        elif decimal_places == 0:
-                                            # Integer unit_price is also valid (fallback)
-                                            unit_price = num_val
-                                            logger.debug(f"Group {idx+1} (position {idx}): '{group_str}' -> cleaned: '{unit_price_str}' -> unit_price: {unit_price} (integer - Dekos format)")
-                                        else:
-                                            logger.debug(f"Group {idx+1} (position {idx}): '{group_str}' -> cleaned: '{unit_price_str}' -> skipping unit_price (has {decimal_places} decimals, expected 4 for Dekos)")
-                                            continue
-                                    else:
-                                        unit_price = num_val
-                                        logger.debug(f"Group {idx+1} (position {idx}): '{group_str}' -> unit_price: {unit_price}")
+                                    unit_price = num_val
+                                    trace("Group %s (position %s): '%s' -> unit_price: %s", idx+1, idx, group_str, unit_price)
                             
                             elif field_type == 'line_total':
                                 # Line total: number, typically larger
-                                # For Dekos format: line_total has exactly 2 decimal places (e.g., "632,00" or "1 660,00")
                                 num_val = extract_number(group_str)
                                 if num_val > 0:
-                                    if is_dekos_format:
-                                        # Check decimal places for Dekos format
-                                        decimal_match = re.search(r'[,\\.](\d+)$', group_str.strip())
-                                        decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                                        if decimal_places == 2:
-                                            line_total = num_val
-                                            logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> line_total: {line_total} (2 decimals - Dekos format)")
-                                        elif decimal_places == 0:
-                                            # Integer line_total is also valid (fallback)
-                                            line_total = num_val
-                                            logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> line_total: {line_total} (integer - Dekos format)")
-                                        else:
-                                            logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> skipping line_total (has {decimal_places} decimals, expected 2 for Dekos)")
-                                            continue
-                                    else:
-                                        line_total = num_val
-                                        logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> line_total: {line_total}")
+                                    line_total = num_val
+                                    trace("Group %s (position %s): %s -> line_total: %s", idx+1, idx, group_str, line_total)
                             
                             elif field_type == 'vat_rate':
                                 # VAT rate: small number (10-25), typically "12" or "21"
@@ -1997,25 +4966,25 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                                     vat_num = extract_number(group_str)
                                     if vat_num >= 10 and vat_num <= 25:
                                         vat_rate = vat_num
-                                        logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> vat_rate: {vat_rate}")
+                                        trace("Group %s (position %s): %s -> vat_rate: %s", idx+1, idx, group_str, vat_rate)
                             
                             elif field_type == 'vat_amount':
                                 # VAT amount: number (for Le-co format)
                                 num_val = extract_number(group_str)
                                 if num_val > 0:
                                     vat_amount = num_val
-                                    logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> vat_amount: {vat_amount}")
+                                    trace("Group %s (position %s): %s -> vat_amount: %s", idx+1, idx, group_str, vat_amount)
                             
                             elif field_type == 'total_with_vat':
                                 # Total with VAT: number (for Le-co format)
                                 num_val = extract_number(group_str)
                                 if num_val > 0:
                                     total_with_vat = num_val
-                                    logger.debug(f"Group {idx+1} (position {idx}): {group_str} -> total_with_vat: {total_with_vat}")
+                                    trace("Group %s (position %s): %s -> total_with_vat: %s", idx+1, idx, group_str, total_with_vat)
                                     # Use total_with_vat as line_total if line_total is smaller (sometimes line_total is before VAT)
                                     if num_val > line_total:
                                         line_total = num_val
-                                        logger.debug(f"Using total_with_vat as line_total: {line_total}")
+                                        trace("Using total_with_vat as line_total: %s", line_total)
                         
                         # Second pass: if description wasn't found, look for it in any remaining groups
                         # Also check if description position was assigned incorrectly (has number instead of text)
@@ -2026,73 +4995,26 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                                 group_str = str(group_str).strip()
                                 
                                 # Skip already assigned fields (code, quantity, unit_price, line_total)
-                                # For Dekos format: code (0), description (1), unit_price (2), quantity (3), unit (4), vat_rate (5), line_total (6)
                                 # For standard format: code (0), description (1), quantity (2), unit (3), unit_price (4), line_total (5), vat_rate (6)
                                 if idx == 0 and group_str == product_code:
                                     continue  # Skip code
                                 num_val = extract_number(group_str)
-                                if is_dekos_format:
-                                    # Dekos format: unit_price at idx 2, quantity at idx 3, line_total at idx 6
-                                    # But if regex pattern is wrong, unit_price might be at idx 1 (description position)
-                                    # Check if position 1 contains a number with comma/dot - if so, skip it (it's unit_price)
-                                    is_number_format = re.match(r'^\d+[,\\.]\d+$', group_str.strip())
-                                    if idx == 1 and is_number_format:
-                                        logger.warning(f"Group {idx+1} (position {idx}, Dekos description): '{group_str}' is unit_price, not description. Skipping.")
-                                        continue  # Skip unit_price at description position
-                                    if idx == 2 and num_val == unit_price and unit_price > 0:
-                                        continue  # Skip unit_price
-                                    if idx == 3 and num_val == quantity and quantity > 0:
-                                        continue  # Skip quantity
-                                    if idx == 6 and num_val == line_total and line_total > 0:
-                                        continue  # Skip line_total
-                                else:
-                                    # Standard format: quantity at idx 2, unit_price at idx 4, line_total at idx 5
-                                    if idx == 2 and num_val == quantity and quantity > 0:
-                                        continue  # Skip quantity
-                                    if idx == 4 and num_val == unit_price and unit_price > 0:
-                                        continue  # Skip unit_price
-                                    if idx == 5 and num_val == line_total and line_total > 0:
-                                        continue  # Skip line_total
+                                # Standard format: quantity at idx 2, unit_price at idx 4, line_total at idx 5
+                                if idx == 2 and num_val == quantity and quantity > 0:
+                                    continue  # Skip quantity
+                                if idx == 4 and num_val == unit_price and unit_price > 0:
+                                    continue  # Skip unit_price
+                                if idx == 5 and num_val == line_total and line_total > 0:
+                                    continue  # Skip line_total
                                 
                                 # Look for description: contains letters (must have at least one letter)
                                 # Must NOT be a pure number with comma/dot (e.g., "79,0000" or "79.0000")
                                 is_number_format = re.match(r'^\d+[,\\.]\d+$', group_str.strip())
                                 if not is_number_format and any(c.isalpha() or c in 'áčďéěíňóřšťúůýžÁČĎÉĚÍŇÓŘŠŤÚŮÝŽ' for c in group_str):
                                     description = group_str
-                                    logger.debug(f"Group {idx+1} (fallback): {group_str[:30]}... -> description: {description[:30] if description else ''}...")
+                                    trace("Group %s (fallback): %s... -> description: %s...", idx+1, group_str[:30], description[:30] if description else '')
                                     break
                         
-                        # Special case for Dekos format: if quantity was split between groups[2] and groups[3]
-                        # Check if groups[2] (unit_price position) contains "1,6600 1" and groups[3] (quantity position) contains "000,000"
-                        # This happens when pattern splits "1 000,000" into "1" (end of groups[2]) and "000,000" (groups[3])
-                        if is_dekos_format and quantity == 0 and len(groups) >= 4:
-                            unit_price_group = groups[2].strip() if len(groups) > 2 else ""
-                            quantity_group = groups[3].strip() if len(groups) > 3 else ""
-                            
-                            # Check if groups[2] ends with space+number and groups[3] is "000,000"
-                            if re.match(r'^000,000$', quantity_group):
-                                trailing_match = re.search(r'\s+(\d+)$', unit_price_group)
-                                if trailing_match:
-                                    trailing_num = trailing_match.group(1)
-                                    # Combine trailing_num + groups[3] to get full quantity: "1 000,000"
-                                    combined_quantity_str = f"{trailing_num} {quantity_group}"
-                                    quantity_val = extract_number(combined_quantity_str)
-                                    decimal_match = re.search(r'[,\\.](\d+)$', combined_quantity_str)
-                                    decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                                    if quantity_val > 0 and (decimal_places == 3 or decimal_places == 0):
-                                        quantity = quantity_val
-                                        logger.info(f"Detected split quantity in Dekos format: groups[2]='{unit_price_group}' contains '{trailing_num}', groups[3]='{quantity_group}' -> combined: '{combined_quantity_str}' -> quantity: {quantity}")
-                                        
-                                        # Also update unit_price if it wasn't extracted yet
-                                        if unit_price == 0:
-                                            # Remove the trailing number part from unit_price_str
-                                            cleaned_unit_price_str = re.sub(r'\s+\d+$', '', unit_price_group).strip()
-                                            decimal_match = re.search(r'[,\\.](\d+)$', cleaned_unit_price_str)
-                                            decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                                            if decimal_places == 4:
-                                                unit_price = extract_number(cleaned_unit_price_str)
-                                                logger.info(f"Updated unit_price from split quantity: '{unit_price_group}' -> cleaned: '{cleaned_unit_price_str}' -> unit_price: {unit_price}")
-                        
                         # Third pass: if quantity is still 0, check if description position has a number
                         # If description position (idx=1) has a number instead of text, use it as quantity
                         if quantity == 0 and len(groups) > 1:
@@ -2102,7 +5024,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                                 num_val = extract_number(desc_pos_value)
                                 if num_val > 0 and num_val <= 10000 and num_val != unit_price and num_val != line_total:
                                     quantity = num_val
-                                    logger.debug(f"Group 2 (description position, repurposed): {desc_pos_value} -> quantity: {quantity}")
+                                    trace("Group 2 (description position, repurposed): %s -> quantity: %s", desc_pos_value, quantity)
                         
                         # Fourth pass: if quantity is still 0, look for any unassigned numeric group
                         if quantity == 0:
@@ -2118,7 +5040,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                                     num_val = extract_number(group_str)
                                     if num_val > 0 and num_val != unit_price and num_val != line_total:
                                         quantity = num_val
-                                        logger.debug(f"Group {idx+1} (fallback quantity from description pos): {group_str} -> quantity: {quantity}")
+                                        trace("Group %s (fallback quantity from description pos): %s -> quantity: %s", idx+1, group_str, quantity)
                                         break
                                 if group_str.isdigit() and extract_number(group_str) >= 10 and extract_number(group_str) <= 25:
                                     continue  # Probably VAT rate
@@ -2126,70 +5048,11 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                                 # Check if this looks like quantity (smaller number, early position)
                                 num_val = extract_number(group_str)
                                 if num_val > 0 and num_val <= 10000 and num_val != unit_price and num_val != line_total:
-                                    # For Dekos format, check decimal places
-                                    if is_dekos_format:
-                                        decimal_match = re.search(r'[,\\.](\d+)$', group_str.strip())
-                                        decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                                        
-                                        # Quantity should have 3 decimals (e.g., "8,000" or "1 000,000") or be integer
-                                        # Should NOT have 4 decimals (that's unit_price) or 2 decimals (that's line_total)
-                                        if decimal_places == 3 or decimal_places == 0:
-                                            # If it's in position 3 (expected quantity position) or if it's reasonable for quantity
-                                            # Also check: if groups[3] was 0, and this value is reasonable, it might be quantity
-                                            if idx == 3 or (idx <= 3 and (unit_price == 0 or num_val < unit_price)) or (num_val >= 10 and num_val < line_total if line_total > 0 else True):
-                                                quantity = num_val
-                                                logger.debug(f"Group {idx+1} (fallback, Dekos): '{group_str}' -> quantity: {quantity} ({decimal_places} decimals, position {idx})")
-                                                break
-                                        # Explicitly skip if it has 4 decimals (unit_price) or 2 decimals (line_total)
-                                        elif decimal_places == 4:
-                                            logger.debug(f"Group {idx+1} (fallback, Dekos): '{group_str}' -> skipping quantity (has 4 decimals, likely unit_price)")
-                                            continue
-                                        elif decimal_places == 2:
-                                            logger.debug(f"Group {idx+1} (fallback, Dekos): '{group_str}' -> skipping quantity (has 2 decimals, likely line_total)")
-                                            continue
-                                        # Special case: if groups[3] was 0, and we have a number that could be quantity, use it
-                                        # But make sure it's not line_total (line_total has 2 decimals) or unit_price (unit_price has 4 decimals)
-                                        elif decimal_places != 2 and decimal_places != 4 and num_val > 0 and (idx == 3 or num_val < line_total if line_total > 0 else True):
-                                            # This might be quantity if groups[3] was 0
-                                            quantity = num_val
-                                            logger.debug(f"Group {idx+1} (fallback, Dekos, special case): '{group_str}' -> quantity: {quantity} ({decimal_places} decimals, position {idx})")
-                                            break
-                                    else:
-                                        # Standard format: if it's in an early position (0-3) or smaller than unit_price, it's likely quantity
-                                        if idx <= 3 or (unit_price > 0 and num_val < unit_price):
-                                            quantity = num_val
-                                            logger.debug(f"Group {idx+1} (fallback): '{group_str}' -> quantity: {quantity}")
-                                            break
-                        
-                        # Fifth pass: if unit_price is still 0, look for any unassigned numeric group with 4 decimals (Dekos format)
-                        if unit_price == 0 and is_dekos_format:
-                            for idx, group_str in enumerate(groups):
-                                if not group_str:
-                                    continue
-                                group_str = str(group_str).strip()
-                                
-                                # Skip if already assigned or is code/quantity/vat_rate/line_total
-                                if idx == 0 and group_str == product_code:
-                                    continue
-                                if group_str.isdigit() and extract_number(group_str) >= 10 and extract_number(group_str) <= 25:
-                                    continue  # Probably VAT rate
-                                
-                                # Check if this looks like unit_price (4 decimals for Dekos)
-                                num_val = extract_number(group_str)
-                                if idx == 3 and num_val == quantity and quantity > 0:
-                                    continue  # Skip quantity
-                                if idx == 6 and num_val == line_total and line_total > 0:
-                                    continue  # Skip line_total
-                                if num_val > 0 and num_val != quantity and num_val != line_total:
-                                    decimal_match = re.search(r'[,\\.](\d+)$', group_str.strip())
-                                    decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                                    # Unit_price should have 4 decimals for Dekos, or be integer
-                                    if decimal_places == 4 or decimal_places == 0:
-                                        # If it's in position 2 (expected unit_price position) or larger than quantity, it's likely unit_price
-                                        if idx == 2 or (quantity > 0 and num_val > quantity):
-                                            unit_price = num_val
-                                            logger.debug(f"Group {idx+1} (fallback unit_price, Dekos): {group_str} -> unit_price: {unit_price} ({decimal_places} decimals)")
-                                            break
+                                    # Standard format: if it's in an early position (0-3) or smaller than unit_price, it's likely quantity
+                                    if idx <= 3 or (unit_price > 0 and num_val < unit_price):
+                                        quantity = num_val
+                                        trace("Group %s (fallback): '%s' -> quantity: %s", idx+1, group_str, quantity)
+                                        break
                         
                         # If we found product_code or at least some fields, use this format
                         if product_code or description or quantity > 0:
@@ -2201,16 +5064,16 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                             if len(groups) == 9 and quantity > 0 and unit_price > 0 and vat_rate:
                                 line_amount = quantity * unit_price
                                 calculated_line_total_with_vat = line_amount * (1 + vat_rate / 100)
-                                logger.info(f"Leco format detected (9 groups) - calculating line_amount: {quantity} * {unit_price} = {line_amount:.2f}")
-                                logger.info(f"Leco format detected (9 groups) - calculating line_total with VAT: {line_amount:.2f} * (1 + {vat_rate}/100) = {calculated_line_total_with_vat:.2f} (was: {line_total})")
+                                trace("Leco format detected (9 groups) - calculating line_amount: %s * %s = %.2f", quantity, unit_price, line_amount)
+                                trace("Leco format detected (9 groups) - calculating line_total with VAT: %.2f * (1 + %s/100) = %.2f (was: %s)", line_amount, vat_rate, calculated_line_total_with_vat, line_total)
                                 line_total = calculated_line_total_with_vat
                             elif len(groups) == 9 and quantity > 0 and unit_price > 0 and not vat_rate:
                                 # Fallback: calculate without VAT if vat_rate is missing
                                 line_amount = quantity * unit_price
-                                logger.warning(f"Leco format detected (9 groups) but vat_rate missing - calculating line_amount: {quantity} * {unit_price} = {line_amount:.2f}")
+                                trace("Leco format detected (9 groups) but vat_rate missing - calculating line_amount: %s * %s = %.2f", quantity, unit_price, line_amount)
                                 line_total = line_amount
                             
-                            logger.info(f"Extracting interactive labeling format ({len(groups)} groups) - code: {product_code}, description: {description}, quantity: {quantity} {unit_of_measure}, unit_price: {unit_price}, line_amount: {line_amount}, total: {line_total}, vat_rate: {vat_rate}, vat_amount: {vat_amount}, total_with_vat: {total_with_vat}")
+                            trace("Extracting interactive labeling format (%s groups) - code: %s, description: %s, quantity: %s %s, unit_price: %s, line_amount: %s, total: %s, vat_rate: %s, vat_amount: %s, total_with_vat: %s", len(groups), product_code, description, quantity, unit_of_measure, unit_price, line_amount, line_total, vat_rate, vat_amount, total_with_vat)
                             
                             # Apply code corrections if configured
                             corrected_code = apply_code_corrections(product_code, code_corrections) if product_code else None
@@ -2219,7 +5082,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                             description_corrections = table_columns.get('description_corrections', {})
                             corrected_description = apply_description_corrections(description, description_corrections) if description else None
                             
-                            return InvoiceItem(
+                            return ParsedItem(
                                 product_code=corrected_code,
                                 description=corrected_description,
                                 quantity=quantity,
@@ -2242,7 +5105,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     quantity_field = extract_number(groups[1]) if len(groups) > 1 else 0
                     line_total = extract_number(groups[6]) if len(groups) > 6 else 0
                     
-                    logger.info(f"Extracting 10-group MAKRO format - base_price: {base_price_val}, units_in_mu: {units_in_mu_val}")
+                    trace("Extracting 10-group MAKRO format - base_price: %s, units_in_mu: %s", base_price_val, units_in_mu_val)
                     
                     # Detect format: items starting with "*" are sold by weight (Format B)
                     is_weight_format = description and description.startswith('*')
@@ -2270,28 +5133,28 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         # Calculate total weight in kg
                         calculated_total_weight = count * weight_value
                         total_weight_kg = calculated_total_weight
-                        logger.info(f"Extracted multiplication pattern from description '{description}': {count} × {mult_match.group(2)}{unit} = {calculated_total_weight:.3f} kg")
+                        trace("Extracted multiplication pattern from description '%s': %s × %s%s = %.3f kg", description, count, mult_match.group(2), unit, calculated_total_weight)
                     
                     if is_weight_format:
                         # Format B: quantity field is actually total weight in kg
                         total_weight_kg = quantity_field
                         price_per_kg = base_price_val  # base_price is actually price per kg
                         quantity = 1  # No package count, just weight
-                        logger.info(f"Format B (by weight): total_weight={total_weight_kg} kg, price_per_kg={price_per_kg} Kč/kg")
+                        trace("Format B (by weight): total_weight=%s kg, price_per_kg=%s Kč/kg", total_weight_kg, price_per_kg)
                     elif package_weight_kg:
                         # Format A: calculate total weight based on units_in_mu or quantity
                         # If units_in_mu > 1, it means multiple units per package (e.g., "100g 12x" = 1.2 kg)
                         # If units_in_mu = 1, use quantity as package count
                         if units_in_mu_val and units_in_mu_val > 1:
                             total_weight_kg = package_weight_kg * units_in_mu_val
-                            logger.info(f"Format A (multi-unit package): {package_weight_kg} kg × {units_in_mu_val} units = {total_weight_kg:.3f} kg")
+                            trace("Format A (multi-unit package): %s kg × %s units = %.3f kg", package_weight_kg, units_in_mu_val, total_weight_kg)
                         elif quantity_field > 0:
                             total_weight_kg = package_weight_kg * quantity_field
-                            logger.info(f"Format A (by quantity): {package_weight_kg} kg × {quantity_field} packages = {total_weight_kg:.3f} kg")
+                            trace("Format A (by quantity): %s kg × %s packages = %.3f kg", package_weight_kg, quantity_field, total_weight_kg)
                         
                         if total_weight_kg and total_weight_kg > 0 and line_total > 0:
                             price_per_kg = line_total / total_weight_kg
-                            logger.info(f"Calculated price per kg: {price_per_kg:.2f} Kč/kg (total: {line_total}, weight: {total_weight_kg:.3f} kg)")
+                            trace("Calculated price per kg: %.2f Kč/kg (total: %s, weight: %.3f kg)", price_per_kg, line_total, total_weight_kg)
                     
                     # Apply code corrections if configured
                     raw_code = groups[0] if len(groups) > 0 else None
@@ -2301,7 +5164,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     description_corrections = table_columns.get('description_corrections', {})
                     corrected_description = apply_description_corrections(description, description_corrections) if description else None
                     
-                    return InvoiceItem(
+                    return ParsedItem(
                         product_code=corrected_code,
                         quantity=quantity,
                         description=corrected_description,
@@ -2328,7 +5191,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     
                     if is_fabio_format:
                         # FABIO format: description, quantity, unit, unit_price, line_amount, vat_rate, line_total
-                        logger.info(f"Detected FABIO format (7 groups) - line: {line[:80]}")
+                        trace("Detected FABIO format (7 groups) - line: %s", line[:80])
                         description = groups[0].strip() if len(groups) > 0 else None
                         quantity = extract_number(groups[1]) if len(groups) > 1 else 0
                         unit_of_measure = groups[2].strip().lower() if len(groups) > 2 else None
@@ -2337,13 +5200,13 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         vat_rate = extract_number(groups[5]) if len(groups) > 5 else None
                         line_total = extract_number(groups[6]) if len(groups) > 6 else 0  # Amount with VAT
                         
-                        logger.info(f"Extracting FABIO format - description: {description[:50] if description else None}, quantity: {quantity} {unit_of_measure}, unit_price: {unit_price}, line_amount: {line_amount}, vat_rate: {vat_rate}, line_total: {line_total}")
+                        trace("Extracting FABIO format - description: %s, quantity: %s %s, unit_price: %s, line_amount: %s, vat_rate: %s, line_total: %s", description[:50] if description else None, quantity, unit_of_measure, unit_price, line_amount, vat_rate, line_total)
                         
                         # Apply description corrections if configured
                         description_corrections = table_columns.get('description_corrections', {})
                         corrected_description = apply_description_corrections(description, description_corrections) if description else None
                         
-                        return InvoiceItem(
+                        return ParsedItem(
                             product_code=None,  # FABIO doesn't use product codes
                             description=corrected_description,
                             quantity=quantity,
@@ -2361,118 +5224,19 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     is_dekos_format = first_group and '.' in str(first_group) and re.match(r'^\d+\.\d+(-?\d*)?$', str(first_group))
                     
                     if is_dekos_format:
-                        # This is Dekos format - should have been handled by interactive labeling above
-                        # If we reach here, interactive labeling didn't extract fields correctly
-                        # Force use of interactive labeling logic by re-processing with Dekos field order
-                        logger.warning(f"Dekos format detected (code: {first_group}) but interactive labeling didn't extract fields correctly. Retrying with Dekos format detection.")
-                        
-                        # Re-process using Dekos format logic
+                        # Dekos format: code, description, unit_price, quantity, unit, vat_rate, line_total
+                        # The amounts are only read provisionally here - reconcile_amounts picks the reading of all
+                        # three that satisfies quantity × unit_price ≈ line_total (split "1 000,000", merged "51 108,1300")
                         product_code = first_group
                         description = groups[1].strip() if len(groups) > 1 else None
-                        unit_price = 0
-                        quantity = 0
-                        unit_of_measure = None
-                        vat_rate = None
-                        line_total = 0
-                        
-                        # Dekos format: code, description, unit_price, quantity, unit, vat_rate, line_total
-                        if len(groups) >= 3:
-                            # Check decimal places for unit_price (should have 4 decimals)
-                            # Unit_price may contain spaces or additional numbers (e.g., "1,6600 1")
-                            # Extract only the part before space or before any additional number
-                            unit_price_str = groups[2].strip() if len(groups) > 2 else ""
-                            
-                            # Special case: if unit_price_str contains "1,6600 1", it means quantity "1 000,000" is split
-                            # Pattern captured "1,6600 1" where "1" is the start of "1 000,000"
-                            # Check if groups[2] ends with a space and number, and groups[3] starts with "000,000"
-                            quantity_prefix = None
-                            if len(groups) >= 4:
-                                quantity_str_check = groups[3].strip() if len(groups) > 3 else ""
-                                # If groups[2] ends with space+number and groups[3] is "000,000", combine them
-                                if re.match(r'^000,000$', quantity_str_check):
-                                    # groups[2] probably contains "1,6600 1" where "1" is the start of "1 000,000"
-                                    # Extract the trailing number after space in groups[2]
-                                    trailing_match = re.search(r'\s+(\d+)$', unit_price_str)
-                                    if trailing_match:
-                                        trailing_num = trailing_match.group(1)
-                                        # Combine trailing_num + groups[3] to get full quantity: "1 000,000"
-                                        quantity_prefix = trailing_num
-                                        logger.debug(f"Detected split quantity: groups[2]='{groups[2]}' contains '{trailing_num}', groups[3]='{quantity_str_check}' -> quantity='{trailing_num} {quantity_str_check}'")
-                            
-                            # Remove any trailing numbers after space (e.g., "1,6600 1" → "1,6600")
-                            if quantity_prefix:
-                                # Remove the trailing number part (it belongs to quantity)
-                                unit_price_str = re.sub(r'\s+\d+$', '', unit_price_str).strip()
-                            
-                            decimal_match = re.search(r'[,\\.](\d+)$', unit_price_str)
-                            decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                            if decimal_places == 4:
-                                unit_price = extract_number(unit_price_str)
-                                logger.debug(f"Group 3 (unit_price): '{groups[2]}' -> cleaned: '{unit_price_str}' -> unit_price: {unit_price} (4 decimals)")
-                            else:
-                                logger.warning(f"Group 3 (unit_price): '{groups[2]}' -> cleaned: '{unit_price_str}' has {decimal_places} decimals, expected 4 for Dekos")
-                        
-                        if len(groups) >= 4:
-                            # Check decimal places for quantity (should have 3 decimals)
-                            # Quantity may contain spaces between thousands (e.g., "1 000,000")
-                            quantity_str = groups[3].strip() if len(groups) > 3 else ""
-                            
-                            # If quantity_prefix was found, combine it with groups[3] to get full quantity
-                            if quantity_prefix:
-                                quantity_str = f"{quantity_prefix} {quantity_str}"
-                                logger.debug(f"Combining quantity: '{quantity_prefix}' + '{groups[3]}' -> '{quantity_str}'")
-                            
-                            # For Czech format, spaces are thousands separators, so extract_number will handle them correctly
-                            decimal_match = re.search(r'[,\\.](\d+)$', quantity_str)
-                            decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                            quantity_val = extract_number(quantity_str)
-                            if quantity_val > 0 and (decimal_places == 3 or decimal_places == 0):
-                                quantity = quantity_val
-                                logger.debug(f"Group 4 (quantity): '{groups[3]}' -> full: '{quantity_str}' -> quantity: {quantity} ({decimal_places} decimals)")
-                            elif quantity_val == 0:
-                                # If groups[3] is 0, try to find quantity elsewhere
-                                # Look for a number that could be quantity (has 3 decimals or integer, not 2 decimals)
-                                # Quantity may have spaces between thousands (e.g., "1 000,000")
-                                logger.debug(f"Group 4 (quantity position) is 0, looking for quantity elsewhere")
-                                for check_idx in range(len(groups)):
-                                    if check_idx == 3:
-                                        continue  # Skip position 3 (quantity position, already checked)
-                                    check_group = groups[check_idx].strip() if check_idx < len(groups) else ""
-                                    if not check_group:
-                                        continue
-                                    # For Czech format, spaces are thousands separators
-                                    check_decimal_match = re.search(r'[,\\.](\d+)$', check_group)
-                                    check_decimal_places = len(check_decimal_match.group(1)) if check_decimal_match else 0
-                                    check_val = extract_number(check_group)
-                                    # Quantity should have 3 decimals or be integer, but NOT 2 decimals (that's line_total)
-                                    if check_val > 0 and check_val <= 10000 and check_decimal_places != 2 and (check_decimal_places == 3 or check_decimal_places == 0):
-                                        # Check if it's not unit_price (unit_price has 4 decimals)
-                                        if check_decimal_places != 4:
-                                            quantity = check_val
-                                            logger.debug(f"Group {check_idx+1} (fallback for quantity): '{check_group}' -> quantity: {quantity} ({check_decimal_places} decimals)")
-                                            break
-                        
-                        if len(groups) >= 5:
-                            unit_of_measure = groups[4].strip() if len(groups) > 4 else None
-                        
-                        if len(groups) >= 6:
-                            vat_rate = extract_number(groups[5]) if len(groups) > 5 else None
-                        
-                        if len(groups) >= 7:
-                            # Check decimal places for line_total (should have 2 decimals)
-                            line_total_str = groups[6].strip() if len(groups) > 6 else ""
-                            decimal_match = re.search(r'[,\\.](\d+)$', line_total_str)
-                            decimal_places = len(decimal_match.group(1)) if decimal_match else 0
-                            if decimal_places == 2:
-                                line_total = extract_number(line_total_str)
-                                logger.debug(f"Group 7 (line_total): {line_total_str} -> line_total: {line_total} (2 decimals - Dekos format)")
-                            elif decimal_places == 0:
-                                # Integer line_total is also valid (fallback)
-                                line_total = extract_number(line_total_str)
-                                logger.debug(f"Group 7 (line_total): {line_total_str} -> line_total: {line_total} (integer - Dekos format)")
-                            else:
-                                logger.warning(f"Group 7 (line_total): {line_total_str} has {decimal_places} decimals, expected 2 for Dekos format")
-                                line_total = extract_number(line_total_str)  # Use anyway as fallback
+                        amounts = tuple(
+                            (field, groups[index], decimals)
+                            for field, index, decimals in DEKOS_AMOUNT_COLUMNS
+                            if index < len(groups) and groups[index]
+                        )
+                        provisional = {field: extract_number(text) for field, text, _ in amounts}
+                        unit_of_measure = groups[4].strip() if len(groups) > 4 else None
+                        vat_rate = extract_number(groups[5]) if len(groups) > 5 else None
                         
                         # Apply code corrections
                         corrected_code = apply_code_corrections(product_code, code_corrections) if product_code else None
@@ -2481,40 +5245,18 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         description_corrections = table_columns.get('description_corrections', {})
                         corrected_description = apply_description_corrections(description, description_corrections) if description else None
                         
-                        logger.info(f"Extracting Dekos format (fallback) - code: {corrected_code}, description: {corrected_description}, quantity: {quantity} {unit_of_measure}, unit_price: {unit_price}, total: {line_total}, vat_rate: {vat_rate}")
-                        
-                        # Check for ambiguous OCR pattern: capacity indicator + potential thousands separator
-                        # Pattern: description ending with "5L" and unit_price starting with "51" (e.g., "STOP BAKTER 5L" + "51 108,1300")
-                        # This could mean: OCR correctly captured "5L" but also the thousands separator looks suspicious
-                        matching_confidence = 100
-                        if corrected_description and unit_price:
-                            # Check if description ends with capacity indicator (digit + L or I)
-                            capacity_match = re.search(r'(\d)[LI]\s*$', corrected_description)
-                            if capacity_match:
-                                # Check if unit_price starts with a 2-digit number ending in 1
-                                price_str = str(unit_price).replace(',', '').replace('.', '').replace(' ', '')
-                                if price_str and len(price_str) >= 2:
-                                    # Get first 2 digits
-                                    first_two = price_str[:2]
-                                    if first_two.endswith('1'):
-                                        digit_before = capacity_match.group(1)
-                                        # If they match (e.g., "5L" and price starts with "51"), it's ambiguous
-                                        if first_two == f"{digit_before}1":
-                                            matching_confidence = 75
-                                            logger.warning(f"⚠️  Ambiguous OCR pattern detected: description ends with '{capacity_match.group(0)}' and unit_price starts with '{first_two}...'")
-                                            logger.warning(f"   This could be: 1) Correct (5L + price 51,108), or 2) OCR duplicate (5L read as both '5L' and '51')")
-                                            logger.warning(f"   Confidence reduced to {matching_confidence}% - MANUAL REVIEW RECOMMENDED")
+                        trace("Extracting Dekos format - code: %s, description: %s, unit: %s, vat_rate: %s, amounts: %s", corrected_code, corrected_description, unit_of_measure, vat_rate, [text for _, text, _ in amounts])
                         
-                        return InvoiceItem(
+                        return ParsedItem(
                             product_code=corrected_code,
                             description=corrected_description,
-                            quantity=quantity,
+                            quantity=provisional.get('quantity', 0),
                             unit_of_measure=unit_of_measure,
-                            unit_price=unit_price,
-                            line_total=line_total,
+                            unit_price=provisional.get('unit_price', 0),
+                            line_total=provisional.get('line_total', 0),
                             vat_rate=vat_rate,
                             line_number=line_number,
-                            matching_confidence=matching_confidence,
+                            amounts=amounts,
                         )
                     
                     # MAKRO format: 7 captures (without VAT columns)
@@ -2523,13 +5265,13 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     base_price_val = extract_number(groups[3]) if len(groups) > 3 else None
                     units_in_mu_val = extract_number(groups[4]) if len(groups) > 4 else None
                     
-                    logger.info(f"Extracting 7-group MAKRO format - base_price: {base_price_val}, units_in_mu: {units_in_mu_val}")
+                    trace("Extracting 7-group MAKRO format - base_price: %s, units_in_mu: %s", base_price_val, units_in_mu_val)
                     
                     # Apply code corrections if configured
                     raw_code = groups[0] if len(groups) > 0 else None
                     corrected_code = apply_code_corrections(raw_code, code_corrections) if raw_code else None
                     
-                    return InvoiceItem(
+                    return ParsedItem(
                         product_code=corrected_code,
                         quantity=extract_number(groups[1]) if len(groups) > 1 else 0,
                         description=groups[2].strip() if len(groups) > 2 else None,
@@ -2561,12 +5303,12 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     description_corrections = table_columns.get('description_corrections', {})
                     corrected_weight = apply_description_corrections(weight_raw, description_corrections) if weight_raw else None
                     
-                    logger.info(f"Extracting Albert format (4 groups) - description: {description}, weight: {weight_raw} → {corrected_weight}, unit_price: {unit_price}, vat_letter: {vat_letter} ({vat_rate}%)")
+                    trace("Extracting Albert format (4 groups) - description: %s, weight: %s → %s, unit_price: %s, vat_letter: %s (%s%%)", description, weight_raw, corrected_weight, unit_price, vat_letter, vat_rate)
                     
                     # Apply description corrections to name as well
                     corrected_description = apply_description_corrections(description, description_corrections) if description else None
                     
-                    return InvoiceItem(
+                    return ParsedItem(
                         product_code=None,  # No product codes for Albert
                         description=corrected_description,
                         quantity=quantity,
@@ -2588,7 +5330,7 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                     raw_description = groups[1] if len(groups) > 1 else None
                     corrected_description = apply_description_corrections(raw_description, description_corrections) if raw_description else None
                     
-                    return InvoiceItem(
+                    return ParsedItem(
                         product_code=corrected_code,
                         description=corrected_description,
                         quantity=extract_number(groups[2]) if len(groups) > 2 else 0,
@@ -2598,11 +5340,11 @@ def extract_item_from_line(line: str, table_columns: Dict, line_number: int) ->
                         line_number=line_number,
                     )
         except Exception as e:
-            logger.error(f"Error matching line pattern: {e}")
+            logger.error("Error matching line pattern: %s", e)
         return None
     
     # No pattern configured or pattern did not match - return None
-    logger.warning(f"❌ No pattern configured or pattern did not match for line: {line[:80]}")
+    trace("❌ No pattern configured or pattern did not match for line: %s", line[:80])
     return None
 
 def calculate_confidence(extracted_data: Dict) -> float:
@@ -2634,17 +5376,19 @@ def calculate_confidence(extracted_data: Dict) -> float:
             )
             score += (complete_items / len(items)) * 60
         except Exception as e:
-            logger.error(f"Error calculating item completeness: {e}")
-            logger.error(f"  items type: {type(items)}")
-            logger.error(f"  items length: {len(items)}")
+            logger.error("Error calculating item completeness: %s", e)
+            logger.error("  items type: %s", type(items))
+            logger.error("  items length: %s", len(items))
             if items and len(items) > 0:
-                logger.error(f"  first item type: {type(items[0])}")
-                logger.error(f"  first item value: {items[0]}")
+                logger.error("  first item type: %s", type(items[0]))
+                logger.error("  first item value: %s", items[0])
             # Fallback: give partial score if we have items at all
             score += 30
     
     return (score / max_score) * 100 if max_score > 0 else 0
 
+startup['import_seconds']['main'] = round(time.perf_counter() - _import_started, 3)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
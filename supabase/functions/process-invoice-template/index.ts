@@ -80,8 +80,10 @@ serve(async (req) => {
     });
     
     // Add timeout handling for fetch request (30 seconds)
+    // The same budget is sent as X-Deadline-Ms so the OCR service stops working once we stop waiting
+    const ocrTimeoutMs = 30000;
     const controller = new AbortController();
-    const timeoutId = setTimeout(() => controller.abort(), 30000);
+    const timeoutId = setTimeout(() => controller.abort(), ocrTimeoutMs);
     
     let ocrResponse;
     try {
@@ -89,11 +91,13 @@ serve(async (req) => {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'X-Deadline-Ms': String(ocrTimeoutMs),
         },
         body: JSON.stringify({
           file_base64: base64File,
           file_name: fileName,
           template_config: template.config,
+          supplier_id: supplierId,  // Scopes supplier code matching in the OCR service's ingredient index
         }),
         signal: controller.signal,
       });
@@ -282,6 +286,23 @@ async function matchIngredientsWithCodes(
   for (const item of items) {
     const productCode = item.product_code?.trim();
     const description = item.description?.trim();
+
+    // Candidates from the OCR service's ingredient index (present when the index is loaded) - no DB round trips
+    const best = item.ingredient_candidates?.[0];
+    if (best && (best.match === 'code' || best.match === 'code_variant')) {
+      matchedItems.push({
+        ...item,
+        matched_ingredient_id: best.ingredient_id,
+        matched_ingredient_name: best.name,
+        matched_ingredient_unit: best.unit,
+        matched_ingredient_category: best.category_id,
+        match_status: best.match === 'code' ? 'exact' : 'fuzzy',
+        match_confidence: best.score,
+      });
+      continue;
+    }
+    // A name match only suggests - the supplier's own codes below are still looked up first
+    const indexSuggestion = best && best.score > 0.4 ? best : null;
     
     // For items without product_code (e.g., FABIO, Albert), try matching by description
     if (!productCode) {
@@ -344,6 +365,18 @@ async function matchIngredientsWithCodes(
         continue;
       }
 
+      // The index already scored every ingredient name - no need to fetch and score them here
+      if (indexSuggestion) {
+        matchedItems.push({
+          ...item,
+          suggested_ingredient_id: indexSuggestion.ingredient_id,
+          suggested_ingredient_name: indexSuggestion.name,
+          match_status: 'suggested',
+          match_confidence: indexSuggestion.score,
+        });
+        continue;
+      }
+
       // STEP 3: Get all ingredient mappings for similarity-based fuzzy matching
       // Search ALL suppliers for better suggestions (not just current supplier)
       const { data: allIngredients, error: allError } = await supabase
@@ -556,8 +589,10 @@ async function matchIngredientsWithCodes(
       }
     }
 
-    // No match found - suggest based on product code and description
-    const suggestion = await suggestIngredient(supabase, productCode, item.description, supplierId);
+    // No match found - suggest based on product code and description (the index candidate when there is one)
+    const suggestion = indexSuggestion
+      ? { id: indexSuggestion.ingredient_id, name: indexSuggestion.name, confidence: indexSuggestion.score }
+      : await suggestIngredient(supabase, productCode, item.description, supplierId);
     
     matchedItems.push({
       ...item,